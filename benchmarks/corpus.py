@@ -0,0 +1,80 @@
+import os
+import random
+
+import pymupdf
+from langchain_core.documents import Document
+
+# Words for synthetic rules text, so keyword and vector searches have something to find
+VOCABULARY = """
+ability action advantage attack bonus check class combat condition creature d4 d6
+d8 d10 d12 d20 damage DC dexterity disadvantage dungeon effect enemy feat fighter
+grapple hit initiative level magic modifier movement opportunity proficiency range
+reaction rest roll rogue round saving sneak speed spell strength target throw turn
+weapon wisdom wizard
+""".split()
+SENTENCE_WORDS = (6, 18)
+PARAGRAPH_SENTENCES = (3, 7)
+PAGE_MARGIN = 50
+
+
+def sentence(rng: random.Random) -> str:
+    """Get a random sentence of rules vocabulary"""
+    words = rng.choices(VOCABULARY, k=rng.randint(*SENTENCE_WORDS))
+    return " ".join(words).capitalize() + "."
+
+
+def page_text(rng: random.Random, paragraphs: int) -> str:
+    """Get the text of a page of random paragraphs"""
+    return "\n\n".join(
+        " ".join(sentence(rng) for _ in range(rng.randint(*PARAGRAPH_SENTENCES)))
+        for _ in range(paragraphs)
+    )
+
+
+def make_corpus(
+    directory: str, files: int, pages: int, paragraphs: int = 6, seed: int = 0
+) -> list[str]:
+    """
+    Write PDFs of random rules text. The same seed always gives the same text, so
+    runs can be compared. Returns the paths of the files.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+
+    paths = []
+    for number in range(files):
+        path = os.path.join(directory, f"rules_{number:03}.pdf")
+        doc = pymupdf.open()
+        for _ in range(pages):
+            page = doc.new_page()
+            rect = page.rect + (PAGE_MARGIN, PAGE_MARGIN, -PAGE_MARGIN, -PAGE_MARGIN)
+            page.insert_textbox(rect, page_text(rng, paragraphs), fontsize=9)
+        doc.save(path)
+        doc.close()
+        paths.append(path)
+    return paths
+
+
+def make_pages(count: int, seed: int = 0) -> list[Document]:
+    """Get pages of random rules text without writing PDFs, a paragraph each"""
+    rng = random.Random(seed)
+    return [
+        Document(
+            page_content=page_text(rng, paragraphs=1),
+            metadata={"source": f"rules_{i // 100:03}.pdf", "page": i % 100},
+        )
+        for i in range(count)
+    ]
+
+
+def make_queries(count: int, seed: int = 0) -> list[str]:
+    """Get random questions, and some short keyword queries"""
+    rng = random.Random(seed)
+    return [
+        (
+            " ".join(rng.choices(VOCABULARY, k=2))
+            if i % 2
+            else f"How does {' '.join(rng.choices(VOCABULARY, k=4))} work?"
+        )
+        for i in range(count)
+    ]
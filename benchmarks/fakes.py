@@ -0,0 +1,159 @@
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Iterator, Sequence
+from uuid import uuid4
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessageChunk,
+    BaseMessage,
+    HumanMessage,
+    message_chunk_to_message,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool
+
+DEFAULT_ANSWER = (
+    "Roll a d20 and add your modifier. If the total equals or exceeds the DC, "
+    "the check succeeds. Otherwise it fails, and the game master describes "
+    "what happens next."
+)
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """
+    Deterministic embedder that waits like a server would, for a fixed time per
+    request plus a time per text.
+    """
+
+    request_latency: float = 0.0
+    text_latency: float = 0.0
+
+    def _delay(self, count: int) -> float:
+        return self.request_latency + self.text_latency * count
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        time.sleep(self._delay(len(texts)))
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self._delay(1))
+        return super().embed_query(text)
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        await asyncio.sleep(self._delay(len(texts)))
+        return super().embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        await asyncio.sleep(self._delay(1))
+        return super().embed_query(text)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model that streams a fixed answer a word at a time, after a delay before
+    the first token and at a given number of tokens per second. With tools bound,
+    it answers a question by calling the first tool with it, like the agent would.
+    """
+
+    answer: str = DEFAULT_ANSWER
+    first_token_latency: float = 0.0
+    tokens_per_second: float = 0.0  # 0 streams as fast as possible
+    tool_name: str | None = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def bind_tools(self, tools: Sequence[BaseTool], **kwargs: Any) -> "FakeChatModel":
+        return self.model_copy(update={"tool_name": tools[0].name if tools else None})
+
+    def _chunks(self, messages: list[BaseMessage]) -> list[AIMessageChunk]:
+        """Get the chunks of the response to the messages"""
+        if self.tool_name and isinstance(messages[-1], HumanMessage):
+            args = json.dumps({"query": messages[-1].content})
+            return [
+                AIMessageChunk(
+                    content="",
+                    tool_call_chunks=[
+                        {
+                            "name": self.tool_name,
+                            "args": args,
+                            "id": f"call_{uuid4().hex}",
+                            "index": 0,
+                        }
+                    ],
+                )
+            ]
+
+        words = self.answer.split(" ")
+        return [
+            AIMessageChunk(content=word if i == 0 else " " + word)
+            for i, word in enumerate(words)
+        ]
+
+    @property
+    def _token_delay(self) -> float:
+        return 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        chunks = [chunk.message for chunk in self._stream(messages, stop, run_manager)]
+        message = message_chunk_to_message(sum(chunks[1:], chunks[0]))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        chunks = [
+            chunk.message async for chunk in self._astream(messages, stop, run_manager)
+        ]
+        message = message_chunk_to_message(sum(chunks[1:], chunks[0]))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: CallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                time.sleep(self._token_delay)
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content, chunk=generation)
+            yield generation
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: list[str] | None = None,
+        run_manager: AsyncCallbackManagerForLLMRun | None = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                await asyncio.sleep(self._token_delay)
+            generation = ChatGenerationChunk(message=chunk)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content, chunk=generation)
+            yield generation
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import os
+import platform
+import statistics
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+
+import click
+from langchain_community.document_loaders import PyMuPDFLoader
+
+import rag_store
+from benchmarks.corpus import make_corpus, make_pages, make_queries
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+from rag_store import RagStore, RagStores, split_pages
+from utils import Config, count_tokens
+from workflows import LLM
+
+BENCHMARKS = ("parse", "ingest", "retrieval", "answer")
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+EMBEDDING_SIZE = 256
+
+
+def make_config(work_dir: str, name: str, backend: str = "chroma") -> Config:
+    """
+    Get a config that keeps everything in the work directory, with caches,
+    conversation memory and traces off
+    """
+    return Config(
+        _env_file=None,
+        chat_model="fake",
+        chat_provider="fake",
+        chat_api_key="fake",
+        embedding_model="fake",
+        pdf_dir=os.path.join(work_dir, "pdfs"),
+        chroma_collection_name=name,
+        chroma_path=os.path.join(work_dir, name),
+        vector_backend=backend,
+        answer_cache_size=0,
+        retrieval_cache_size=0,
+        memory_path=None,
+        trace_path=None,
+    )
+
+
+def open_store(config: Config, embeddings: FakeEmbeddings) -> RagStore:
+    """Open a new store that embeds with the fake embedder"""
+    store = RagStore(config, rag_store.get_client(config))
+    store.embedder.embeddings = embeddings
+    return store
+
+
+def latency_stats(latencies: list[float]) -> dict[str, float]:
+    """Get the median, 95th percentile and mean of latencies, in milliseconds"""
+    if len(latencies) < 2:
+        latencies = latencies * 2
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": percentiles[49] * 1000,
+        "p95_ms": percentiles[94] * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+    }
+
+
+def bench_parse(paths: list[str]) -> dict[str, float]:
+    """Parse and split PDFs in this process, as each worker does"""
+    pages = chunks = 0
+    start = perf_counter()
+    for path in paths:
+        loaded = list(PyMuPDFLoader(path).lazy_load())
+        pages += len(loaded)
+        chunks += len(split_pages(loaded))
+    seconds = perf_counter() - start
+    return {
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": seconds,
+        "pages_per_second": pages / seconds,
+    }
+
+
+async def bench_ingest(
+    work_dir: str, embeddings: FakeEmbeddings, pages: int, backend: str
+) -> dict[str, float]:
+    """Load the corpus through the whole pipeline: parse, split, embed and write"""
+    store = open_store(make_config(work_dir, "ingest", backend), embeddings)
+    chunks = 0
+
+    def update_func(total: int | None = None, advance: int = 0):
+        nonlocal chunks
+        chunks += advance
+
+    start = perf_counter()
+    await store.load(update_func)
+    seconds = perf_counter() - start
+    return {
+        "pages": pages,
+        "chunks": chunks,
+        "seconds": seconds,
+        "pages_per_second": pages / seconds,
+        "chunks_per_second": chunks / seconds,
+    }
+
+
+async def bench_retrieval(
+    work_dir: str,
+    embeddings: FakeEmbeddings,
+    sizes: list[int],
+    queries: list[str],
+    backend: str,
+) -> dict[str, dict]:
+    """
+    Measure search latency for each retrieval mode as the collection grows, the
+    tokens of rules each search would send to the model, and the time to open it
+    """
+    results = {}
+    for size in sizes:
+        config = make_config(work_dir, f"retrieval-{size}", backend)
+        await open_store(config, embeddings).load_pages(
+            make_pages(size), lambda **kwargs: None
+        )
+
+        start = perf_counter()
+        store = open_store(config, embeddings)
+        open_ms = (perf_counter() - start) * 1000
+
+        results[str(size)] = {"chunks": store.get_count(), "open_ms": open_ms}
+        for mode in RETRIEVAL_MODES:
+            store.retriever.mode = mode
+            latencies = []
+            tokens = []
+            for query in queries:
+                start = perf_counter()
+                docs = await store.retriever.ainvoke(query)
+                latencies.append(perf_counter() - start)
+                tokens.append(sum(count_tokens(doc.page_content) for doc in docs))
+            results[str(size)][mode] = latency_stats(latencies) | {
+                "context_tokens": statistics.fmean(tokens)
+            }
+    return results
+
+
+async def bench_answer(
+    work_dir: str,
+    embeddings: FakeEmbeddings,
+    chat_model: FakeChatModel,
+    questions: list[str],
+    backend: str,
+) -> dict[str, dict]:
+    """Measure time to first token and total time to answer through the graph"""
+    config = make_config(work_dir, "ingest", backend)
+    RagStores.clear()
+    stores = RagStores(config, rag_store.get_client(config))
+    stores.embedder.embeddings = embeddings
+    LLM.clear()
+    llm = LLM(config, stores, chat_model=chat_model)
+    await llm.initialize_workflow()
+
+    first_tokens = []
+    totals = []
+    for question in questions:
+        first_token = None
+        start = perf_counter()
+
+        def update_func(text: str):
+            nonlocal first_token
+            if first_token is None:
+                first_token = perf_counter() - start
+
+        await llm.stream_response(question, update_func)
+        totals.append(perf_counter() - start)
+        first_tokens.append(first_token if first_token is not None else totals[-1])
+    return {
+        "time_to_first_token": latency_stats(first_tokens),
+        "total": latency_stats(totals),
+    }
+
+
+async def run(
+    work_dir: str,
+    benchmarks: tuple[str, ...],
+    files: int,
+    pages: int,
+    sizes: list[int],
+    queries: int,
+    embedding_latency: float,
+    embedding_text_latency: float,
+    first_token_latency: float,
+    tokens_per_second: float,
+    backend: str,
+    seed: int,
+) -> dict:
+    """Run the benchmarks, and get their results"""
+    embeddings = FakeEmbeddings(
+        size=EMBEDDING_SIZE,
+        request_latency=embedding_latency,
+        text_latency=embedding_text_latency,
+    )
+    chat_model = FakeChatModel(
+        first_token_latency=first_token_latency, tokens_per_second=tokens_per_second
+    )
+    questions = make_queries(queries, seed)
+    paths = make_corpus(os.path.join(work_dir, "pdfs"), files, pages, seed=seed)
+
+    results: dict[str, dict] = {}
+    if "parse" in benchmarks:
+        results["parse"] = bench_parse(paths)
+
+    # Answers are retrieved from the ingested corpus
+    if "ingest" in benchmarks or "answer" in benchmarks:
+        results["ingest"] = await bench_ingest(
+            work_dir, embeddings, files * pages, backend
+        )
+    if "retrieval" in benchmarks:
+        results["retrieval"] = await bench_retrieval(
+            work_dir, embeddings, sizes, questions, backend
+        )
+    if "answer" in benchmarks:
+        results["answer"] = await bench_answer(
+            work_dir, embeddings, chat_model, questions, backend
+        )
+    return results
+
+
+@click.command()
+@click.option("--output", "-o", type=click.Path(dir_okay=False), help="JSON file")
+@click.option("--only", "benchmarks", multiple=True, type=click.Choice(BENCHMARKS))
+@click.option("--files", default=4, show_default=True, help="PDFs in the corpus")
+@click.option("--pages", default=25, show_default=True, help="Pages per PDF")
+@click.option(
+    "--sizes",
+    default="1000,5000",
+    show_default=True,
+    help="Comma-separated chunk counts for the retrieval benchmark",
+)
+@click.option("--queries", default=50, show_default=True, help="Queries per run")
+@click.option(
+    "--embedding-latency",
+    default=0.01,
+    show_default=True,
+    help="Seconds per embedding request",
+)
+@click.option(
+    "--embedding-text-latency",
+    default=0.001,
+    show_default=True,
+    help="Seconds per text embedded",
+)
+@click.option(
+    "--first-token-latency",
+    default=0.2,
+    show_default=True,
+    help="Seconds before the chat model's first token",
+)
+@click.option(
+    "--tokens-per-second",
+    default=50.0,
+    show_default=True,
+    help="Chat model tokens per second, or 0 for no limit",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(["chroma", "numpy"]),
+    default="chroma",
+    show_default=True,
+    help="Where to keep the vectors of chunks",
+)
+@click.option("--seed", default=0, show_default=True)
+def main(output, benchmarks, sizes, **options):
+    """Run the benchmarks offline with fake models, and print the results as JSON"""
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = asyncio.run(
+            run(
+                work_dir,
+                benchmarks or BENCHMARKS,
+                sizes=[int(size) for size in sizes.split(",")],
+                **options,
+            )
+        )
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {"benchmarks": benchmarks or BENCHMARKS, "sizes": sizes}
+        | options,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    click.echo(text)
@@ -0,0 +1,261 @@
+import itertools
+import json
+import platform
+import statistics
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+
+import chromadb
+import click
+import numpy as np
+
+import rag_store
+from utils import Config
+
+SYNTHETIC_SIZE = 256  # Dimensions of synthetic vectors
+SYNTHETIC_CLUSTERS = 50  # Topics the synthetic vectors are grouped around
+SYNTHETIC_SPREAD = 0.5  # How far synthetic vectors are from their topic's center
+READ_BATCH_SIZE = 1000  # Vectors to read from the collection at a time
+
+
+def load_vectors(
+    config: Config, client: chromadb.ClientAPI, game: str | None = None
+) -> np.ndarray:
+    """
+    Read the embeddings of a game's chunks, or of every game's and those outside
+    them if no game is given
+    """
+    games = [game] if game is not None else [None, *rag_store.get_games(config)]
+    names = set(client.list_collections())
+    batches = []
+    for name in (rag_store.collection_name(config, game) for game in games):
+        if name not in names:
+            continue
+        collection = client.get_collection(name)
+        for offset in itertools.count(0, READ_BATCH_SIZE):
+            results = collection.get(
+                include=["embeddings"], limit=READ_BATCH_SIZE, offset=offset
+            )
+            if not results["ids"]:
+                break
+            batches.append(np.asarray(results["embeddings"], dtype=np.float32))
+    if not batches:
+        raise click.ClickException(
+            "The collections are empty. Load PDFs first, or use --source synthetic"
+        )
+    return np.concatenate(batches)
+
+
+def make_vectors(count: int, size: int = SYNTHETIC_SIZE, seed: int = 0) -> np.ndarray:
+    """Get random vectors grouped around topics, roughly as embeddings of rules are"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(SYNTHETIC_CLUSTERS, size))
+    topics = rng.integers(SYNTHETIC_CLUSTERS, size=count)
+    vectors = centers[topics] + rng.normal(scale=SYNTHETIC_SPREAD, size=(count, size))
+    return vectors.astype(np.float32)
+
+
+def split_queries(
+    vectors: np.ndarray, count: int, seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    """Hold out some vectors to search with, so queries aren't in the index"""
+    order = np.random.default_rng(seed).permutation(len(vectors))
+    return vectors[order[count:]], vectors[order[:count]]
+
+
+def exact_neighbors(
+    corpus: np.ndarray, queries: np.ndarray, k: int, space: str
+) -> np.ndarray:
+    """Get the positions of each query's k nearest vectors, by searching them all"""
+    if space == "cosine":
+        corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    scores = queries @ corpus.T
+    if space == "l2":
+        # The query's own length doesn't change the order
+        scores = 2 * scores - (corpus**2).sum(axis=1)
+
+    k = min(k, corpus.shape[0])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(
+        top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1
+    )
+
+
+def build_index(
+    client: chromadb.ClientAPI,
+    corpus: np.ndarray,
+    space: str,
+    m: int,
+    construction_ef: int,
+    search_ef: int,
+) -> tuple[chromadb.Collection, float]:
+    """Build a collection's index with the given settings. Returns it and the seconds"""
+    name = f"tune-{space}-{m}-{construction_ef}-{search_ef}"
+    collection = client.create_collection(
+        name,
+        metadata={
+            "hnsw:space": space,
+            "hnsw:M": m,
+            "hnsw:construction_ef": construction_ef,
+            "hnsw:search_ef": search_ef,
+        },
+    )
+    batch_size = client.get_max_batch_size()
+    start = perf_counter()
+    for offset in range(0, len(corpus), batch_size):
+        batch = corpus[offset : offset + batch_size]
+        collection.add(
+            ids=[str(i) for i in range(offset, offset + len(batch))], embeddings=batch
+        )
+    return collection, perf_counter() - start
+
+
+def measure(
+    collection: chromadb.Collection, queries: np.ndarray, exact: np.ndarray, k: int
+) -> dict[str, float]:
+    """Get the recall of a collection's index against exact search, and its latency"""
+    recalls = []
+    latencies = []
+    for query, expected in zip(queries, exact):
+        start = perf_counter()
+        results = collection.query(query_embeddings=[query], n_results=k, include=[])
+        latencies.append(perf_counter() - start)
+        found = {int(id_) for id_ in results["ids"][0]}
+        recalls.append(len(found & set(expected.tolist())) / len(expected))
+
+    if len(latencies) < 2:
+        latencies = latencies * 2
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "recall_at_k": statistics.fmean(recalls),
+        "p50_ms": percentiles[49] * 1000,
+        "p99_ms": percentiles[98] * 1000,
+    }
+
+
+def tune(
+    work_dir: str,
+    vectors: np.ndarray,
+    queries: int,
+    k: int,
+    space: str,
+    ms: list[int],
+    construction_efs: list[int],
+    search_efs: list[int],
+    seed: int = 0,
+) -> list[dict]:
+    """Build the index under each combination of settings, and measure it"""
+    corpus, query_vectors = split_queries(vectors, queries, seed)
+    exact = exact_neighbors(corpus, query_vectors, k, space)
+    client = chromadb.PersistentClient(path=work_dir)
+
+    results = []
+    for m, construction_ef, search_ef in itertools.product(
+        ms, construction_efs, search_efs
+    ):
+        collection, seconds = build_index(
+            client, corpus, space, m, construction_ef, search_ef
+        )
+        results.append(
+            {
+                "m": m,
+                "construction_ef": construction_ef,
+                "search_ef": search_ef,
+                "build_seconds": seconds,
+            }
+            | measure(collection, query_vectors, exact, k)
+        )
+        client.delete_collection(collection.name)
+    return results
+
+
+def parse_ints(ctx, param, value: str) -> list[int]:
+    try:
+        return [int(item) for item in value.split(",")]
+    except ValueError:
+        raise click.BadParameter("Expected comma-separated numbers")
+
+
+@click.command()
+@click.option("--output", "-o", type=click.Path(dir_okay=False), help="JSON file")
+@click.option(
+    "--source",
+    type=click.Choice(["collection", "synthetic"]),
+    default="collection",
+    show_default=True,
+    help="Tune on the configured collection's vectors, or on random ones",
+)
+@click.option(
+    "--game", help="Tune on a game's vectors  [default: every game's, and the rest]"
+)
+@click.option("--vectors", default=5000, show_default=True, help="Synthetic vectors")
+@click.option(
+    "--space",
+    type=click.Choice(["l2", "cosine", "ip"]),
+    help="Distance to compare by  [default: the configured one, or l2]",
+)
+@click.option("--m", "ms", default="8,16,32", callback=parse_ints, show_default=True)
+@click.option(
+    "--construction-ef",
+    "construction_efs",
+    default="100,200",
+    callback=parse_ints,
+    show_default=True,
+)
+@click.option(
+    "--search-ef",
+    "search_efs",
+    default="10,50,100",
+    callback=parse_ints,
+    show_default=True,
+)
+@click.option("--k", default=10, show_default=True, help="Neighbors to find")
+@click.option("--queries", default=100, show_default=True, help="Queries per setting")
+@click.option("--seed", default=0, show_default=True)
+def main(output, source, game, vectors, space, **options):
+    """
+    Build the vector index under several settings, and print the recall of each
+    against exact search, with its query latency and build time, as JSON
+    """
+    if source == "collection":
+        config = Config()
+        if config.vector_backend != "chroma":
+            raise click.ClickException(
+                "Tuning is for Chroma's index. Use --source synthetic instead"
+            )
+        space = space or config.hnsw_space
+        data = load_vectors(config, rag_store.get_client(config), game)
+    else:
+        space = space or "l2"
+        data = make_vectors(vectors)
+    if len(data) <= options["queries"]:
+        raise click.ClickException("There must be more vectors than queries")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = tune(work_dir, data, space=space, **options)
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "source": source,
+            "game": game,
+            "vectors": len(data),
+            "dimensions": data.shape[1],
+            "space": space,
+        }
+        | options,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    click.echo(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,68 @@
+import re
+from asyncio import CancelledError
 from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
 from functools import partial
 from typing import Iterable
 
 from textual import on, work
 from textual.app import App, ComposeResult, SystemCommand
+from textual.await_complete import AwaitComplete
 from textual.containers import Container, Horizontal, Vertical, VerticalScroll
 from textual.screen import Screen
-from textual.widgets import Button, Footer, Header, Input, Markdown, ProgressBar, Static
-
-from utils import History, get_logger
+from textual.widget import Widget
+from textual.widgets import (
+    Button,
+    Footer,
+    Header,
+    Input,
+    Markdown,
+    ProgressBar,
+    Select,
+    Static,
+)
+
+from utils import Coalescer, History, HistorySearch, get_logger
 
 logger = get_logger(__name__)
 
 SCREEN_CHAT = "chat"
 SCREEN_MANAGE_STORE = "manage_store"
+LOAD_GROUP = "load"
+PROMPT_GROUP = "prompt"
+GREETING = "How can I help?"
+WARMING_UP = "Warming up..."
+THINKING = "..."
+ALL_GAMES = "All games"
+CANCELLED = "*Stopped.*"
+RENDER_FPS = 20.0
+
+# The start of a fenced code block, inside which blank lines don't end a block
+FENCE_PATTERN = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+
+
+def game_select(games: list[str], game: str | None, **kwargs) -> Select[str]:
+    """Get a selector of a game, or of every game when blank"""
+    return Select(
+        [(name, name) for name in games],
+        prompt=ALL_GAMES,
+        value=game if game in games else Select.BLANK,
+        **kwargs,
+    )
+
+
+def selected_game(select: Select[str]) -> str | None:
+    """Get the game selected, or None for every game"""
+    return None if select.value is Select.BLANK else select.value
 
 
 class ManageStore(Screen):
     """Manage store screen."""
 
-    BINDINGS = [("escape,space,q", "app.pop_screen", "Close")]
+    BINDINGS = [
+        ("escape,space,q", "app.pop_screen", "Close"),
+        ("c", "cancel_load", "Cancel load"),
+    ]
     CSS_PATH = "stylesheets/manage_store.tcss"
 
     def compose(self) -> ComposeResult:
@@ -27,6 +70,10 @@ class ManageStore(Screen):
         with Horizontal(classes="screenBox"):
             with Vertical(id="load-view", classes="dialogBox"):
                 yield Static("Manage your PDFs store.")
+                games = self.app.games()
+                select = game_select(games, self.app.game, id="store-game")
+                select.display = bool(games)
+                yield select
                 with Horizontal():
                     yield Button.success("Load", id="load")
                     yield Button.success("Reset", id="reset")
@@ -44,70 +91,368 @@ class ManageStore(Screen):
 
         actions[event.button.id](event.button)
 
-    @work
+    def action_cancel_load(self) -> None:
+        """Cancel a load in progress."""
+        self.workers.cancel_group(self, LOAD_GROUP)
+
+    def set_status(self, button: Button, text: str) -> None:
+        """Replace the status box contents with a message."""
+        button.loading = False
+        statusBox = self.query_one("#statusBox")
+        statusBox.remove_children()
+        statusBox.mount(Static(text))
+
+    @work(group=LOAD_GROUP)
     async def load_rag(self, button):
         statusBox = self.query_one("#statusBox")
         progress = ProgressBar(show_eta=False, total=100)
         statusBox.remove_children()
         statusBox.mount(progress)
 
-        await self.app.on_load_rag(progress.update)
+        try:
+            await self.app.on_load_rag(progress.update, self.game)
+        except CancelledError:
+            # The screen may have been closed, which also cancels the load
+            if self.is_attached:
+                self.set_status(button, "Load cancelled.")
+            raise
 
-        button.loading = False
-        statusBox = self.query_one("#statusBox")
-        statusBox.remove_children()
-        statusBox.mount(Static("Store loaded."))
+        self.set_status(button, "Store loaded.")
 
     @work
     async def reset_rag(self, button):
-        await self.app.on_reset_rag()
+        await self.app.on_reset_rag(self.game)
+        self.set_status(button, "Store reset.")
 
-        button.loading = False
-        statusBox = self.query_one("#statusBox")
-        statusBox.remove_children()
-        statusBox.mount(Static("Store reset."))
+    @property
+    def game(self) -> str | None:
+        """The game whose store is managed, or None for every game's"""
+        return selected_game(self.query_one("#store-game", Select))
 
 
 class Prompt(Markdown):
     """Markdown for the user prompt."""
 
 
-class Response(Markdown):
+def settled_length(markdown: str, start: int = 0) -> int:
+    """
+    Get the length of the Markdown in blocks that are finished, i.e. that are followed
+    by a blank line and the start of another block, so appending can't change them.
+    The text is scanned from the given length, which must be at the end of a block.
+    """
+    settled = position = start
+    fence = None
+    blank = False
+    for line in markdown[start:].splitlines(keepends=True):
+        # A blank line and an unindented line start a new block, outside code
+        if fence is None and blank and line.strip() and not line[0].isspace():
+            settled = position
+
+        if match := FENCE_PATTERN.match(line):
+            marker = match[1]
+            if fence is None:
+                fence = marker
+            elif marker[0] == fence[0] and len(marker) >= len(fence):
+                if line.strip() == marker:
+                    fence = None
+
+        blank = not line.strip()
+        position += len(line)
+
+    return settled
+
+
+class StreamingMarkdown(Widget):
+    """
+    Markdown that's redrawn as a response streams in. Finished blocks are parsed once,
+    into documents of their own, and only the block being written is parsed again.
+    """
+
+    DEFAULT_CSS = """
+    StreamingMarkdown {
+        height: auto;
+        layout: vertical;
+    }
+    StreamingMarkdown > Markdown {
+        padding: 0;
+        margin: 0;
+        background: transparent;
+    }
+    """
+
+    def __init__(self, markdown: str = "", **kwargs):
+        super().__init__(**kwargs)
+        self.markdown = markdown
+        self.settled = settled_length(markdown)
+        self._replacing: AwaitComplete | None = None
+        self._pending: str | None = None
+
+    def compose(self) -> ComposeResult:
+        if self.settled:
+            yield Markdown(self.markdown[: self.settled])
+        yield Markdown(self.markdown[self.settled :], classes="tail")
+
+    def update(self, markdown: str) -> AwaitComplete:
+        """
+        Show new Markdown, only parsing what's changed if it's been appended to.
+        Await the result to wait for the documents to be mounted.
+        """
+        if self._replacing is not None:
+            # Shown once the documents being replaced are gone
+            self._pending = markdown
+            return self._replacing
+
+        if not markdown.startswith(self.markdown[: self.settled]):
+            # Replaced rather than appended to, so start again
+            self.markdown = markdown
+            self.settled = settled_length(markdown)
+            self._replacing = AwaitComplete(self._replace())
+            return self._replacing
+
+        tail = self.query_one(".tail", Markdown)
+        settled = settled_length(markdown, self.settled)
+        mounted = []
+        if settled > self.settled:
+            mounted.append(
+                self.mount(Markdown(markdown[self.settled : settled]), before=tail)
+            )
+        self.markdown = markdown
+        self.settled = settled
+        return AwaitComplete(*mounted, tail.update(markdown[settled:]))
+
+    async def _replace(self) -> None:
+        """Remove the documents before mounting new ones, so they're never both shown"""
+        try:
+            await self.remove_children()
+            await self.mount_all(self.compose())
+        finally:
+            self._replacing = None
+
+        if (pending := self._pending) is not None:
+            self._pending = None
+            await self.update(pending)
+
+
+class Response(StreamingMarkdown):
     """Markdown for the reply from the LLM."""
 
     BORDER_TITLE = "AI"
 
 
+@dataclass
+class ChatMessage:
+    """A message in the chat, kept whether or not it's shown"""
+
+    widget: type[Markdown | StreamingMarkdown]
+    text: str
+
+
+class ChatLog(VerticalScroll):
+    """
+    Scrolling chat that only keeps widgets for a window of its messages, so it stays
+    fast however long the session. Earlier or later messages are shown a page at a
+    time when the window is scrolled to either end.
+    """
+
+    WINDOW = 30  # Messages shown at once
+    PAGE = 10  # Messages shown when scrolling to an end of the window
+    EDGE = 1  # Lines from an end of the window that count as reaching it
+
+    def __init__(self, *messages: ChatMessage, **kwargs):
+        super().__init__(**kwargs)
+        self.messages = list(messages)
+        self.start = max(len(self.messages) - self.WINDOW, 0)
+        self.paging = False
+
+    def compose(self) -> ComposeResult:
+        yield from self.render_messages(self.start, len(self.messages))
+
+    @property
+    def end(self) -> int:
+        """Index after the last message shown"""
+        return self.start + len(self.children)
+
+    def render_messages(self, start: int, end: int) -> list[Widget]:
+        """Create widgets for a range of the messages"""
+        return [message.widget(message.text) for message in self.messages[start:end]]
+
+    def get_widget(self, index: int) -> Widget | None:
+        """Get the widget for a message, if it's shown"""
+        if self.start <= index < self.end:
+            return self.children[index - self.start]
+        return None
+
+    async def add(self, widget: type[Markdown | StreamingMarkdown], text: str) -> int:
+        """Add a message and show it with those before it. Returns its index"""
+        self.messages.append(ChatMessage(widget, text))
+        index = len(self.messages) - 1
+        if self.end == index:
+            await self.mount(self.render_messages(index, index + 1)[0])
+            await self.trim(keep_end=True)
+        else:
+            await self.show(index + 1 - self.WINDOW)
+
+        self.children[-1].anchor()
+        return index
+
+    def update(self, index: int, text: str) -> None:
+        """Change the text of a message, and its widget if it's shown"""
+        self.messages[index].text = text
+        if (widget := self.get_widget(index)) is not None:
+            widget.update(text)
+
+    async def reset(self, *messages: ChatMessage) -> None:
+        """Replace the messages, and show them from the start"""
+        self.messages = list(messages)
+        await self.show(0)
+
+    async def show(self, start: int) -> None:
+        """Show the window of messages from the given index"""
+        self.start = max(start, 0)
+        await self.remove_children()
+        await self.mount_all(self.render_messages(self.start, self.start + self.WINDOW))
+
+    async def trim(self, keep_end: bool) -> None:
+        """Remove widgets outside the window, from the start or the end"""
+        excess = len(self.children) - self.WINDOW
+        if excess <= 0:
+            return
+
+        if keep_end:
+            await self.remove_children(self.children[:excess])
+            self.start += excess
+        else:
+            await self.remove_children(self.children[-excess:])
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+        if self.paging:
+            return
+
+        if new_value < old_value and new_value <= self.EDGE and self.start > 0:
+            self.paging = True
+            self.call_later(self.page, earlier=True)
+        elif (
+            new_value > old_value
+            and new_value >= self.max_scroll_y - self.EDGE
+            and self.end < len(self.messages)
+        ):
+            self.paging = True
+            self.call_later(self.page, earlier=False)
+
+    async def page(self, earlier: bool) -> None:
+        """Show a page of earlier or later messages, without moving those in view"""
+        # A widget that stays shown, to scroll by however far it moves
+        anchor = self.children[0] if earlier else self.children[-1]
+        before = anchor.virtual_region.y
+
+        if earlier:
+            start = max(self.start - self.PAGE, 0)
+            await self.mount_all(self.render_messages(start, self.start), before=0)
+            self.start = start
+        else:
+            await self.mount_all(self.render_messages(self.end, self.end + self.PAGE))
+        await self.trim(keep_end=not earlier)
+
+        def keep_position() -> None:
+            # Finish scrolling to the end first, or it would undo this
+            self.app.animator.force_stop_animation(self, "scroll_y")
+            self.scroll_to(
+                y=self.scroll_y + anchor.virtual_region.y - before,
+                animate=False,
+                immediate=True,
+            )
+            self.paging = False
+
+        self.call_after_refresh(keep_position)
+
+
+class SearchInput(Input):
+    """Input for searching back through the prompts sent."""
+
+    BINDINGS = [
+        ("ctrl+r", "screen.search_older", "Older"),
+        ("escape", "screen.cancel_search", "Cancel"),
+    ]
+
+
 class Chat(Screen):
     """Chat screen."""
 
     AUTO_FOCUS = "Input"
     CSS_PATH = "stylesheets/chat.tcss"
-    BINDINGS = [("up", "history_up", "Get last"), ("down", "history_down", "Get next")]
-
-    history = History(100)
+    BINDINGS = [
+        ("up", "history_up", "Get last"),
+        ("down", "history_down", "Get next"),
+        ("ctrl+r", "search_history", "Search"),
+        ("f2", "toggle_latency", "Latency"),
+        ("ctrl+n", "new_conversation", "New chat"),
+        ("escape", "cancel_prompt", "Stop"),
+    ]
+
+    search: HistorySearch | None = None
+    original = ""  # What was typed before searching
+
+    @property
+    def history(self) -> History:
+        return self.app.history
 
     def compose(self) -> ComposeResult:
         yield Header()
-        with VerticalScroll(id="chat-view"):
-            yield Response("How can I help?")
-        yield Input(placeholder=">")
+        yield ChatLog(
+            ChatMessage(Response, GREETING if self.app.ready else WARMING_UP),
+            id="chat-view",
+        )
+        yield Static(id="latency", markup=False)
+        with Horizontal(id="prompt-bar"):
+            yield game_select([], None, id="game")
+            yield Input(id="prompt", placeholder=">", disabled=not self.app.ready)
+        yield SearchInput(id="search", placeholder="Search history")
         yield Footer()
 
-    @on(Input.Submitted)
+    @on(Input.Submitted, "#prompt")
     async def on_input(self, event: Input.Submitted) -> None:
         """When the user hits return."""
-        chat_view = self.query_one("#chat-view")
+        chat_log = self.query_one(ChatLog)
         if not event.value.strip():
             return
 
         event.input.clear()
-        await chat_view.mount(Prompt(event.value))
-        await chat_view.mount(response := Response("..."))
-        response.anchor()
+        await chat_log.add(Prompt, event.value)
+        response = await chat_log.add(Response, THINKING)
         self.history.append(event.value)
         self.send_prompt(event.value, response)
 
+    def set_greeting(self, text: str) -> None:
+        """Replace the first message in the chat."""
+        self.query_one(ChatLog).update(0, text)
+
+    def set_ready(self) -> None:
+        """Let the user chat once the app has warmed up."""
+        self.set_greeting(GREETING)
+        self.update_games()
+        input = self.query_one(Input)
+        input.disabled = False
+        input.focus()
+
+    def on_screen_resume(self) -> None:
+        if self.app.ready:
+            self.update_games()
+
+    def update_games(self) -> None:
+        """Show the games to choose from, if there are any, with the active one"""
+        games = self.app.games()
+        select = self.query_one("#game", Select)
+        select.display = bool(games)
+        with select.prevent(Select.Changed):
+            select.set_options([(name, name) for name in games])
+            select.value = self.app.game if self.app.game in games else Select.BLANK
+
+    @on(Select.Changed, "#game")
+    def on_game_changed(self, event: Select.Changed) -> None:
+        """Search the rules of the game chosen, or of every game."""
+        self.app.select_game(selected_game(event.select))
+
     def action_history_up(self) -> None:
         """Get the last message from history and insert it into the input."""
 
@@ -132,11 +477,103 @@ class Chat(Screen):
         input.clear()
         input.insert(text, 0)
 
-    @work(thread=True)
-    async def send_prompt(self, prompt: str, response: Response) -> None:
-        """Call the parent's prompt function so that it can update the thread."""
-        update_func = partial(self.app.call_from_thread, response.update)
-        await self.app.prompt_func(prompt, update_func)
+    def action_search_history(self) -> None:
+        """Start searching back through the history for what's typed."""
+        prompt = self.query_one("#prompt", Input)
+        if prompt.disabled:
+            return
+
+        self.search = HistorySearch(self.history)
+        self.original = prompt.value
+        search = self.query_one(SearchInput)
+        search.clear()
+        search.remove_class("no-match")
+        search.add_class("visible")
+        search.focus()
+
+    @on(Input.Changed, "#search")
+    def on_search_changed(self, event: Input.Changed) -> None:
+        """Show the latest prompt containing the search."""
+        if self.search is not None:
+            self.show_match(self.search.update(event.value), event.input)
+
+    def action_search_older(self) -> None:
+        """Show the next older prompt containing the search."""
+        if self.search is not None:
+            self.show_match(self.search.older(), self.query_one(SearchInput))
+
+    def show_match(self, text: str | None, search: Input) -> None:
+        """Put a prompt found by the search into the input."""
+        search.set_class(text is None and bool(search.value), "no-match")
+        if text is not None:
+            prompt = self.query_one("#prompt", Input)
+            prompt.value = text
+            prompt.cursor_position = len(text)
+
+    @on(Input.Submitted, "#search")
+    def on_search_submitted(self, event: Input.Submitted) -> None:
+        """Stop searching, leaving the prompt found to edit or send."""
+        self.end_search()
+
+    def action_cancel_search(self) -> None:
+        """Stop searching, putting back what was typed before."""
+        self.query_one("#prompt", Input).value = self.original
+        self.end_search()
+
+    def end_search(self) -> None:
+        """Hide the search and go back to the input."""
+        self.search = None
+        self.query_one(SearchInput).remove_class("visible")
+        self.query_one("#prompt", Input).focus()
+
+    def action_toggle_latency(self) -> None:
+        """Show or hide the latency of the last response and the session."""
+        self.query_one("#latency").toggle_class("visible")
+        self.update_latency()
+
+    def update_latency(self) -> None:
+        """Refresh the latency panel, if it's shown."""
+        panel = self.query_one("#latency", Static)
+        if panel.has_class("visible") and self.app.on_latency:
+            panel.update(self.app.on_latency())
+
+    async def action_new_conversation(self) -> None:
+        """Stop any response, and start a new conversation with an empty chat."""
+        if not self.app.ready or not self.app.on_new_conversation:
+            return
+
+        cancelled = self.workers.cancel_group(self, PROMPT_GROUP)
+        await self.workers.wait_for_complete(cancelled)
+        await self.app.on_new_conversation()
+        await self.query_one(ChatLog).reset(ChatMessage(Response, GREETING))
+        self.query_one("#prompt", Input).focus()
+
+    def action_cancel_prompt(self) -> None:
+        """Stop the response being generated."""
+        self.workers.cancel_group(self, PROMPT_GROUP)
+
+    @work(exclusive=True, group=PROMPT_GROUP)
+    async def send_prompt(self, prompt: str, response: int) -> None:
+        """
+        Call the parent's prompt function, drawing its updates on a timer at most at
+        the app's frame rate. A new prompt cancels the one before.
+        """
+        chat_log = self.query_one(ChatLog)
+        coalescer = Coalescer(partial(chat_log.update, response))
+        timer = self.set_interval(1 / self.app.render_fps, coalescer.flush)
+        try:
+            await self.app.prompt_func(prompt, coalescer.push)
+        except CancelledError:
+            coalescer.flush()
+            text = chat_log.messages[response].text
+            chat_log.update(
+                response, CANCELLED if text == THINKING else f"{text}\n\n{CANCELLED}"
+            )
+            raise
+        finally:
+            timer.stop()
+            coalescer.flush()
+            self.update_latency()
 
 
 class CliApp(App):
@@ -152,6 +589,9 @@ class CliApp(App):
         yield SystemCommand("Admin PDFs", "Manage PDF store", self.load_pdf_screen)
 
     def load_pdf_screen(self):
+        if not self.ready:
+            self.notify(WARMING_UP)
+            return
         self.push_screen(ManageStore())
 
     def __init__(
@@ -161,18 +601,52 @@ class CliApp(App):
         on_reset_rag: Callable[[], Awaitable[None]],
         initial_screen: str = SCREEN_CHAT,
         mount_func: Callable[[App], Awaitable[None]] | None = None,
+        on_latency: Callable[[], str] | None = None,
+        warm_up_func: Callable[[], Awaitable[str]] | None = None,
+        render_fps: float = RENDER_FPS,
+        history: History | None = None,
+        games_func: Callable[[], list[str]] | None = None,
+        on_select_game: Callable[[str | None], None] | None = None,
+        game: str | None = None,
+        on_new_conversation: Callable[[], Awaitable[None]] | None = None,
         *args,
         **kwargs,
     ):
+        """
+        If a warm up function is given, it's run once the app has drawn, and the
+        chat is disabled until it returns the name of the screen to show. Prompts
+        are kept in the given history, or one that lasts the session. If there are
+        games, the one to search can be chosen, starting with the given one, and
+        each game's store is loaded and reset on its own. The conversation is
+        started again with the given function, if there is one.
+        """
         self.prompt_func = prompt_func
+        self.on_latency = on_latency
         self.on_load_rag = on_load_rag
         self.on_reset_rag = on_reset_rag
         self.initial_screen = initial_screen
-        if mount_func and callable(mount_func):
-            self.mount_func: Callable = mount_func
+        self.mount_func = mount_func
+        self.warm_up_func = warm_up_func
+        self.render_fps = render_fps
+        self.history = history if history is not None else History()
+        self.games_func = games_func
+        self.on_select_game = on_select_game
+        self.game = game
+        self.on_new_conversation = on_new_conversation
+        self.ready = warm_up_func is None
 
         super().__init__(*args, **kwargs)
 
+    def games(self) -> list[str]:
+        """Get the names of the games to choose from"""
+        return self.games_func() if self.games_func else []
+
+    def select_game(self, game: str | None) -> None:
+        """Search the rules of a game, or of every game if None"""
+        self.game = game
+        if self.on_select_game:
+            self.on_select_game(game)
+
     async def on_mount(self) -> None:
         """Run setup on mount"""
         if self.mount_func:
@@ -181,7 +655,25 @@ class CliApp(App):
         self.title = "Agent"
 
         # Make the chat screen the base screen
-        self.push_screen(SCREEN_CHAT)
+        await self.push_screen(SCREEN_CHAT)
 
-        if self.initial_screen != SCREEN_CHAT:
+        if self.warm_up_func:
+            self.warm_up()
+        elif self.initial_screen != SCREEN_CHAT:
             self.push_screen(self.initial_screen)
+
+    @work(exit_on_error=False)
+    async def warm_up(self) -> None:
+        """Run the warm up function, then enable the chat and show the first screen"""
+        chat = self.get_screen(SCREEN_CHAT)
+        try:
+            screen = await self.warm_up_func()
+        except Exception as e:
+            logger.exception("Failed to warm up")
+            chat.set_greeting(f"Failed to start: {e}")
+            return
+
+        self.ready = True
+        chat.set_ready()
+        if screen != SCREEN_CHAT:
+            self.push_screen(screen)
@@ -1,11 +1,17 @@
 import asyncio
+import logging
+from typing import TYPE_CHECKING
 
 from pydantic import ValidationError
 
-import rag_store
 from cli import SCREEN_CHAT, SCREEN_MANAGE_STORE, CliApp
-from utils import Config, get_logger
-from workflows import LLM
+from utils import Config, History, configure_logging, get_logger
+
+# The store and LLM pull in langchain, chromadb and PyMuPDF, which take seconds to
+# import, so they're imported and built once the app has drawn
+if TYPE_CHECKING:
+    from rag_store import RagStores
+    from workflows import LLM
 
 logger = get_logger(__name__)
 
@@ -15,13 +21,30 @@ except ValidationError as e:
     print(f"Failed to load config. {e}")
     exit(1)
 
-store = rag_store.RagStore(config, rag_store.get_client())
-llm_agent = LLM(config, store)
+stores: "RagStores"
+llm_agent: "LLM"
+
+
+def build() -> None:
+    """Import and build the stores and LLM"""
+    global stores, llm_agent
+
+    import rag_store
+    from workflows import LLM
+
+    stores = rag_store.RagStores(config, rag_store.get_client(config))
+    llm_agent = LLM(config, stores)
 
 
-async def on_mount(_app) -> None:
-    """Run on cli mount"""
-    logger.debug("\n" + llm_agent.graph().draw_mermaid())
+async def warm_up() -> str:
+    """Build the store and LLM without blocking the app. Returns the screen to show"""
+    await asyncio.to_thread(build)
+    await llm_agent.initialize_workflow()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("\n%s", llm_agent.graph().draw_mermaid())
+
+    # check for rag initialization and prompt user
+    return SCREEN_MANAGE_STORE if stores.get_count() == 0 else SCREEN_CHAT
 
 
 async def on_prompt(text: str, update_func) -> None:
@@ -29,30 +52,61 @@ async def on_prompt(text: str, update_func) -> None:
     await llm_agent.stream_response(text, update_func)
 
 
-async def load_rag(update_func) -> None:
-    """Create and load the RAG store. Update progress using the update function"""
-    await store.load(update_func)
+async def load_rag(update_func, game: str | None = None) -> None:
+    """
+    Load a game's RAG store, or every game's. Update progress using the update
+    function
+    """
+    await stores.load(update_func, game)
 
 
-async def reset_rag() -> None:
-    """Reset the RAG store"""
-    await store.reset()
+async def reset_rag(game: str | None = None) -> None:
+    """Reset a game's RAG store, or every game's"""
+    await stores.reset(game)
 
 
-async def main() -> None:
-    await llm_agent.initialize_workflow()
+def get_games() -> list[str]:
+    """Get the names of the games, whose PDFs are in subdirectories"""
+    return stores.games()
+
+
+def select_game(game: str | None) -> None:
+    """Search a game's rules, or every game's"""
+    stores.active = game
+
+
+async def new_conversation() -> None:
+    """Forget the conversation so far"""
+    await llm_agent.new_conversation()
 
-    # check for rag initialization and prompt user
-    initial_screen = SCREEN_MANAGE_STORE if store.get_count() == 0 else SCREEN_CHAT
 
+def latency() -> str:
+    """Describe the latency of the last response and the session"""
+    return llm_agent.tracer.report()
+
+
+async def main() -> None:
+    configure_logging(config.log_level)
+    history = History(config.history_size, config.history_path)
     app = CliApp(
         on_prompt,
         on_load_rag=load_rag,
         on_reset_rag=reset_rag,
-        initial_screen=initial_screen,
-        mount_func=on_mount,
+        warm_up_func=warm_up,
+        on_latency=latency,
+        on_new_conversation=new_conversation,
+        games_func=get_games,
+        on_select_game=select_game,
+        game=config.game,
+        render_fps=config.render_fps,
+        history=history,
     )
     await app.run_async()
+    history.close()
+
+    # The conversation memory's connection has a thread to stop
+    if "llm_agent" in globals():
+        await llm_agent.close()
 
 
 if __name__ == "__main__":
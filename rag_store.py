@@ -1,102 +1,1107 @@
+import asyncio
 import glob
+import hashlib
 import itertools
+import json
+import multiprocessing
+import os
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor
+from contextlib import aclosing
+from contextvars import ContextVar
+from dataclasses import replace
+from functools import partial
+from multiprocessing.queues import Queue
+from multiprocessing.synchronize import Event as EventType
+from queue import Empty, Full
 from time import time
-from typing import Iterable
+from typing import Any, AsyncIterator, Callable, Hashable, Iterable, Literal
 
 import chromadb
+import numpy as np
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import PyMuPDFLoader
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
 from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_ollama import OllamaEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_text_splitters.base import TextSplitter
+from pydantic import PrivateAttr
 
-from utils import Config, Singleton, get_logger
+from utils import (
+    AdaptiveBatcher,
+    BM25Index,
+    CachedEmbeddings,
+    Config,
+    LRUCache,
+    Manifest,
+    ManifestEntry,
+    NumpyVectorStore,
+    Singleton,
+    cosine_similarities,
+    fit_budget,
+    get_logger,
+    hash_file,
+    merge_chunks,
+    mmr,
+)
+from utils.bm25 import tokenize
 
 logger = get_logger(__name__)
 
-CHROMA_PATH = ".chroma"
-TEXT_SPLITTER_BATCH_SIZE = 50  # Number of documents to split at a time
+CHUNK_SIZE = 1000  # Characters in each chunk of a page
+CHUNK_OVERLAP = 100  # Characters shared by consecutive chunks
+TEXT_SPLITTER_BATCH_SIZE = 50  # Number of chunks to embed at a time, to start with
+EMBEDDING_RETRIES = 5  # Attempts to embed a batch before giving up
+DELETE_BATCH_SIZE = 1000  # Number of chunk IDs to delete at a time
+PAGE_BATCH_SIZE = 10  # Number of pages to parse and split at a time
+CHUNK_QUEUE_SIZE = 16  # Number of page batches buffered between parsing and writing
+QUEUE_POLL_INTERVAL = 0.5  # Seconds to wait for parsed chunks before checking workers
+# Start parsing workers fresh, since forking the app's threads could deadlock them
+PROCESS_CONTEXT = multiprocessing.get_context("spawn")
+INDEX_BATCH_SIZE = 1000  # Number of chunks to read at a time when rebuilding the index
+RETRIEVER_K = 4  # Number of chunks to retrieve, unless the search parameters say
+RRF_K = 60  # Damps the weight of top ranks when fusing keyword and vector results
+KEYWORD_QUERY_TERMS = 3  # Longest query that is searched by keyword alone
+VECTOR_RETRY_AFTER = 30.0  # Seconds to use keywords alone after a vector search fails
+MAX_COLLECTION_NAME = 63  # Longest collection name Chroma allows
 
+# An "@game" prefix that scopes a query to one game
+GAME_PREFIX = re.compile(r"@(\S+)\s+")
 
-def get_embedder(config) -> OllamaEmbeddings:
-    """Get embeddings for PDFs"""
-    return OllamaEmbeddings(model=config.embedding_model)
+# Chroma's settings for a collection's vector index, when its metadata doesn't say
+HNSW_DEFAULTS = {
+    "hnsw:space": "l2",
+    "hnsw:M": 16,
+    "hnsw:construction_ef": 100,
+    "hnsw:search_ef": 100,
+}
+
+# Streams of (file path, chunks), with None as the chunks once a file is done
+ChunkStream = AsyncIterator[tuple[str, list[Document] | None]]
+
+# The game the current query is scoped to, instead of the active one
+query_game: ContextVar[str | None] = ContextVar("query_game", default=None)
+
+
+def get_embedder(config: Config) -> CachedEmbeddings:
+    """Get embeddings for PDFs, cached on disk so identical chunks are embedded once"""
+    return CachedEmbeddings(
+        OllamaEmbeddings(model=config.embedding_model),
+        model=config.embedding_model,
+        path=os.path.join(config.chroma_path, "embeddings.sqlite"),
+        max_bytes=config.embedding_cache_mb * 1024 * 1024,
+    )
 
 
 def get_splitter() -> TextSplitter:
-    """Get text splitter for PDFs"""
-    return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    """
+    Get text splitter for PDFs. Chunks record where they start in the page, so
+    overlapping ones can be merged when retrieved together.
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True
+    )
 
 
-def get_client() -> chromadb.Client:
-    """Get client for Chroma."""
+def get_client(config: Config) -> chromadb.ClientAPI | None:
+    """Get client for Chroma, or None if vectors are kept with NumPy."""
+    if config.vector_backend == "numpy":
+        return None
     # By default, Chroma stores data in a .chroma directory in the current directory
-    return chromadb.PersistentClient(path=CHROMA_PATH)
+    return chromadb.PersistentClient(path=config.chroma_path)
 
 
-class RagStore(metaclass=Singleton):
-    """RAG store for PDFs"""
+def collection_name(config: Config, game: str | None = None) -> str:
+    """
+    Get the name of a game's collection, or of the collection of PDFs outside any
+    game's directory. Names are made safe for Chroma, with a hash of the game's name
+    so that games whose names only differ in punctuation don't share one.
+    """
+    if game is None:
+        return config.chroma_collection_name
 
-    def __init__(self, config: Config, client: chromadb.Client, *args, **kwargs):
-        """Initialize the RAG store"""
-        super().__init__(*args, **kwargs)
+    slug = re.sub(r"[^a-z0-9]+", "-", game.casefold()).strip("-")
+    digest = hashlib.sha256(game.encode("utf-8")).hexdigest()[:8]
+    prefix = f"{config.chroma_collection_name}-{slug}"
+    return f"{prefix[: MAX_COLLECTION_NAME - len(digest) - 1].rstrip('-.')}-{digest}"
+
+
+def get_games(config: Config) -> list[str]:
+    """Get the names of the games, from the subdirectories of the PDF directory"""
+    if not os.path.isdir(config.pdf_dir):
+        return []
+    return sorted(
+        entry.name
+        for entry in os.scandir(config.pdf_dir)
+        if entry.is_dir() and not entry.name.startswith(".")
+    )
+
+
+def get_collection_metadata(config: Config) -> dict[str, str | int]:
+    """
+    Get the metadata the collection is created with, which records the settings of
+    its vector index
+    """
+    return {
+        "source": "pdfs",
+        "hnsw:space": config.hnsw_space,
+        "hnsw:M": config.hnsw_m,
+        "hnsw:construction_ef": config.hnsw_construction_ef,
+        "hnsw:search_ef": config.hnsw_search_ef,
+    }
+
+
+def get_index_settings(config: Config) -> dict[str, str | int]:
+    """Get the configured settings of the vector index, for the configured backend"""
+    if config.vector_backend == "numpy":
+        return {"space": config.hnsw_space, "dtype": config.vector_dtype}
+    return get_collection_metadata(config)
+
+
+def get_vectors_path(config: Config, name: str) -> str:
+    """Get the directory of a collection's vectors when they're kept with NumPy."""
+    return os.path.join(config.chroma_path, f"{name}.vectors")
+
+
+def get_manifest(config: Config, name: str) -> Manifest:
+    """Get the manifest of loaded files, stored next to the Chroma collection."""
+    return Manifest(os.path.join(config.chroma_path, f"{name}.manifest.json"))
+
+
+def get_index(config: Config, name: str) -> BM25Index:
+    """Get the keyword index of the chunks, stored next to the Chroma collection."""
+    return BM25Index(os.path.join(config.chroma_path, f"{name}.bm25.json"))
+
+
+def chunk_id(doc: Document, ordinal: int) -> str:
+    """
+    Get a content-addressed ID for a chunk, so that reloading a file replaces its
+    chunks instead of duplicating them.
+    """
+    key = "\0".join(
+        [
+            str(doc.metadata.get("source", "")),
+            str(doc.metadata.get("page", "")),
+            str(ordinal),
+            doc.page_content,
+        ]
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def split_pages(
+    pages: Iterable[Document], ordinals: dict[str, int] | None = None
+) -> list[Document]:
+    """
+    Split pages into chunks with content-addressed IDs. Pass the same ordinals to
+    each call when splitting a file a few pages at a time, so the IDs stay unique.
+    """
+    doc_splits = get_splitter().split_documents(pages)
+
+    ordinals = defaultdict(int) if ordinals is None else ordinals
+    for doc in doc_splits:
+        source = doc.metadata.get("source", "")
+        doc.id = chunk_id(doc, ordinals[source])
+        ordinals[source] += 1
+
+    return doc_splits
+
+
+async def split_stream(pages: Iterable[Document]) -> ChunkStream:
+    """Split pages into chunks a few pages at a time"""
+    ordinals: dict[str, int] = defaultdict(int)
+    for batch in itertools.batched(pages, PAGE_BATCH_SIZE):
+        chunks_by_source: dict[str, list[Document]] = defaultdict(list)
+        for doc in split_pages(batch, ordinals):
+            chunks_by_source[doc.metadata.get("source", "")].append(doc)
+        for source, chunks in chunks_by_source.items():
+            yield source, chunks
+
+
+# Set in each worker process by init_worker
+_chunk_queue: Queue | None = None
+_stop_event: EventType | None = None
+
+
+def init_worker(queue: Queue, stop: EventType):
+    """
+    Set the queue that a worker process sends its chunks to, and the event that's
+    set when the load stops
+    """
+    global _chunk_queue, _stop_event
+    _chunk_queue = queue
+    _stop_event = stop
+
+
+def send_chunks(item: tuple[str, list[Document] | None]) -> bool:
+    """
+    Send chunks to the chunk queue, waiting while it's full until the store catches
+    up. Returns False if the load stopped first.
+    """
+    while not _stop_event.is_set():
+        try:
+            _chunk_queue.put(item, timeout=QUEUE_POLL_INTERVAL)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def parse_file(file_path: str) -> None:
+    """
+    Parse a PDF and split it into chunks, sending them to the chunk queue a few pages
+    at a time, followed by None once the file is done. Runs in a worker process, and
+    stops early if the load does.
+    """
+    pages = PyMuPDFLoader(file_path, mode="page").lazy_load()
+    ordinals: dict[str, int] = defaultdict(int)
+    for batch in itertools.batched(pages, PAGE_BATCH_SIZE):
+        if _stop_event.is_set():
+            return
+        if (chunks := split_pages(batch, ordinals)) and not send_chunks(
+            (file_path, chunks)
+        ):
+            return
+    send_chunks((file_path, None))
+
+
+def drain_queue(queue: Queue, futures: list[Future]):
+    """
+    Discard chunks from the queue until every worker has stopped and it's empty, so
+    no worker is left blocked sending to it, or flushing to it as its process exits
+    """
+    while True:
+        try:
+            queue.get(timeout=QUEUE_POLL_INTERVAL)
+        except Empty:
+            if all(future.done() for future in futures):
+                return
+
+
+def get_executor(config: Config, queue: Queue, stop: EventType) -> Executor:
+    """Get a pool of worker processes for parsing PDFs, sized to the available CPUs"""
+    return ProcessPoolExecutor(
+        max_workers=config.ingest_workers,
+        mp_context=PROCESS_CONTEXT,
+        initializer=init_worker,
+        initargs=(queue, stop),
+    )
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query's case and whitespace, so trivially different queries match"""
+    return " ".join(query.casefold().split())
+
+
+def fuse_ranks(*rankings: list[str]) -> list[str]:
+    """Merge rankings of IDs with reciprocal rank fusion"""
+    scores: dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking):
+            scores[id_] += 1 / (RRF_K + rank + 1)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
 
+
+class ChromaStore(Chroma):
+    """Chroma store, with the same ways to read and write chunks as NumpyVectorStore"""
+
+    def count(self) -> int:
+        return self._collection.count()
+
+    def upsert_embedded(
+        self,
+        ids: list[str],
+        embeddings: list[list[float]],
+        documents: list[str],
+        metadatas: list[dict],
+    ):
+        """Write embedded chunks, replacing any with the same IDs"""
+        self._collection.upsert(
+            ids=ids,
+            embeddings=embeddings,
+            documents=documents,
+            # Chroma rejects empty metadata
+            metadatas=[metadata or None for metadata in metadatas],
+        )
+
+    def get_embeddings(self, ids: list[str]) -> dict[str, list[float]]:
+        """Get the stored vectors of chunks by ID"""
+        results = self._collection.get(ids=ids, include=["embeddings"])
+        return dict(zip(results["ids"], results["embeddings"]))
+
+    def scan(self, limit: int, offset: int) -> tuple[list[str], list[str]]:
+        """Get the IDs and text of a page of the chunks"""
+        results = self._collection.get(
+            include=["documents"], limit=limit, offset=offset
+        )
+        return results["ids"], results["documents"]
+
+    def index_settings(self) -> dict[str, str | int]:
+        """Get the settings the collection's vector index was built with"""
+        metadata = self._collection.metadata or {}
+        return {key: metadata.get(key, value) for key, value in HNSW_DEFAULTS.items()}
+
+
+class HybridRetriever(VectorStoreRetriever):
+    """
+    Vector store retriever that also searches a keyword index, and fuses the two
+    rankings. Short queries whose terms are all in the index, like "Sneak Attack",
+    are searched by keyword alone, which skips embedding the query. Keywords are
+    also used alone when the vector search is slow or failing.
+
+    More chunks are found by vector than are needed, and those similar enough to the
+    query are chosen by maximal marginal relevance, so near-identical passages don't
+    crowd out others. Overlapping chunks of a page are merged, and the results are
+    trimmed to a token budget.
+    """
+
+    index: BM25Index
+    mode: Literal["hybrid", "vector", "lexical"] = "hybrid"
+    vector_timeout: float = 2.0
+    fetch_k: int = 20
+    mmr_lambda: float = 0.7
+    min_similarity: float = -1.0
+    token_budget: int = 0
+    _vector_retry_at: float = PrivateAttr(default=0.0)
+
+    def use_vector(self, query: str) -> bool:
+        """Check whether a query should be searched by vector too"""
+        if self.mode != "hybrid":
+            return self.mode == "vector"
+
+        terms = tokenize(query)
+        if len(terms) <= KEYWORD_QUERY_TERMS and self.index.has_terms(terms):
+            return False
+        return time() >= self._vector_retry_at
+
+    def vector_failed(self, error: Exception):
+        """Use keywords alone for a while after a vector search fails"""
+        logger.warning("Vector search failed, searching by keyword: %r", error)
+        self._vector_retry_at = time() + VECTOR_RETRY_AFTER
+
+    def get_vectors(self, docs: list[Document]) -> np.ndarray:
+        """Get the stored embeddings of chunks, a row each"""
+        vectors = self.vectorstore.get_embeddings([doc.id for doc in docs])
+        return np.array([vectors[doc.id] for doc in docs], dtype=np.float32)
+
+    def rerank(
+        self, query_vector: list[float], docs: list[Document], k: int
+    ) -> list[Document]:
+        """
+        Choose up to k of the chunks found by vector that are similar enough to the
+        query, trading relevance against variety
+        """
+        if not docs:
+            return []
+
+        vectors = self.get_vectors(docs)
+        similarities = cosine_similarities(query_vector, vectors)
+        similar = similarities >= self.min_similarity
+        docs = [doc for doc, keep in zip(docs, similar) if keep]
+        chosen = mmr(similarities[similar], vectors[similar], k, self.mmr_lambda)
+        return [docs[i] for i in chosen]
+
+    def fuse(
+        self, query: str, k: int, vector_docs: list[Document] | None
+    ) -> list[Document]:
+        """
+        Get the top documents from the keyword and vector rankings, merged and
+        trimmed to the token budget
+        """
+        if self.mode == "vector":
+            ids = [doc.id for doc in vector_docs]
+        else:
+            lexical_ids = [id_ for id_, _ in self.index.search(query, k)]
+            if vector_docs is None:
+                ids = lexical_ids
+            else:
+                ids = fuse_ranks([doc.id for doc in vector_docs], lexical_ids)[:k]
+
+        docs = {doc.id: doc for doc in vector_docs or []}
+        missing = [id_ for id_ in ids if id_ not in docs]
+        if missing:
+            docs.update((doc.id, doc) for doc in self.vectorstore.get_by_ids(missing))
+        found = [docs[id_] for id_ in ids if id_ in docs]
+        return fit_budget(merge_chunks(found), self.token_budget)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs: Any
+    ) -> list[Document]:
+        k = (self.search_kwargs | kwargs).get("k", RETRIEVER_K)
+        fetch_kwargs = kwargs | {"k": max(k, self.fetch_k)}
+        vector_docs = None
+        if self.use_vector(query):
+            try:
+                candidates = super()._get_relevant_documents(
+                    query, run_manager=run_manager, **fetch_kwargs
+                )
+                # The query's embedding is cached by the search
+                query_vector = self.vectorstore.embeddings.embed_query(query)
+                vector_docs = self.rerank(query_vector, candidates, k)
+            except Exception as e:
+                if self.mode == "vector":
+                    raise
+                self.vector_failed(e)
+        return self.fuse(query, k, vector_docs)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        **kwargs: Any,
+    ) -> list[Document]:
+        k = (self.search_kwargs | kwargs).get("k", RETRIEVER_K)
+        fetch_kwargs = kwargs | {"k": max(k, self.fetch_k)}
+
+        async def search() -> list[Document]:
+            candidates = await super(HybridRetriever, self)._aget_relevant_documents(
+                query, run_manager=run_manager, **fetch_kwargs
+            )
+            # The query's embedding is cached by the search
+            query_vector = await self.vectorstore.embeddings.aembed_query(query)
+            return self.rerank(query_vector, candidates, k)
+
+        vector_docs = None
+        if self.use_vector(query):
+            try:
+                if self.mode == "vector":
+                    vector_docs = await search()
+                else:
+                    vector_docs = await asyncio.wait_for(search(), self.vector_timeout)
+            except Exception as e:
+                if self.mode == "vector":
+                    raise
+                self.vector_failed(e)
+        return self.fuse(query, k, vector_docs)
+
+
+class CachedRetriever(HybridRetriever):
+    """
+    Vector store retriever that caches results by the normalized query, the search
+    parameters, and the store's generation, so results are never served for an older
+    version of the collection.
+    """
+
+    cache: LRUCache
+    generation: Callable[[], int]
+
+    def cache_key(self, query: str, kwargs: dict[str, Any]) -> Hashable:
+        """Get the cache key for a query"""
+        search_kwargs = json.dumps(
+            self.search_kwargs | kwargs, sort_keys=True, default=str
+        )
+        return (
+            normalize_query(query),
+            self.search_type,
+            search_kwargs,
+            self.generation(),
+        )
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun, **kwargs: Any
+    ) -> list[Document]:
+        key = self.cache_key(query, kwargs)
+        docs = self.cache.get(key)
+        if docs is None:
+            docs = super()._get_relevant_documents(
+                query, run_manager=run_manager, **kwargs
+            )
+            self.cache.set(key, docs)
+        return [doc.model_copy() for doc in docs]
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        **kwargs: Any,
+    ) -> list[Document]:
+        key = self.cache_key(query, kwargs)
+        docs = self.cache.get(key)
+        if docs is None:
+            docs = await super()._aget_relevant_documents(
+                query, run_manager=run_manager, **kwargs
+            )
+            self.cache.set(key, docs)
+        return [doc.model_copy() for doc in docs]
+
+
+class RagStore:
+    """RAG store for the PDFs of a game, or for those outside any game's directory"""
+
+    def __init__(
+        self,
+        config: Config,
+        client: chromadb.ClientAPI | None,
+        game: str | None = None,
+        embedder: CachedEmbeddings | None = None,
+    ):
+        """Initialize the RAG store, sharing the given embedder if there is one"""
         self.config = config
-        self.pdf_dir = config.pdf_dir
+        self.game = game
+        self.name = collection_name(config, game)
+        self.pdf_dir = (
+            config.pdf_dir if game is None else os.path.join(config.pdf_dir, game)
+        )
         self.client = client
+        self.manifest = get_manifest(config, self.name)
+        self.embedder = embedder if embedder is not None else get_embedder(config)
+        self.index = get_index(config, self.name)
+        self.retrieval_cache = LRUCache(
+            config.retrieval_cache_size, config.retrieval_cache_ttl
+        )
+
+        # Bumped whenever the collection changes, and listeners are called
+        self.generation = 0
+        self.listeners: list[Callable[[], None]] = [self.retrieval_cache.clear]
         self.create_store()
+        self.sync_index()
 
     def create_store(self):
         """Create a new store"""
-        logger.debug(f"Creating store: {self.config.chroma_collection_name}")
-        self.store = Chroma(
-            collection_name=self.config.chroma_collection_name,
-            embedding_function=get_embedder(self.config),
-            client=self.client,
-            collection_metadata={"source": "pdfs"},
-        )
-        self.retriever: VectorStoreRetriever = self.store.as_retriever()
+        logger.debug("Creating store: %s", self.name)
+        if self.config.vector_backend == "numpy":
+            self.store = NumpyVectorStore(
+                get_vectors_path(self.config, self.name),
+                self.embedder,
+                space=self.config.hnsw_space,
+                dtype=self.config.vector_dtype,
+                ivf_min_rows=self.config.ivf_min_chunks,
+                ivf_probes=self.config.ivf_probes,
+            )
+        else:
+            self.store = ChromaStore(
+                collection_name=self.name,
+                embedding_function=self.embedder,
+                client=self.client,
+                collection_metadata=get_collection_metadata(self.config),
+            )
+        self.check_index_settings()
+
+        # Tools hold on to the retriever, so keep it and point it at the new store
+        if hasattr(self, "retriever"):
+            self.retriever.vectorstore = self.store
+        else:
+            self.retriever = CachedRetriever(
+                vectorstore=self.store,
+                index=self.index,
+                mode=self.config.retrieval_mode,
+                vector_timeout=self.config.vector_search_timeout,
+                fetch_k=self.config.retrieval_fetch_k,
+                mmr_lambda=self.config.retrieval_mmr_lambda,
+                min_similarity=self.config.retrieval_min_similarity,
+                token_budget=self.config.retrieval_token_budget,
+                cache=self.retrieval_cache,
+                generation=lambda: self.generation,
+            )
+
+    def index_settings(self) -> dict[str, str | int]:
+        """Get the settings the collection's vector index was built with"""
+        return self.store.index_settings()
+
+    def check_index_settings(self):
+        """
+        Warn if the collection's vector index was built with other settings than the
+        configured ones. They're fixed once the collection is created, so it has to
+        be reset and loaded again to change them.
+        """
+        wanted = get_index_settings(self.config)
+        changed = {
+            key: (value, wanted[key])
+            for key, value in self.index_settings().items()
+            if value != wanted[key]
+        }
+        if changed:
+            logger.warning(
+                "The collection's index settings differ from the config, reset the "
+                "store and load it again to use them: %s",
+                changed,
+            )
 
     async def reset(self):
         """Reset the RAG store"""
-        self.client.delete_collection(name=self.config.chroma_collection_name)
+        self.store.delete_collection()
+        self.manifest.clear()
+        self.manifest.save()
+        self.index.clear()
         self.create_store()
+        self.changed()
+
+    def changed(self):
+        """Note that the collection changed, so anything derived from it is stale"""
+        self.index.save()
+        self.generation += 1
+        for listener in self.listeners:
+            listener()
 
     def get_count(self) -> int:
-        return self.store._collection.count()
+        return self.store.count()
+
+    def stats(self) -> dict[str, dict[str, int | float]]:
+        """Get the hit rates of the embedding and retrieval caches"""
+        return {
+            "embeddings": self.embedder.stats(),
+            "retrieval": self.retrieval_cache.stats(),
+        }
+
+    def sync_index(self):
+        """
+        Rebuild the keyword index from the collection if they don't match, e.g. if
+        the app stopped before the index was saved.
+        """
+        if len(self.index) == self.get_count():
+            return
+
+        logger.info("Rebuilding the keyword index")
+        self.index.clear()
+        offset = 0
+        while True:
+            ids, documents = self.store.scan(INDEX_BATCH_SIZE, offset)
+            if not ids:
+                break
+            self.index.add(ids, documents)
+            offset += len(ids)
+        self.index.save()
+
+    def delete_ids(self, ids: list[str]):
+        """Delete chunks from the store"""
+        for batch in itertools.batched(ids, DELETE_BATCH_SIZE):
+            self.store.delete(ids=list(batch))
+        self.index.remove(ids)
+
+    async def changed_files(self, file_paths: list[str]) -> dict[str, ManifestEntry]:
+        """
+        Compare files against the manifest. Deletes the chunks of removed and changed
+        files, and returns new manifest entries for the files that need loading.
+        """
+        for file_path in self.manifest.missing(file_paths):
+            logger.debug("Removing: %s", file_path)
+            self.delete_ids(self.manifest.remove(file_path).ids)
+
+        changed: dict[str, ManifestEntry] = {}
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            if self.manifest.is_current(file_path, stat):
+                continue
+
+            # The size or modification time changed, so compare the contents
+            file_hash = await asyncio.to_thread(hash_file, file_path)
+            entry = self.manifest.get(file_path)
+            if entry and entry.hash == file_hash:
+                self.manifest.set(file_path, replace(entry, mtime=stat.st_mtime))
+                continue
+
+            if entry:
+                self.delete_ids(entry.ids)
+
+            changed[file_path] = ManifestEntry(
+                size=stat.st_size, mtime=stat.st_mtime, hash=file_hash
+            )
+
+        return changed
+
+    def files(self) -> list[str]:
+        """
+        Get the PDFs in the game's directory, or those outside any game's directory
+        for the store that has no game
+        """
+        pdf_dir = glob.escape(self.pdf_dir)
+        if self.game is None:
+            return glob.glob(pdf_dir + "/*.pdf")
+        return glob.glob(pdf_dir + "/**/*.pdf", recursive=True)
 
     async def load(self, update_func):
-        """Load PDFs to the store from a directory"""
-        file_paths = glob.glob(self.pdf_dir + "/**/*.pdf", recursive=True)
-        loaders = [PyMuPDFLoader(file_path, mode="page") for file_path in file_paths]
+        """Load new and changed PDFs to the store from a directory"""
+        file_paths = self.files()
+        removed = self.manifest.missing(file_paths)
+        changed = await self.changed_files(file_paths)
+        modified = bool(removed or changed)
+        self.manifest.save()
+
+        # Each store starts the progress again, when every game's store is loaded
+        update_func(total=0, progress=0)
+
+        # IDs of the chunks sent to the store for files that are still loading
+        ids: dict[str, list[str]] = defaultdict(list)
+
+        async def track(chunks_stream: ChunkStream) -> ChunkStream:
+            async for file_path, chunks in chunks_stream:
+                if chunks is not None:
+                    ids[file_path].extend(doc.id for doc in chunks)
+                yield file_path, chunks
+
+        try:
+            async with (
+                aclosing(self.parse_files(list(changed))) as parsed,
+                aclosing(track(parsed)) as tracked,
+                aclosing(self.write_chunks(tracked, update_func)) as written,
+            ):
+                async for file_path, chunks in written:
+                    if chunks is not None:
+                        continue
+
+                    # Record each file once it's written, so a cancelled load can resume
+                    entry = changed.pop(file_path)
+                    entry.ids = ids.pop(file_path, [])
+                    self.manifest.set(file_path, entry)
+                    self.manifest.save()
+        finally:
+            # Remove the chunks of files that were only partly loaded
+            for file_ids in ids.values():
+                self.delete_ids(file_ids)
+
+            if modified:
+                self.changed()
+            logger.debug("Cache stats: %s", self.stats())
+
+    async def parse_files(self, file_paths: list[str]) -> ChunkStream:
+        """
+        Parse files in worker processes, yielding their chunks a few pages at a time,
+        then None for each file once it's done. The queue from the workers is bounded,
+        so parsing waits for the store to catch up.
+        """
+        if not file_paths:
+            return
+
+        queue: Queue = PROCESS_CONTEXT.Queue(maxsize=CHUNK_QUEUE_SIZE)
+        stop = PROCESS_CONTEXT.Event()
+        executor = get_executor(self.config, queue, stop)
+        futures: list[Future] = []
+        try:
+            futures = [executor.submit(parse_file, path) for path in file_paths]
+            remaining = set(file_paths)
+            while remaining:
+                try:
+                    file_path, chunks = await asyncio.to_thread(
+                        queue.get, timeout=QUEUE_POLL_INTERVAL
+                    )
+                except Empty:
+                    # Raise the error if a worker failed to parse its file
+                    for future in futures:
+                        if future.done() and future.exception():
+                            raise future.exception()
+                    continue
 
-        pages = []
-        for loader in loaders:
-            logger.debug(f"Loading: {loader.file_path}")
+                if chunks is None:
+                    logger.debug("Parsed: %s", file_path)
+                    remaining.discard(file_path)
+                yield file_path, chunks
+        finally:
+            # Stop the workers if the load was, and wait for them to exit. They
+            # finish the pages they're parsing first, so this takes moments.
+            stop.set()
+            for future in futures:
+                future.cancel()
+            await asyncio.to_thread(drain_queue, queue, futures)
+            await asyncio.to_thread(executor.shutdown)
 
-            async for page in loader.alazy_load():
-                pages.append(page)
+    async def load_pages(
+        self, pages: Iterable[Document], update_func
+    ) -> dict[str, list[str]]:
+        """Load pages into the store. Returns the chunk IDs for each source file."""
+        ids: dict[str, list[str]] = defaultdict(list)
+        try:
+            async for source, chunks in self.write_chunks(
+                split_stream(pages), update_func
+            ):
+                if chunks:
+                    ids[source].extend(doc.id for doc in chunks)
+        finally:
+            if ids:
+                self.changed()
+        return ids
 
-        await self.load_pages(pages, update_func)
+    def upsert(self, chunks: list[Document], embeddings: list[list[float]]):
+        """Write embedded chunks to the store, replacing any with the same IDs"""
+        self.store.upsert_embedded(
+            [doc.id for doc in chunks],
+            embeddings,
+            [doc.page_content for doc in chunks],
+            [doc.metadata for doc in chunks],
+        )
+        self.index.add([doc.id for doc in chunks], [doc.page_content for doc in chunks])
 
-    async def load_pages(self, pages: Iterable[Document], update_func):
-        """Load pages into the store"""
+    async def embed_batch(
+        self, chunks: list[Document], batcher: AdaptiveBatcher
+    ) -> list[list[float]]:
+        """Embed a batch of chunks, retrying with backoff if the embedder fails"""
+        texts = [doc.page_content for doc in chunks]
+        attempt = 1
+        while True:
+            start = time()
+            try:
+                embeddings = await self.embedder.aembed_documents(texts)
+            except Exception as e:
+                batcher.record_error()
+                if attempt >= EMBEDDING_RETRIES:
+                    raise
+                attempt += 1
+                logger.warning(
+                    "Embedding failed, retrying in %.1f seconds: %s", batcher.backoff, e
+                )
+                await asyncio.sleep(batcher.backoff)
+                continue
 
-        text_splitter = get_splitter()
-        doc_splits = text_splitter.split_documents(pages)
+            batcher.record(time() - start)
+            return embeddings
 
+    async def write_chunks(
+        self, chunks_stream: ChunkStream, update_func
+    ) -> ChunkStream:
+        """
+        Embed and write streamed chunks to the store in batches, yielding each batch
+        once it's written. Several batches are embedded at once while earlier ones
+        are written, with the batch size and concurrency adapting to how quickly the
+        embedder responds. A file's None marker is passed on once all of its chunks
+        are written. The progress total grows as chunks arrive.
+        """
         start = time()
-        total = len(doc_splits)
+        total = 0
         completed = 0
-        update_func(total=total)
-
-        # process doc splits in batches
-        for batch in itertools.batched(doc_splits, TEXT_SPLITTER_BATCH_SIZE):
-            await self.store.aadd_documents(batch)
-            completed += len(batch)
-            logger.debug(
-                f"{completed}/{total} pages loaded in {time() - start:.2f} seconds"
+        batcher = AdaptiveBatcher(
+            batch_size=TEXT_SPLITTER_BATCH_SIZE,
+            max_concurrency=self.config.embedding_concurrency,
+        )
+        buffers: dict[str, list[Document]] = defaultdict(list)
+        in_flight: Counter[str] = Counter()
+        finished: list[str] = []  # Files waiting for their batches to be written
+        tasks: set[asyncio.Task] = set()
+        writes: set[asyncio.Future] = set()
+        write_lock = asyncio.Lock()
+
+        async def write_batch(
+            file_path: str, batch: list[Document]
+        ) -> tuple[str, list[Document]]:
+            embeddings = await self.embed_batch(batch, batcher)
+
+            # Writes go one at a time, while other batches are embedding
+            async with write_lock:
+                write = asyncio.ensure_future(
+                    asyncio.to_thread(self.upsert, batch, embeddings)
+                )
+                writes.add(write)
+                write.add_done_callback(writes.discard)
+                await asyncio.shield(write)
+            return file_path, batch
+
+        def submit(file_path: str, batch: list[Document]):
+            in_flight[file_path] += 1
+            tasks.add(asyncio.create_task(write_batch(file_path, batch)))
+
+        async def drain(limit: int) -> ChunkStream:
+            """Yield written batches until no more than limit are in flight"""
+            nonlocal completed
+            while True:
+                done = {task for task in tasks if task.done()}
+                if not done and len(tasks) > limit:
+                    done, _ = await asyncio.wait(tasks, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+
+                for task in done:
+                    tasks.discard(task)
+                    file_path, batch = task.result()
+                    in_flight[file_path] -= 1
+                    completed += len(batch)
+                    logger.debug(
+                        "%d/%d chunks loaded in %.2f seconds",
+                        completed,
+                        total,
+                        time() - start,
+                    )
+                    update_func(advance=len(batch))
+                    yield file_path, batch
+
+            for file_path in [path for path in finished if not in_flight[path]]:
+                finished.remove(file_path)
+                yield file_path, None
+
+        try:
+            async for file_path, chunks in chunks_stream:
+                if chunks is not None:
+                    total += len(chunks)
+                    update_func(total=total)
+                    buffers[file_path].extend(chunks)
+
+                buffer = buffers[file_path]
+                while len(buffer) >= batcher.batch_size or (chunks is None and buffer):
+                    batch = buffer[: batcher.batch_size]
+                    del buffer[: batcher.batch_size]
+
+                    # Wait for a free slot before sending another batch
+                    async for item in drain(batcher.concurrency - 1):
+                        yield item
+                    submit(file_path, batch)
+
+                if chunks is None:
+                    del buffers[file_path]
+                    finished.append(file_path)
+
+                async for item in drain(len(tasks)):
+                    yield item
+
+            # Write whatever is left for streams without end markers
+            for file_path, buffer in buffers.items():
+                for batch in itertools.batched(buffer, batcher.batch_size):
+                    submit(file_path, list(batch))
+
+            async for item in drain(0):
+                yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+            # Let writes already sent to the store finish, so they can be cleaned up
+            await asyncio.gather(*tasks, *writes, return_exceptions=True)
+
+
+class RagStores(metaclass=Singleton):
+    """
+    RAG stores for each game, whose PDFs are in a subdirectory of the PDF directory,
+    and for the PDFs outside them. Stores are opened when they're first used, and
+    share an embedder. Queries search the store of the game they're scoped to, or
+    the active game's, or every store if there's neither.
+    """
+
+    def __init__(
+        self, config: Config, client: chromadb.ClientAPI | None, *args, **kwargs
+    ):
+        """Initialize the registry of stores, with the configured game active"""
+        super().__init__(*args, **kwargs)
+
+        self.config = config
+        self.client = client
+        self.embedder = get_embedder(config)
+        self.stores: dict[str | None, RagStore] = {}
+        self.active = config.game
+
+        # Called with the game whose store changed, or None for the PDFs outside them
+        self.listeners: list[Callable[[str | None], None]] = []
+        self.retriever = GameRetriever(
+            stores=self,
+            k=RETRIEVER_K,
+            token_budget=config.retrieval_token_budget,
+        )
+
+    def games(self) -> list[str]:
+        """Get the names of the games, from the subdirectories of the PDF directory"""
+        return get_games(self.config)
+
+    def get(self, game: str | None = None) -> RagStore:
+        """Get a game's store, opening it if it isn't already"""
+        if game not in self.stores:
+            store = RagStore(self.config, self.client, game, embedder=self.embedder)
+            store.listeners.append(partial(self.changed, game))
+            self.stores[game] = store
+        return self.stores[game]
+
+    def changed(self, game: str | None):
+        """Note that a game's store changed"""
+        for listener in self.listeners:
+            listener(game)
+
+    def targets(self, game: str | None) -> list[str | None]:
+        """Get the stores of a game, or of every game and the PDFs outside them"""
+        return [game] if game is not None else [None, *self.games()]
+
+    def scope(self) -> str | None:
+        """Get the game the current query is scoped to, or the active one"""
+        return query_game.get() or self.active
+
+    def retrievers(self) -> list[CachedRetriever]:
+        """Get the retrievers of the stores in scope"""
+        return [self.get(game).retriever for game in self.targets(self.scope())]
+
+    def split_game(self, text: str) -> tuple[str | None, str]:
+        """
+        Split an "@game" prefix from a query, if it names a game. Names are matched
+        ignoring case, spaces and punctuation, so "@pathfinder2e" names "Pathfinder 2e".
+        """
+
+        def normalize(name: str) -> str:
+            return re.sub(r"[\W_]+", "", name.casefold())
+
+        if match := GAME_PREFIX.match(text.lstrip()):
+            games = {normalize(game): game for game in self.games()}
+            if (game := games.get(normalize(match[1]))) is not None:
+                return game, text.lstrip()[match.end() :]
+        return None, text
+
+    def get_count(self) -> int:
+        """Count the chunks in every store, without opening them"""
+        names = [collection_name(self.config, game) for game in self.targets(None)]
+        if self.client is None:
+            return sum(
+                NumpyVectorStore.stored_count(get_vectors_path(self.config, name))
+                for name in names
+            )
+
+        collections = set(self.client.list_collections())
+        return sum(
+            self.client.get_collection(name).count()
+            for name in names
+            if name in collections
+        )
+
+    async def load(self, update_func, game: str | None = None):
+        """Load the PDFs of a game to its store, or of every game if none is given"""
+        for target in self.targets(game):
+            store = await asyncio.to_thread(self.get, target)
+            await store.load(update_func)
+
+    async def reset(self, game: str | None = None):
+        """Reset a game's store, or every store if no game is given"""
+        for target in self.targets(game):
+            store = await asyncio.to_thread(self.get, target)
+            await store.reset()
+
+
+class GameRetriever(BaseRetriever):
+    """
+    Retriever that searches the stores of the games in scope, fusing their results
+    by rank when there's more than one, and trimming them to the token budget
+    """
+
+    stores: RagStores
+    k: int = RETRIEVER_K
+    token_budget: int = 0
+
+    def combine(self, results: list[list[Document]]) -> list[Document]:
+        """Fuse the results of each store"""
+        if len(results) == 1:
+            return results[0]
+
+        docs = {doc.id: doc for found in results for doc in found}
+        ids = fuse_ranks(*[[doc.id for doc in found] for found in results])
+        return fit_budget([docs[id_] for id_ in ids[: self.k]], self.token_budget)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        config = {"callbacks": run_manager.get_child()}
+        return self.combine(
+            [
+                retriever.invoke(query, config=config)
+                for retriever in self.stores.retrievers()
+            ]
+        )
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        # Stores are opened the first time they're searched, which reads from disk
+        retrievers = await asyncio.to_thread(self.stores.retrievers)
+        config = {"callbacks": run_manager.get_child()}
+        return self.combine(
+            await asyncio.gather(
+                *(retriever.ainvoke(query, config=config) for retriever in retrievers)
             )
-            update_func(advance=len(batch))
+        )
@@ -0,0 +1,24 @@
+from langchain_community.document_loaders import PyMuPDFLoader
+
+from benchmarks.corpus import make_corpus, make_pages, make_queries
+
+
+def test_make_corpus(tmp_path):
+    paths = make_corpus(str(tmp_path), files=2, pages=3)
+    assert len(paths) == 2
+
+    pages = list(PyMuPDFLoader(paths[0]).lazy_load())
+    assert len(pages) == 3
+    assert pages[0].page_content.strip()
+
+    # The same seed gives the same text
+    other = make_corpus(str(tmp_path / "other"), files=1, pages=3)
+    assert list(PyMuPDFLoader(other[0]).lazy_load())[0].page_content == (
+        pages[0].page_content
+    )
+
+
+def test_make_pages_and_queries():
+    assert len(make_pages(5)) == 5
+    assert make_queries(4) == make_queries(4)
+    assert make_queries(4) != make_queries(4, seed=1)
@@ -0,0 +1,39 @@
+import pytest
+from langchain_core.messages import HumanMessage, ToolMessage
+from langchain_core.tools import tool
+
+from benchmarks.fakes import FakeChatModel, FakeEmbeddings
+
+
+@tool
+def retrieve_rules(query: str) -> str:
+    """Look up rules"""
+    return query
+
+
+def test_fake_embeddings():
+    embeddings = FakeEmbeddings(size=4)
+    assert embeddings.embed_query("a") == embeddings.embed_query("a")
+    assert len(embeddings.embed_documents(["a", "b"])) == 2
+
+
+@pytest.mark.asyncio
+async def test_fake_chat_model_streams():
+    model = FakeChatModel(answer="One two three")
+    chunks = [chunk.content async for chunk in model.astream("Question?")]
+    assert chunks == ["One", " two", " three"]
+    assert (await model.ainvoke("Question?")).content == "One two three"
+
+
+@pytest.mark.asyncio
+async def test_fake_chat_model_tools():
+    model = FakeChatModel(answer="Answer").bind_tools([retrieve_rules])
+
+    # Questions are answered with a tool call, and tool results with the answer
+    message = await model.ainvoke([HumanMessage(content="Question?")])
+    assert message.tool_calls[0]["name"] == "retrieve_rules"
+    assert message.tool_calls[0]["args"] == {"query": "Question?"}
+
+    tool_message = ToolMessage(content="rules", tool_call_id="1")
+    message = await model.ainvoke([HumanMessage(content="Question?"), tool_message])
+    assert message.content == "Answer"
@@ -0,0 +1,82 @@
+import os
+
+import click
+import numpy as np
+import pytest
+
+from benchmarks.tune import (
+    exact_neighbors,
+    load_vectors,
+    make_vectors,
+    split_queries,
+    tune,
+)
+from rag_store import collection_name
+
+
+@pytest.mark.parametrize(
+    "space, expected",
+    [
+        ("l2", [[0, 1], [2, 0]]),
+        ("cosine", [[1, 0], [2, 1]]),
+        ("ip", [[1, 0], [2, 1]]),
+    ],
+)
+def test_exact_neighbors(space, expected):
+    corpus = np.array([[1.0, 0.0], [3.0, 0.5], [0.0, 4.0]], dtype=np.float32)
+    queries = np.array([[1.0, 0.2], [0.5, 3.0]], dtype=np.float32)
+    assert exact_neighbors(corpus, queries, 2, space).tolist() == expected
+
+
+def test_split_queries():
+    vectors = make_vectors(10, size=4)
+    assert vectors.shape == (10, 4)
+    assert np.array_equal(vectors, make_vectors(10, size=4))
+
+    corpus, queries = split_queries(vectors, 3)
+    assert corpus.shape == (7, 4) and queries.shape == (3, 4)
+    assert sorted(map(tuple, np.concatenate([corpus, queries]))) == sorted(
+        map(tuple, vectors)
+    )
+
+
+def test_load_vectors(config, chroma_client):
+    os.makedirs(os.path.join(config.pdf_dir, "dnd"))
+    os.makedirs(os.path.join(config.pdf_dir, "pathfinder"))
+    with pytest.raises(click.ClickException):
+        load_vectors(config, chroma_client)
+
+    for game, vector in ((None, [1.0, 0.0]), ("dnd", [0.0, 1.0])):
+        chroma_client.create_collection(collection_name(config, game)).add(
+            ids=["1"], embeddings=[vector]
+        )
+    try:
+        # Every game's vectors are read, or one game's
+        assert load_vectors(config, chroma_client).tolist() == [[1, 0], [0, 1]]
+        assert load_vectors(config, chroma_client, "dnd").tolist() == [[0, 1]]
+        with pytest.raises(click.ClickException):
+            load_vectors(config, chroma_client, "pathfinder")
+    finally:
+        for name in chroma_client.list_collections():
+            chroma_client.delete_collection(name)
+
+
+def test_tune(tmp_path):
+    results = tune(
+        str(tmp_path),
+        make_vectors(60, size=8),
+        queries=5,
+        k=3,
+        space="l2",
+        ms=[4, 8],
+        construction_efs=[20],
+        search_efs=[50],
+    )
+    assert [(r["m"], r["construction_ef"], r["search_ef"]) for r in results] == [
+        (4, 20, 50),
+        (8, 20, 50),
+    ]
+
+    # Searching far more than are indexed finds the exact neighbors
+    assert all(r["recall_at_k"] == 1.0 for r in results)
+    assert all(r["p99_ms"] >= r["p50_ms"] > 0 for r in results)
@@ -1,13 +1,20 @@
 import chromadb
 import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
 
-from rag_store import RagStore
+from rag_store import RagStore, RagStores
 from utils import Config
 
 
 @pytest.fixture
-def config():
-    yield Config(_env_file=".env.test")
+def config(tmp_path):
+    yield Config(
+        _env_file=".env.test",
+        pdf_dir=str(tmp_path / "pdfs"),
+        chroma_path=str(tmp_path / "chroma"),
+        trace_path=str(tmp_path / "traces.jsonl"),
+        memory_path=str(tmp_path / "memory.sqlite"),
+    )
 
 
 @pytest.fixture
@@ -21,5 +28,20 @@ def chroma_client():
 
 @pytest.fixture
 def rag_store(config, chroma_client):
-    RagStore.clear()
-    yield RagStore(config, client=chroma_client)
+    store = RagStore(config, client=chroma_client)
+    store.embedder.embeddings = DeterministicFakeEmbedding(size=8)
+    yield store
+
+    # The ephemeral client is shared, so don't leave chunks for the next test
+    chroma_client.delete_collection(config.chroma_collection_name)
+
+
+@pytest.fixture
+def rag_stores(config, chroma_client):
+    RagStores.clear()
+    stores = RagStores(config, client=chroma_client)
+    stores.embedder.embeddings = DeterministicFakeEmbedding(size=8)
+    yield stores
+
+    for name in chroma_client.list_collections():
+        chroma_client.delete_collection(name)
@@ -0,0 +1,347 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from textual.app import App, ComposeResult
+from textual.widgets import Input, Markdown, Select
+from textual.widgets.markdown import MarkdownBlock
+
+from cli import (
+    GREETING,
+    ChatLog,
+    ChatMessage,
+    CliApp,
+    ManageStore,
+    Prompt,
+    Response,
+    SearchInput,
+    StreamingMarkdown,
+    settled_length,
+)
+from utils import History
+
+
+class ChatLogApp(App):
+    CSS = "ChatLog { height: 10; } Markdown { height: 3; margin: 0; }"
+
+    def compose(self) -> ComposeResult:
+        yield ChatLog(ChatMessage(Response, "Hello"))
+
+
+async def scroll(pilot, chat_log: ChatLog, action) -> None:
+    """Scroll as the user would, and wait for any page of messages to be shown"""
+    action()
+    await pilot.wait_for_scheduled_animations()
+    await pilot.pause()
+    while chat_log.paging:
+        await pilot.pause()
+
+
+@pytest.fixture
+def small_window(monkeypatch):
+    monkeypatch.setattr(ChatLog, "WINDOW", 6)
+    monkeypatch.setattr(ChatLog, "PAGE", 2)
+
+
+@pytest.mark.asyncio
+async def test_chat_log_window(small_window):
+    app = ChatLogApp()
+    async with app.run_test() as pilot:
+        chat_log = app.query_one(ChatLog)
+        for i in range(1, 20):
+            await chat_log.add(Prompt, f"message {i}")
+        await pilot.pause()
+
+        # Only the latest messages have widgets
+        assert len(chat_log.messages) == 20
+        assert len(chat_log.children) == 6
+        assert (chat_log.start, chat_log.end) == (14, 20)
+
+        # Messages that aren't shown are still updated
+        chat_log.update(0, "Hi")
+        assert chat_log.messages[0].text == "Hi"
+        chat_log.update(19, "last")
+        assert chat_log.messages[19].text == "last"
+        assert chat_log.get_widget(19) is chat_log.children[-1]
+
+        # Scrolling to the top shows earlier messages
+        await scroll(pilot, chat_log, chat_log.action_scroll_end)
+        await scroll(pilot, chat_log, chat_log.action_scroll_home)
+        assert (chat_log.start, chat_log.end) == (12, 18)
+        assert len(chat_log.children) == 6
+        assert chat_log.scroll_y == 6  # The messages in view haven't moved
+        assert not chat_log.paging
+
+        # And scrolling back to the bottom shows later ones
+        await scroll(pilot, chat_log, chat_log.action_scroll_end)
+        assert chat_log.end == 20
+
+        # Adding a message while scrolled back shows the latest messages
+        await scroll(pilot, chat_log, chat_log.action_scroll_home)
+        await chat_log.add(Response, "new")
+        assert (chat_log.start, chat_log.end) == (15, 21)
+
+
+@pytest.mark.asyncio
+async def test_chat_prompt():
+    async def on_prompt(text, update_func):
+        update_func(f"You said {text}")
+
+    app = CliApp(on_prompt, on_load_rag=None, on_reset_rag=None)
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        app.screen.query_one(Input).value = "hello"
+        await pilot.press("enter")
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+
+        chat_log = app.screen.query_one(ChatLog)
+        assert [message.text for message in chat_log.messages] == [
+            "How can I help?",
+            "hello",
+            "You said hello",
+        ]
+
+
+@pytest.mark.parametrize(
+    "markdown, settled",
+    [
+        ("One", 0),
+        ("One\n\n", 0),
+        ("One\n\nTw", 5),
+        ("# One\n\nTwo\n\n- thr", 12),
+        ("- One\n\n  more\n", 0),  # The rest of a list item
+        ("```\nOne\n\nTwo\n```\n\nThree", 18),
+        ("```\nOne\n\nTwo\n", 0),  # Still in the code block
+        ("~~~~\n```\n\nTwo\n~~~~\n\nThree", 20),
+    ],
+)
+def test_settled_length(markdown, settled):
+    assert settled_length(markdown) == settled
+
+
+def test_settled_length_from():
+    markdown = "One\n\nTwo\n\nThree"
+    assert settled_length(markdown, 5) == 10
+    assert settled_length(markdown, 10) == 10
+
+
+class StreamingApp(App):
+    def compose(self) -> ComposeResult:
+        yield StreamingMarkdown("One\n\nTw")
+
+
+@pytest.mark.asyncio
+async def test_streaming_markdown():
+    app = StreamingApp()
+    async with app.run_test() as pilot:
+        widget = app.query_one(StreamingMarkdown)
+        first, tail = widget.query_children(Markdown)
+        assert tail.has_class("tail")
+
+        # Finished blocks are kept, and only the last block is parsed again
+        await widget.update("One\n\nTwo\n\nThr")
+        documents = list(widget.query_children(Markdown))
+        assert len(documents) == 3
+        assert documents[0] is first and documents[-1] is tail
+
+        await widget.update("One\n\nTwo\n\nThree")
+        assert list(widget.query_children(Markdown)) == documents
+
+        # Replacing the text starts again
+        await widget.update("Four")
+        documents = list(widget.query_children(Markdown))
+        assert len(documents) == 1
+        assert documents[0] is not tail
+        assert widget.markdown == "Four"
+
+
+@pytest.mark.asyncio
+async def test_streaming_markdown_replaced():
+    app = StreamingApp()
+    async with app.run_test() as pilot:
+        widget = app.query_one(StreamingMarkdown)
+
+        # Text streamed in while the documents are replaced is shown after them
+        replacing = widget.update("Four\n\nFi")
+        widget.update("Four\n\nFive\n\nSi")
+        await replacing
+        await pilot.pause()
+        documents = list(widget.query_children(Markdown))
+        assert [
+            [str(block.renderable) for block in document.query(MarkdownBlock)]
+            for document in documents
+        ] == [["Four"], ["Five"], ["Si"]]
+        assert documents[-1].has_class("tail")
+
+
+@pytest.mark.asyncio
+async def test_chat_prompt_cancelled():
+    cancelled = []
+
+    async def on_prompt(text, update_func):
+        update_func(f"Thinking about {text}")
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            cancelled.append(text)
+            raise
+
+    app = CliApp(on_prompt, on_load_rag=None, on_reset_rag=None)
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        chat_log = app.screen.query_one(ChatLog)
+
+        # A new prompt stops the one before
+        for text in ["first", "second"]:
+            app.screen.query_one(Input).value = text
+            await pilot.press("enter")
+            await pilot.pause()
+        assert cancelled == ["first"]
+        assert chat_log.messages[2].text == "Thinking about first\n\n*Stopped.*"
+
+        # As does escape
+        await pilot.press("escape")
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+        assert cancelled == ["first", "second"]
+        assert chat_log.messages[4].text == "Thinking about second\n\n*Stopped.*"
+
+
+@pytest.mark.asyncio
+async def test_chat_new_conversation():
+    async def on_prompt(text, update_func):
+        update_func(f"Answer to {text}")
+
+    on_new_conversation = AsyncMock()
+    app = CliApp(
+        on_prompt,
+        on_load_rag=None,
+        on_reset_rag=None,
+        on_new_conversation=on_new_conversation,
+    )
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        chat_log = app.screen.query_one(ChatLog)
+        app.screen.query_one(Input).value = "first"
+        await pilot.press("enter")
+        await app.workers.wait_for_complete()
+        assert len(chat_log.messages) == 3
+
+        # The conversation starts again, with only the greeting shown
+        await pilot.press("ctrl+n")
+        await pilot.pause()
+        on_new_conversation.assert_awaited_once()
+        assert [message.text for message in chat_log.messages] == [GREETING]
+        assert len(chat_log.children) == 1
+
+
+@pytest.mark.asyncio
+async def test_chat_search_history():
+    async def on_prompt(text, update_func):
+        update_func(text)
+
+    history = History()
+    for text in ["How does grappling work?", "roll 1d20", "Grapple DC?"]:
+        history.append(text)
+
+    app = CliApp(on_prompt, on_load_rag=None, on_reset_rag=None, history=history)
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        prompt = app.screen.query_one("#prompt", Input)
+        search = app.screen.query_one(SearchInput)
+        prompt.value = "typed"
+
+        # Ctrl-R searches back for what's typed, and again for older matches
+        await pilot.press("ctrl+r", *"grap")
+        assert search.has_focus
+        assert prompt.value == "Grapple DC?"
+        await pilot.press("ctrl+r")
+        assert prompt.value == "How does grappling work?"
+
+        # Escape puts back what was typed before
+        await pilot.press("escape")
+        assert prompt.has_focus
+        assert prompt.value == "typed"
+
+        # Return leaves the match to send
+        await pilot.press("ctrl+r", *"1d", "enter")
+        assert prompt.value == "roll 1d20"
+        await pilot.press("enter")
+        await app.workers.wait_for_complete()
+        assert history.history[-1] == "roll 1d20"
+
+
+@pytest.mark.asyncio
+async def test_chat_select_game():
+    async def on_prompt(text, update_func):
+        update_func(text)
+
+    selected = []
+    app = CliApp(
+        on_prompt,
+        on_load_rag=None,
+        on_reset_rag=None,
+        games_func=lambda: ["dnd", "pathfinder"],
+        on_select_game=selected.append,
+        game="dnd",
+    )
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        select = app.screen.query_one("#game", Select)
+        assert select.display
+        assert select.value == "dnd"
+        assert selected == []
+
+        select.value = "pathfinder"
+        await pilot.pause()
+        select.clear()
+        await pilot.pause()
+        assert selected == ["pathfinder", None]
+        assert app.game is None
+
+
+@pytest.mark.asyncio
+async def test_chat_no_games():
+    async def on_prompt(text, update_func):
+        update_func(text)
+
+    app = CliApp(on_prompt, on_load_rag=None, on_reset_rag=None)
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        assert not app.screen.query_one("#game", Select).display
+
+
+@pytest.mark.asyncio
+async def test_manage_store_game():
+    loaded = []
+    reset = []
+
+    async def on_load_rag(update_func, game):
+        update_func(total=1, advance=1)
+        loaded.append(game)
+
+    async def on_reset_rag(game):
+        reset.append(game)
+
+    app = CliApp(
+        None,
+        on_load_rag=on_load_rag,
+        on_reset_rag=on_reset_rag,
+        games_func=lambda: ["dnd", "pathfinder"],
+        game="dnd",
+    )
+    async with app.run_test() as pilot:
+        await pilot.pause()
+        await app.push_screen(ManageStore())
+        await pilot.pause()
+
+        # The active game's store is managed to start with
+        await pilot.click("#load")
+        await app.workers.wait_for_complete()
+        app.screen.query_one("#store-game", Select).clear()
+        await pilot.click("#reset")
+        await app.workers.wait_for_complete()
+        await pilot.pause()
+        assert loaded == ["dnd"]
+        assert reset == [None]
@@ -0,0 +1,68 @@
+import json
+import os
+import subprocess
+import sys
+
+# Modules that take seconds to import, which the app should only load once it's drawn
+HEAVY_MODULES = [
+    "chromadb",
+    "langchain",
+    "langchain_core",
+    "langgraph",
+    "numpy",
+    "pymupdf",
+    "rag_store",
+    "workflows",
+]
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_main(tmp_path, code: str, **env: str) -> subprocess.CompletedProcess:
+    """Run code that imports the app in a new interpreter, from a scratch directory"""
+    env = (
+        os.environ
+        | env
+        | {
+            "PYTHONPATH": REPO_DIR,
+            "CHAT_MODEL": "model",
+            "CHAT_PROVIDER": "ollama",
+            "CHAT_API_KEY": "key",
+            "EMBEDDING_MODEL": "embeddings",
+            "PDF_DIR": str(tmp_path / "pdfs"),
+            "CHROMA_COLLECTION_NAME": "rag-chroma",
+            "CHROMA_PATH": str(tmp_path / "chroma"),
+        }
+    )
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        cwd=tmp_path,
+    )
+
+
+def test_import_is_lazy(tmp_path):
+    code = (
+        "import json, sys, main; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    result = import_main(tmp_path, code)
+    assert result.returncode == 0
+    assert json.loads(result.stdout.splitlines()[-1]) == []
+
+
+def test_import_has_no_side_effects(tmp_path):
+    # Logging is only started by main(), so importing the app writes no logs
+    assert import_main(tmp_path, "import main").returncode == 0
+    assert not (tmp_path / "logs").exists()
+
+
+def test_invalid_log_level(tmp_path):
+    # A mistyped level is reported with the rest of the config, before the app starts
+    result = import_main(tmp_path, "import main", LOG_LEVEL="verbose")
+    assert result.returncode == 1
+    assert "Failed to load config" in result.stdout
+    assert "log_level" in result.stdout
@@ -1,14 +1,31 @@
 import glob
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Event, Queue
 from unittest.mock import AsyncMock, MagicMock, Mock, call, patch
 
 import pytest
 from langchain_chroma import Chroma
-from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
 from langchain_core.vectorstores import VectorStoreRetriever
 from langchain_text_splitters.base import TextSplitter
 
-from rag_store import RagStore, get_splitter
+from benchmarks.corpus import make_corpus
+from rag_store import (
+    RagStore,
+    RagStores,
+    collection_name,
+    get_client,
+    get_executor,
+    get_splitter,
+    init_worker,
+    parse_file,
+    query_game,
+)
+from utils import CachedEmbeddings, ManifestEntry, NumpyVectorStore
 
 
 def test_get_splitter():
@@ -16,53 +33,435 @@ def test_get_splitter():
     assert isinstance(splitter, TextSplitter)
 
 
+class TopicEmbeddings(Embeddings):
+    """Embeds text by how often it mentions each topic"""
+
+    TOPICS = ("grapple", "spell", "rest")
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return [text.casefold().count(topic) + 0.1 for topic in self.TOPICS]
+
+
+def test_collection_name(config):
+    assert collection_name(config) == config.chroma_collection_name
+
+    names = [collection_name(config, game) for game in ("D&D", "D D", "x" * 100)]
+    assert names[0].startswith(f"{config.chroma_collection_name}-d-d-")
+    assert len(set(names)) == 3
+    assert all(re.fullmatch(r"[a-z0-9][a-z0-9._-]{1,61}[a-z0-9]", n) for n in names)
+
+
+def thread_executor(config, queue, stop):
+    return ThreadPoolExecutor(initializer=init_worker, initargs=(queue, stop))
+
+
+@patch("rag_store.PAGE_BATCH_SIZE", 1)
+@patch("rag_store.PyMuPDFLoader")
+def test_parse_file(mock_loader_class):
+    mock_loader_class.return_value.lazy_load.return_value = iter(
+        [
+            Document(page_content="text_1", metadata={"source": "doc.pdf", "page": 0}),
+            Document(page_content="text_2", metadata={"source": "doc.pdf", "page": 1}),
+        ]
+    )
+    queue = Queue()
+    init_worker(queue, Event())
+    parse_file("doc.pdf")
+    mock_loader_class.assert_called_once_with("doc.pdf", mode="page")
+
+    # Chunks are sent a page at a time, then None once the file is done
+    file_path, first = queue.get()
+    assert file_path == "doc.pdf"
+    assert [chunk.page_content for chunk in first] == ["text_1"]
+    _, second = queue.get()
+    assert [chunk.page_content for chunk in second] == ["text_2"]
+    assert first[0].id != second[0].id
+    assert queue.get() == ("doc.pdf", None)
+
+
+@patch("rag_store.QUEUE_POLL_INTERVAL", 0.01)
+@patch("rag_store.PyMuPDFLoader")
+def test_parse_file_stopped(mock_loader_class):
+    mock_loader_class.return_value.lazy_load.return_value = iter(
+        [Document(page_content="text", metadata={"source": "doc.pdf"})]
+    )
+    queue = Queue(maxsize=1)
+    queue.put("full")
+    stop = Event()
+    init_worker(queue, stop)
+
+    # A worker waiting on a full queue gives up once the load stops
+    timer = threading.Timer(0.05, stop.set)
+    timer.start()
+    parse_file("doc.pdf")
+    timer.join()
+    assert queue.get() == "full"
+    assert queue.empty()
+
+
 class TestRagStore:
     def test_create_store(self, config, chroma_client):
         store = RagStore(config, client=chroma_client)
         assert store.get_count() == 0
         assert isinstance(store.retriever, VectorStoreRetriever)
         assert isinstance(store.store, Chroma)
+        assert isinstance(store.embedder, CachedEmbeddings)
+
+    def test_index_settings(self, rag_store, config, chroma_client):
+        assert rag_store.index_settings() == {
+            "hnsw:space": "l2",
+            "hnsw:M": 16,
+            "hnsw:construction_ef": 100,
+            "hnsw:search_ef": 100,
+        }
+
+        # Settings are kept from when the collection was made, with a warning
+        changed = config.model_copy(update={"hnsw_m": 8, "hnsw_search_ef": 50})
+        with patch("rag_store.logger") as logger:
+            store = RagStore(changed, client=chroma_client)
+        assert store.index_settings()["hnsw:M"] == 16
+        logger.warning.assert_called_once()
+        assert logger.warning.call_args.args[1] == {
+            "hnsw:M": (16, 8),
+            "hnsw:search_ef": (100, 50),
+        }
+
+    @pytest.mark.asyncio
+    async def test_numpy_backend(self, config):
+        config = config.model_copy(update={"vector_backend": "numpy"})
+        assert get_client(config) is None
+        with patch("rag_store.logger") as logger:
+            store = RagStore(config, client=None)
+        logger.warning.assert_not_called()
+        store.embedder.embeddings = DeterministicFakeEmbedding(size=8)
+        assert isinstance(store.store, NumpyVectorStore)
+        assert store.index_settings() == {"space": "l2", "dtype": "float32"}
+
+        pages = [
+            Document(page_content=f"rule {i}", metadata={"source": f"{i}.pdf"})
+            for i in range(3)
+        ]
+        await store.load_pages(pages, Mock())
+        assert store.get_count() == 3
+        store.retriever.mode = "vector"
+        docs = await store.retriever.ainvoke("rule 1")
+        assert docs[0].page_content == "rule 1"
+
+        # Stores are counted without opening them
+        RagStores.clear()
+        assert RagStores(config, client=None).get_count() == 3
+        RagStores.clear()
+
+        await store.reset()
+        assert store.get_count() == 0
+        assert await store.retriever.ainvoke("rule 1") == []
+
+    @pytest.mark.asyncio
+    async def test_retriever_cache(self, rag_store):
+        pages = [Document(page_content="text_1", metadata={"source": "a.pdf"})]
+        await rag_store.load_pages(pages, Mock())
+        retriever = rag_store.retriever
+
+        with patch.object(
+            rag_store.store,
+            "asimilarity_search",
+            wraps=rag_store.store.asimilarity_search,
+        ) as search:
+            docs = await retriever.ainvoke("How do I roll?")
+            assert [doc.page_content for doc in docs] == ["text_1"]
+
+            # Case and whitespace don't matter, but search parameters do
+            assert docs == await retriever.ainvoke("  how do i   ROLL? ")
+            assert search.call_count == 1
+            await retriever.ainvoke("How do I roll?", k=1)
+            assert search.call_count == 2
+
+            # Results for an older version of the store aren't reused
+            await rag_store.load_pages(
+                [Document(page_content="text_2", metadata={"source": "b.pdf"})], Mock()
+            )
+            docs = await retriever.ainvoke("How do I roll?")
+            assert len(docs) == 2
+            assert search.call_count == 3
+
+        assert rag_store.stats()["retrieval"]["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_retriever_hybrid(self, rag_store):
+        pages = [
+            Document(page_content="Sneak Attack damage", metadata={"source": "a.pdf"}),
+            Document(page_content="Saving throws", metadata={"source": "b.pdf"}),
+        ]
+        await rag_store.load_pages(pages, Mock())
+        store = rag_store.store
+
+        # Short queries whose terms are all indexed skip the vector search
+        with patch.object(store, "asimilarity_search") as search:
+            docs = await rag_store.retriever.ainvoke("sneak attack")
+            assert [doc.page_content for doc in docs] == ["Sneak Attack damage"]
+            search.assert_not_called()
+
+        with patch.object(
+            store, "asimilarity_search", wraps=store.asimilarity_search
+        ) as search:
+            docs = await rag_store.retriever.ainvoke("How much damage is sneak attack?")
+            assert docs[0].page_content == "Sneak Attack damage"
+            assert len(docs) == 2
+            search.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_retriever_vector_failed(self, rag_store):
+        pages = [Document(page_content="Sneak Attack", metadata={"source": "a.pdf"})]
+        await rag_store.load_pages(pages, Mock())
+        store = rag_store.store
+
+        # Falls back to keywords, and stops trying vectors for a while
+        with patch.object(
+            store, "asimilarity_search", side_effect=ConnectionError("Ollama is down")
+        ) as search:
+            question = "What does a rogue's sneak attack do?"
+            docs = await rag_store.retriever.ainvoke(question)
+            assert [doc.page_content for doc in docs] == ["Sneak Attack"]
+            await rag_store.retriever.ainvoke(question + " Again?")
+            search.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_retriever_rerank(self, rag_store):
+        rag_store.embedder.embeddings = TopicEmbeddings()
+        pages = [
+            Document(page_content=text, metadata={"source": f"{i}.pdf"})
+            for i, text in enumerate(
+                [
+                    "Grapple to grapple a creature",
+                    "Grapple to grapple a creature, or shove it",
+                    "Grapple with a spell",
+                    "Take a short rest",
+                ]
+            )
+        ]
+        await rag_store.load_pages(pages, Mock())
+        retriever = rag_store.retriever
+        retriever.mode = "vector"
+
+        # Passages that aren't similar enough are left out
+        retriever.min_similarity = 0.5
+        docs = await retriever.ainvoke("Grapple rules?")
+        assert len(docs) == 3
+        assert "Take a short rest" not in [doc.page_content for doc in docs]
+
+        # By relevance alone, the top passages are near copies
+        retriever.mmr_lambda = 1.0
+        docs = await retriever.ainvoke("How do I grapple?", k=2)
+        assert docs[1].page_content.startswith("Grapple to grapple")
+
+        # Otherwise a passage like one already chosen is passed over
+        retriever.mmr_lambda = 0.5
+        docs = await retriever.ainvoke("So how do I grapple?", k=2)
+        assert docs[1].page_content == "Grapple with a spell"
+
+    @pytest.mark.asyncio
+    async def test_retriever_merge(self, rag_store):
+        text = " ".join(f"Grappling rule {i}." for i in range(150))
+        pages = [Document(page_content=text, metadata={"source": "a.pdf", "page": 0})]
+        await rag_store.load_pages(pages, Mock())
+        assert rag_store.get_count() > 1
+        retriever = rag_store.retriever
+        retriever.mode = "lexical"
+
+        # Overlapping chunks of a page are sent as one
+        docs = await retriever.ainvoke("grappling rule")
+        assert [doc.page_content for doc in docs] == [text]
+
+        # And cut down to the token budget
+        retriever.token_budget = 100
+        docs = await retriever.ainvoke("rule grappling")
+        assert [doc.page_content for doc in docs] == [text[:400]]
+
+    @pytest.mark.asyncio
+    async def test_sync_index(self, rag_store, config, chroma_client):
+        pages = [
+            Document(page_content=f"text_{i}", metadata={"source": "a.pdf"})
+            for i in range(3)
+        ]
+        await rag_store.load_pages(pages, Mock())
+        assert len(rag_store.index) == 3
+        os.remove(rag_store.index.path)
+
+        # A missing index is rebuilt from the collection
+        store = RagStore(config, client=chroma_client)
+        assert len(store.index) == 3
+        assert os.path.exists(store.index.path)
+
+        await store.reset()
+        assert len(store.index) == 0
+
+    @pytest.mark.asyncio
+    async def test_retriever_after_reset(self, rag_store):
+        retriever = rag_store.retriever
+        pages = [Document(page_content="text_1", metadata={"source": "a.pdf"})]
+        await rag_store.load_pages(pages, Mock())
+        assert len(await retriever.ainvoke("text")) == 1
+
+        # The same retriever searches the new collection
+        await rag_store.reset()
+        assert rag_store.retriever is retriever
+        assert await retriever.ainvoke("text") == []
 
     @pytest.mark.asyncio
     async def test_reset(self, rag_store):
+        listener = Mock()
+        rag_store.listeners.append(listener)
         await rag_store.reset()
         assert rag_store.get_count() == 0
+        assert rag_store.generation == 1
+        listener.assert_called_once()
 
     def test_get_count(self, rag_store):
         assert rag_store.get_count() == 0
 
     @pytest.mark.asyncio
+    @patch("rag_store.get_executor", side_effect=thread_executor)
     @patch("rag_store.PyMuPDFLoader")
-    async def test_load(self, mock_loader_class, rag_store, monkeypatch):
-        file_paths = ["pdfs/doc1.pdf", "pdfs/doc2.pdf"]
+    async def test_load(
+        self,
+        mock_loader_class,
+        mock_get_executor,
+        rag_store,
+        monkeypatch,
+        tmp_path,
+    ):
+        file_paths = [str(tmp_path / "doc1.pdf"), str(tmp_path / "doc2.pdf")]
+        for i, file_path in enumerate(file_paths):
+            with open(file_path, "w") as f:
+                f.write(f"pdf {i}")
         monkeypatch.setattr(glob, "glob", MagicMock(return_value=file_paths))
 
-        mock_loader_instance = AsyncMock(PyMuPDFLoader)
-        mock_loader_instance.file_path = "mock_file_path.pdf"
-        mock_lazy_load = MagicMock()
-        mock_lazy_load.__aiter__.return_value = [{"content": "page1"}]
-        mock_loader_instance.alazy_load.return_value = mock_lazy_load
-
-        mock_loader_class.return_value = mock_loader_instance
-
-        rag_store.load_pages = AsyncMock()
+        mock_loader_class.side_effect = lambda file_path, mode: Mock(
+            lazy_load=Mock(
+                return_value=iter(
+                    [Document(page_content="page1", metadata={"source": file_path})]
+                )
+            )
+        )
 
         update_func = Mock()
 
         await rag_store.load(update_func)
 
-        glob.glob.assert_called_once_with(
-            rag_store.config.pdf_dir + "/**/*.pdf", recursive=True
-        )
+        glob.glob.assert_called_once_with(rag_store.config.pdf_dir + "/*.pdf")
         assert mock_loader_class.call_count == len(file_paths)
-        rag_store.load_pages.assert_awaited_once_with(
-            [{"content": "page1"}, {"content": "page1"}], update_func
+        assert rag_store.get_count() == len(file_paths)
+        assert update_func.call_args_list[0] == call(total=0, progress=0)
+        assert call(total=2) in update_func.call_args_list
+        assert call(advance=1) in update_func.call_args_list
+        for file_path in file_paths:
+            assert len(rag_store.manifest.get(file_path).ids) == 1
+
+        assert rag_store.generation == 1
+
+        # Unchanged files are skipped on the next load, without starting workers
+        mock_loader_class.reset_mock()
+        mock_get_executor.reset_mock()
+        await rag_store.load(update_func)
+        assert mock_loader_class.call_count == 0
+        mock_get_executor.assert_not_called()
+        assert rag_store.get_count() == len(file_paths)
+        assert rag_store.generation == 1
+
+    @pytest.mark.asyncio
+    @patch("rag_store.get_executor", side_effect=thread_executor)
+    @patch("rag_store.PyMuPDFLoader")
+    async def test_load_changed_and_removed(
+        self,
+        mock_loader_class,
+        mock_get_executor,
+        rag_store,
+        monkeypatch,
+        tmp_path,
+    ):
+        file_path = str(tmp_path / "doc1.pdf")
+        with open(file_path, "w") as f:
+            f.write("new contents")
+        monkeypatch.setattr(glob, "glob", MagicMock(return_value=[file_path]))
+
+        mock_loader_class.return_value.lazy_load.return_value = iter(
+            [Document(page_content="page1", metadata={"source": file_path})]
         )
 
-    @patch.object(Chroma, "aadd_documents")
+        rag_store.manifest.set(file_path, ManifestEntry(1, 0.0, "old", ["old_id"]))
+        rag_store.manifest.set("removed.pdf", ManifestEntry(1, 0.0, "x", ["gone"]))
+        rag_store.delete_ids = Mock()
+
+        await rag_store.load(Mock())
+
+        assert rag_store.delete_ids.call_args_list == [call(["gone"]), call(["old_id"])]
+        assert rag_store.manifest.get("removed.pdf") is None
+        assert len(rag_store.manifest.get(file_path).ids) == 1
+        assert rag_store.manifest.get(file_path).ids != ["old_id"]
+
+    @pytest.mark.asyncio
+    @patch("rag_store.get_executor", side_effect=thread_executor)
+    @patch("rag_store.PyMuPDFLoader")
+    async def test_load_failed(
+        self,
+        mock_loader_class,
+        mock_get_executor,
+        rag_store,
+        monkeypatch,
+        tmp_path,
+    ):
+        file_path = str(tmp_path / "doc1.pdf")
+        with open(file_path, "w") as f:
+            f.write("contents")
+        monkeypatch.setattr(glob, "glob", MagicMock(return_value=[file_path]))
+
+        def pages():
+            yield Document(page_content="page1", metadata={"source": file_path})
+            raise ValueError("Corrupt PDF")
+
+        mock_loader_class.return_value.lazy_load.return_value = pages()
+        rag_store.delete_ids = Mock()
+
+        with (
+            patch("rag_store.PAGE_BATCH_SIZE", 1),
+            patch("rag_store.TEXT_SPLITTER_BATCH_SIZE", 1),
+            pytest.raises(ValueError),
+        ):
+            await rag_store.load(Mock())
+
+        # The chunks written before the error are removed
+        assert rag_store.manifest.get(file_path) is None
+        assert len(rag_store.delete_ids.call_args.args[0]) == 1
+
+    @pytest.mark.asyncio
+    @patch("rag_store.CHUNK_QUEUE_SIZE", 1)
+    async def test_parse_files_stopped(self, rag_store, tmp_path):
+        paths = make_corpus(str(tmp_path / "pdfs"), files=4, pages=30)
+        executors = []
+
+        def process_executor(*args):
+            executors.append(get_executor(*args))
+            return executors[-1]
+
+        with patch("rag_store.get_executor", side_effect=process_executor):
+            parsed = rag_store.parse_files(paths)
+            await anext(parsed)
+            processes = list(executors[0]._processes.values())
+            await parsed.aclose()
+
+        # Workers blocked on the full queue are stopped, and their processes exit
+        assert processes
+        assert executors[0]._mp_context.get_start_method() == "spawn"
+        for process in processes:
+            process.join(timeout=5)
+            assert not process.is_alive()
+
     @patch("rag_store.get_splitter")
     @pytest.mark.asyncio
-    async def test_load_pages(self, mock_get_splitter, mock_aadd_documents, rag_store):
+    async def test_load_pages(self, mock_get_splitter, rag_store):
         update_func = Mock()
         documents = [
             Document(page_content="text_1"),
@@ -77,3 +476,178 @@ class TestRagStore:
         calls = update_func.call_args_list
         assert calls[0] == call(total=3)
         assert calls[1] == call(advance=3)
+
+    @pytest.mark.asyncio
+    async def test_load_pages_ids(self, rag_store):
+        pages = [
+            Document(page_content="text_1", metadata={"source": "a.pdf", "page": 0}),
+            Document(page_content="text_1", metadata={"source": "a.pdf", "page": 0}),
+            Document(page_content="text_2", metadata={"source": "b.pdf", "page": 0}),
+        ]
+        ids = await rag_store.load_pages(pages, Mock())
+
+        # IDs are unique within a file, and stable across loads
+        assert len(ids["a.pdf"]) == 2
+        assert len(set(ids["a.pdf"])) == 2
+        assert rag_store.get_count() == 3
+
+        assert ids == await rag_store.load_pages(pages, Mock())
+        assert rag_store.get_count() == 3
+
+    @pytest.mark.asyncio
+    @patch("rag_store.asyncio.sleep", new_callable=AsyncMock)
+    async def test_load_pages_retry(self, mock_sleep, rag_store):
+        embeddings = AsyncMock(DeterministicFakeEmbedding)
+        embeddings.aembed_documents.side_effect = [
+            ConnectionError("Ollama is busy"),
+            [[0.1] * 8],
+        ]
+        rag_store.embedder.embeddings = embeddings
+        pages = [Document(page_content="text_1", metadata={"source": "a.pdf"})]
+
+        await rag_store.load_pages(pages, Mock())
+
+        assert embeddings.aembed_documents.await_count == 2
+        mock_sleep.assert_awaited_once()
+        assert rag_store.get_count() == 1
+
+    @pytest.mark.asyncio
+    @patch("rag_store.TEXT_SPLITTER_BATCH_SIZE", 8)
+    async def test_load_pages_concurrent(self, rag_store):
+        pages = [
+            Document(page_content=f"text_{i}", metadata={"source": "a.pdf"})
+            for i in range(100)
+        ]
+        update_func = Mock()
+
+        ids = await rag_store.load_pages(pages, update_func)
+
+        assert len(ids["a.pdf"]) == 100
+        assert rag_store.get_count() == 100
+        advanced = sum(c.kwargs.get("advance", 0) for c in update_func.call_args_list)
+        assert advanced == 100
+
+
+class TestRagStores:
+    def make_games(self, config, *games: str):
+        for game in games:
+            os.makedirs(os.path.join(config.pdf_dir, game))
+
+    def test_games(self, rag_stores, config):
+        assert rag_stores.games() == []
+        self.make_games(config, "Pathfinder 2e", "dnd", ".hidden")
+        assert rag_stores.games() == ["Pathfinder 2e", "dnd"]
+
+        # Stores are opened once, with the embedder shared
+        store = rag_stores.get("dnd")
+        assert rag_stores.get("dnd") is store
+        assert store.pdf_dir == os.path.join(config.pdf_dir, "dnd")
+        assert store.embedder is rag_stores.get().embedder
+
+    def test_split_game(self, rag_stores, config):
+        self.make_games(config, "Pathfinder 2e", "dnd")
+        assert rag_stores.split_game("@DnD  How do I grapple?") == (
+            "dnd",
+            "How do I grapple?",
+        )
+        assert rag_stores.split_game("@pathfinder2e Flanking?") == (
+            "Pathfinder 2e",
+            "Flanking?",
+        )
+        assert rag_stores.split_game("@gurps Flanking?") == (None, "@gurps Flanking?")
+        assert rag_stores.split_game("@dnd") == (None, "@dnd")
+
+    @pytest.mark.asyncio
+    async def test_retriever(self, rag_stores, config):
+        self.make_games(config, "dnd", "pathfinder")
+        for game in (None, "dnd", "pathfinder"):
+            name = game or "shared"
+            pages = [
+                Document(page_content=f"{name} grapple", metadata={"source": name})
+            ]
+            await rag_stores.get(game).load_pages(pages, Mock())
+
+        async def search() -> set[str]:
+            docs = await rag_stores.retriever.ainvoke("grapple")
+            return {doc.page_content for doc in docs}
+
+        # Every store is searched unless there's a game
+        assert await search() == {
+            "shared grapple",
+            "dnd grapple",
+            "pathfinder grapple",
+        }
+        rag_stores.active = "dnd"
+        assert await search() == {"dnd grapple"}
+
+        # A query scoped to a game overrides the active one
+        token = query_game.set("pathfinder")
+        try:
+            assert await search() == {"pathfinder grapple"}
+        finally:
+            query_game.reset(token)
+
+    @pytest.mark.asyncio
+    @patch("rag_store.get_executor", side_effect=thread_executor)
+    @patch("rag_store.PyMuPDFLoader")
+    async def test_load_progress(
+        self, mock_loader_class, mock_get_executor, rag_stores, config
+    ):
+        self.make_games(config, "dnd", "pathfinder")
+        for game in ("dnd", "pathfinder"):
+            for i in range(3):
+                with open(os.path.join(config.pdf_dir, game, f"{i}.pdf"), "w") as f:
+                    f.write(f"{game} {i}")
+        mock_loader_class.side_effect = lambda file_path, mode: Mock(
+            lazy_load=Mock(
+                return_value=iter(
+                    [Document(page_content="page", metadata={"source": file_path})]
+                )
+            )
+        )
+
+        # Like the progress bar, which keeps its progress unless it's set
+        bar = {"total": None, "progress": 0}
+        shown = []
+
+        def update_func(total=None, progress=None, advance=0):
+            if total is not None:
+                bar["total"] = total
+            if progress is not None:
+                bar["progress"] = progress
+            bar["progress"] += advance
+            shown.append((bar["progress"], bar["total"]))
+
+        await rag_stores.load(update_func)
+        assert rag_stores.get_count() == 6
+        assert all(progress <= total for progress, total in shown)
+        assert shown[-1] == (3, 3)
+
+    @pytest.mark.asyncio
+    async def test_load_and_reset(self, rag_stores, config):
+        self.make_games(config, "dnd", "pathfinder")
+        listener = Mock()
+        rag_stores.listeners.append(listener)
+        for game in ("dnd", "pathfinder"):
+            pages = [Document(page_content=game, metadata={"source": game})]
+            await rag_stores.get(game).load_pages(pages, Mock())
+        assert rag_stores.get_count() == 2
+        assert listener.call_args_list == [call("dnd"), call("pathfinder")]
+
+        # Stores are reset on their own, or all together
+        await rag_stores.reset("dnd")
+        assert rag_stores.get("dnd").get_count() == 0
+        assert rag_stores.get("pathfinder").get_count() == 1
+        await rag_stores.reset()
+        assert rag_stores.get_count() == 0
+
+        with patch.object(RagStore, "load", autospec=True) as load:
+            await rag_stores.load(Mock(), "dnd")
+            assert [c.args[0].game for c in load.call_args_list] == ["dnd"]
+            load.reset_mock()
+            await rag_stores.load(Mock())
+            assert [c.args[0].game for c in load.call_args_list] == [
+                None,
+                "dnd",
+                "pathfinder",
+            ]
@@ -1,13 +1,21 @@
+import asyncio
+import json
+import os
+import sqlite3
+from contextlib import closing
 from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Sequence, Union
 from unittest.mock import Mock, call, patch
 
 import pytest
+import pytest_asyncio
 from langchain_core.language_models.base import LanguageModelInput
 from langchain_core.language_models.fake_chat_models import FakeListChatModel
 from langchain_core.messages import (
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     HumanMessage,
+    RemoveMessage,
     ToolMessage,
 )
 from langchain_core.runnables import Runnable
@@ -15,8 +23,19 @@ from langchain_core.tools import BaseTool
 from langgraph.graph import MessagesState
 from langgraph.graph.state import CompiledStateGraph
 
-from tools.dice import DICE_TOOL_NAME
-from workflows import DICE_NODE, GENERATOR_NODE, LLM, DiceMessage
+from rag_store import query_game
+from tools.dice import DICE_ODDS_TOOL_NAME, DICE_TOOL_NAME
+from workflows import (
+    AGENT_NODE,
+    DICE_NODE,
+    GENERATOR_NODE,
+    LLM,
+    DiceMessage,
+    compact_history,
+    load_prompt,
+    split_turn,
+)
+from utils import Singleton
 
 fake_responses = [
     "response 1",
@@ -46,7 +65,7 @@ class FakeModel(FakeListChatModel):
 
 
 async def fake_astream_events(
-    messages: List[BaseMessage],
+    messages: List[BaseMessage], config: Optional[Dict[str, Any]] = None
 ) -> AsyncGenerator[Dict[str, Any], None]:
     for event in fake_stream_events:
         yield {
@@ -56,40 +75,140 @@ async def fake_astream_events(
         }
 
 
+fake_token_events = [
+    {"event": "on_chat_model_start", "metadata": {"langgraph_node": AGENT_NODE}},
+    {
+        "event": "on_chat_model_stream",
+        "metadata": {"langgraph_node": AGENT_NODE},
+        "data": {
+            "chunk": AIMessageChunk(
+                content="",
+                tool_call_chunks=[{"name": "retrieve_rules", "args": "", "index": 0}],
+            )
+        },
+    },
+    {"event": "on_chat_model_start", "metadata": {"langgraph_node": GENERATOR_NODE}},
+    *[
+        {
+            "event": "on_chat_model_stream",
+            "metadata": {"langgraph_node": GENERATOR_NODE},
+            "data": {"chunk": AIMessageChunk(content=token)},
+        }
+        for token in ["Grappling ", "is ", "contested"]
+    ],
+    {
+        "event": "on_chain_end",
+        "name": "LangGraph",
+        "data": {
+            "output": {"messages": [AIMessage(content="Grappling is contested.")]}
+        },
+    },
+]
+
+
+async def fake_astream_token_events(
+    messages: List[BaseMessage], config: Optional[Dict[str, Any]] = None
+) -> AsyncGenerator[Dict[str, Any], None]:
+    for event in fake_token_events:
+        yield event
+
+
 initial_state = MessagesState(messages=[HumanMessage(content="test")])
 
 
+@pytest_asyncio.fixture(autouse=True, loop_scope="function")
+async def clear_llm():
+    # The model is built once per LLM, so each test needs its own
+    LLM.clear()
+    yield
+
+    # The conversation memory's connection has a thread to stop
+    if (llm := Singleton._instances.get(LLM)) is not None:
+        await llm.close()
+
+
+def test_load_prompt(tmp_path):
+    prompt = load_prompt()
+    assert set(prompt.input_variables) == {"context", "question"}
+
+    path = tmp_path / "prompt.txt"
+    path.write_text("Answer {question} using {context}")
+    prompt = load_prompt(str(path))
+    messages = prompt.invoke({"question": "Q", "context": "C"}).to_messages()
+    assert messages[0].content == "Answer Q using C"
+
+
+conversation = [
+    HumanMessage(content="How does grappling work?", id="1"),
+    AIMessage(
+        content="",
+        tool_calls=[{"name": "retrieve_rules", "args": {}, "id": "call"}],
+        id="2",
+    ),
+    ToolMessage(content="Grappling rules...", tool_call_id="call", id="3"),
+    AIMessage(content="Grappling is contested.", id="4"),
+    HumanMessage(content="roll 1d20", id="5"),
+    ToolMessage(name=DICE_TOOL_NAME, content="12", tool_call_id="roll", id="6"),
+    DiceMessage(content="Dice Roll! 12", id="7"),
+    HumanMessage(content="Can I escape?", id="8"),
+]
+
+
+def test_split_turn():
+    earlier, turn = split_turn(conversation)
+    assert earlier == conversation[:-1]
+    assert turn == conversation[-1:]
+    assert split_turn([]) == ([], [])
+
+
+def test_compact_history():
+    earlier, _ = split_turn(conversation)
+
+    # Tool calls and their outputs are left out, and dice rolls become answers
+    history = compact_history(earlier, max_tokens=1000)
+    assert [message.id for message in history] == ["1", "4", "5", "7"]
+    assert type(history[-1]) is AIMessage
+
+    # Only the latest turns that fit in the budget are kept
+    history = compact_history(earlier, max_tokens=20)
+    assert [message.id for message in history] == ["5", "7"]
+    assert compact_history(earlier, max_tokens=0) == []
+
+
 class TestLLM:
     @patch("workflows.init_chat_model")
-    def test_init(self, init_chat_model, config, rag_store):
+    def test_init(self, init_chat_model, config, rag_stores):
         init_chat_model.return_value = FakeModel(responses=fake_responses)
-        llm = LLM(config, rag_store)
+        llm = LLM(config, rag_stores)
         assert llm.config == config
 
     @pytest.mark.asyncio
     @patch("workflows.init_chat_model")
-    async def test_initialize_workflow(self, init_chat_model, config, rag_store):
+    async def test_initialize_workflow(self, init_chat_model, config, rag_stores):
         init_chat_model.return_value = FakeModel(responses=fake_responses)
-        llm = LLM(config, rag_store)
+        llm = LLM(config, rag_stores)
         await llm.initialize_workflow()
         assert llm.agent is not None
         assert isinstance(llm.agent, CompiledStateGraph)
 
     @pytest.mark.asyncio
     @patch("workflows.init_chat_model")
-    async def test_generator_node(self, init_chat_model, config, rag_store):
+    async def test_generator_node(self, init_chat_model, config, rag_stores):
         init_chat_model.return_value = FakeModel(responses=fake_responses)
-        llm = LLM(config, rag_store)
+        llm = LLM(config, rag_stores)
         await llm.initialize_workflow()
         state = initial_state
         response = await llm.generator_node(state)
         assert response["messages"][-1].content == fake_responses[0]
 
+        # The model is built once, not per question
+        assert init_chat_model.call_count == 1
+
     @pytest.mark.asyncio
     @patch("workflows.init_chat_model")
-    async def test_agent_node(self, init_chat_model, config, rag_store):
+    async def test_agent_node(self, init_chat_model, config, rag_stores):
         init_chat_model.return_value = FakeModel(responses=fake_responses)
-        llm = LLM(config, rag_store)
+        llm = LLM(config, rag_stores)
         await llm.initialize_workflow()
         state = initial_state
         response = await llm.agent_node(state)
@@ -97,16 +216,18 @@ class TestLLM:
 
     @pytest.mark.asyncio
     @patch("workflows.init_chat_model")
-    async def test_dice_node(self, init_chat_model, config, rag_store):
+    async def test_dice_node(self, init_chat_model, config, rag_stores):
         init_chat_model.return_value = FakeModel(responses=fake_responses)
-        llm = LLM(config, rag_store)
+        llm = LLM(config, rag_stores)
         await llm.initialize_workflow()
         state = initial_state
         response = await llm.dice_node(state)
         assert response["messages"][-1].content == initial_state["messages"][-1].content
 
-    def test_tools_response_condition(self, config, rag_store):
-        llm = LLM(config, rag_store)
+    @patch("workflows.init_chat_model")
+    def test_tools_response_condition(self, init_chat_model, config, rag_stores):
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
         state = initial_state
         response = llm.tools_response_condition(state)
         assert response == GENERATOR_NODE
@@ -117,11 +238,17 @@ class TestLLM:
         response = llm.tools_response_condition(state)
         assert response == DICE_NODE
 
+        state["messages"][-1] = ToolMessage(
+            name=DICE_ODDS_TOOL_NAME, content="1d20 averages 10.5", tool_call_id="6"
+        )
+        response = llm.tools_response_condition(state)
+        assert response == DICE_NODE
+
     @pytest.mark.asyncio
     @patch("workflows.init_chat_model")
-    async def test_stream_response(self, init_chat_model, config, rag_store):
+    async def test_stream_response(self, init_chat_model, config, rag_stores):
         init_chat_model.return_value = FakeModel(responses=fake_responses)
-        llm = LLM(config, rag_store)
+        llm = LLM(config, rag_stores)
         await llm.initialize_workflow()
         update_func = Mock()
         llm.agent.astream_events = fake_astream_events
@@ -133,3 +260,250 @@ class TestLLM:
             call("This is an AI "),
             call("This is an AI response"),
         ]
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    async def test_stream_response_traced(self, init_chat_model, config, rag_stores):
+        init_chat_model.return_value = FakeModel(responses=["The answer"])
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+        await llm.stream_response("test", Mock())
+
+        trace = llm.tracer.last
+        assert [(span.kind, span.name) for span in trace.spans] == [
+            ("node", AGENT_NODE),
+            ("model", "FakeModel"),
+        ]
+        assert trace.first_output is not None
+        assert trace.summary().startswith(f"{AGENT_NODE} ")
+
+        # Traces are written in the background, and all of them once it's closed
+        llm.tracer.close()
+        with open(config.trace_path) as f:
+            assert json.loads(f.readline())["question"] == "test"
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    async def test_stream_response_tokens(self, init_chat_model, config, rag_stores):
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+        update_func = Mock()
+        llm.agent.astream_events = fake_astream_token_events
+        await llm.stream_response("test", update_func)
+
+        # Tokens are shown as they arrive, then replaced by the final message
+        assert update_func.call_args_list == [
+            call("Grappling "),
+            call("Grappling is "),
+            call("Grappling is contested"),
+            call("Grappling is contested."),
+        ]
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    async def test_stream_response_cancelled(self, init_chat_model, config, rag_stores):
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+        closed = asyncio.Event()
+
+        async def endless_events(messages, config=None):
+            try:
+                yield fake_token_events[3]
+                await asyncio.Event().wait()
+            finally:
+                closed.set()
+
+        llm.agent.astream_events = endless_events
+        update_func = Mock()
+        task = asyncio.create_task(
+            llm.stream_response("How does grappling work?", update_func)
+        )
+        while not update_func.called:
+            await asyncio.sleep(0)
+
+        # Cancelling the response closes the stream, and nothing is cached
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert closed.is_set()
+        assert llm.tracer.last.cancelled
+        assert len(llm.answer_cache(None)) == 0
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    async def test_stream_response_cached(self, init_chat_model, config, rag_stores):
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+        llm.agent.astream_events = Mock(side_effect=fake_astream_token_events)
+
+        await llm.stream_response("How does grappling work?", Mock())
+        assert llm.agent.astream_events.call_count == 1
+
+        # The same question is answered from the cache
+        update_func = Mock()
+        await llm.stream_response("How does grappling work?", update_func)
+        assert llm.agent.astream_events.call_count == 1
+        update_func.assert_called_once_with("Grappling is contested.")
+
+        # Changing the store clears the cache
+        await rag_stores.reset()
+        await llm.stream_response("How does grappling work?", Mock())
+        assert llm.agent.astream_events.call_count == 2
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    async def test_stream_response_game(self, init_chat_model, config, rag_stores):
+        os.makedirs(os.path.join(config.pdf_dir, "dnd"))
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+        scopes = []
+
+        async def fake_events(messages, config=None):
+            scopes.append((query_game.get(), messages["messages"][0].content))
+            async for event in fake_astream_token_events(messages, config):
+                yield event
+
+        # The prefix scopes the search to the game, and isn't sent to the model
+        llm.agent.astream_events = fake_events
+        await llm.stream_response("@dnd How does grappling work?", Mock())
+        assert scopes == [("dnd", "How does grappling work?")]
+        assert query_game.get() is None
+
+        # Answers are kept by game, and forgotten when its store changes
+        assert len(llm.answer_cache("dnd")) == 1
+        assert len(llm.answer_cache(None)) == 0
+        await rag_stores.reset("dnd")
+        assert len(llm.answer_cache("dnd")) == 0
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    @patch("tools.dice.Roller.roll", return_value=12)
+    async def test_stream_response_dice_expression(
+        self, mock_roll, init_chat_model, config, rag_stores
+    ):
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+        llm.agent.astream_events = Mock()
+        rag_stores.embedder.embeddings = Mock()
+
+        # Dice are rolled without the model or the embedder
+        update_func = Mock()
+        await llm.stream_response("roll 2d6 + 5", update_func)
+        llm.agent.astream_events.assert_not_called()
+        rag_stores.embedder.embeddings.assert_not_called()
+        (text,), _ = update_func.call_args
+        assert text.startswith("Dice Roll!")
+        assert text.endswith("12")
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    async def test_stream_response_dice_not_cached(
+        self, init_chat_model, config, rag_stores
+    ):
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+
+        async def fake_dice_events(messages, config=None):
+            yield {
+                "event": "on_chain_end",
+                "name": "LangGraph",
+                "data": {
+                    "output": {
+                        "messages": [
+                            HumanMessage(content="roll 2d6 for my damage"),
+                            ToolMessage(
+                                name=DICE_TOOL_NAME, content="7", tool_call_id="1"
+                            ),
+                            DiceMessage(content="Dice Roll! 7"),
+                        ]
+                    }
+                },
+            }
+
+        # Phrases that aren't just a dice expression go through the model
+        llm.agent.astream_events = Mock(side_effect=fake_dice_events)
+        await llm.stream_response("roll 2d6 for my damage", Mock())
+        await llm.stream_response("roll 2d6 for my damage", Mock())
+        assert llm.agent.astream_events.call_count == 2
+        assert len(llm.answer_cache(None)) == 0
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    async def test_agent_node_history(self, init_chat_model, config, rag_stores):
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+
+        # Stale tool outputs are dropped from the conversation
+        response = await llm.agent_node(MessagesState(messages=conversation))
+        removed = [m.id for m in response["messages"] if isinstance(m, RemoveMessage)]
+        assert removed == ["2", "3", "6"]
+        assert response["messages"][-1].content == fake_responses[0]
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    async def test_stream_response_memory(self, init_chat_model, config, rag_stores):
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+        await llm.stream_response("How does grappling work?", Mock())
+        await llm.stream_response("roll 1d20", Mock())
+        await llm.stream_response("Can I escape?", Mock())
+
+        # Follow-on questions aren't cached, since they depend on what came before
+        assert len(llm.answer_cache(None)) == 1
+
+        # Only the latest checkpoint is kept, since it holds the whole conversation
+        with closing(sqlite3.connect(config.memory_path)) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM checkpoints").fetchone() == (1,)
+            assert (
+                conn.execute(
+                    "SELECT COUNT(DISTINCT checkpoint_id) FROM writes"
+                ).fetchone()[0]
+                <= 1
+            )
+
+        # The conversation is kept in the memory file, by session
+        await llm.close()
+        LLM.clear()
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+        messages = await llm.conversation()
+        assert [message.content for message in messages[::2]] == [
+            "How does grappling work?",
+            "roll 1d20",
+            "Can I escape?",
+        ]
+        assert messages[-1].content == fake_responses[1]
+
+        llm.run_config = {"configurable": {"thread_id": "another session"}}
+        assert await llm.conversation() == []
+
+    @pytest.mark.asyncio
+    @patch("workflows.init_chat_model")
+    async def test_new_conversation(self, init_chat_model, config, rag_stores):
+        init_chat_model.return_value = FakeModel(responses=fake_responses)
+        llm = LLM(config, rag_stores)
+        await llm.initialize_workflow()
+        await llm.stream_response("How does grappling work?", Mock())
+        assert len(llm.answer_cache(None)) == 1
+
+        # Follow-on questions aren't answered from the cache, however similar
+        with patch.object(
+            llm.agent, "astream_events", wraps=llm.agent.astream_events
+        ) as astream_events:
+            await llm.stream_response("How does grappling work?", Mock())
+            assert astream_events.call_count == 1
+
+            # But the first question of a new conversation is
+            await llm.new_conversation()
+            assert await llm.conversation() == []
+            await llm.stream_response("How does grappling work?", Mock())
+            assert astream_events.call_count == 1
+        assert len(await llm.conversation()) == 2
@@ -3,7 +3,7 @@ from unittest.mock import MagicMock, patch
 import pytest
 from d7.dice_expression import DiceExpression
 
-from tools.dice import DiceTool, Roller
+from tools.dice import DiceOddsTool, DiceTool, Roller, parse_expression, parse_roll
 
 
 class TestRoller:
@@ -28,6 +28,47 @@ class TestRoller:
         roller = Roller("1d6")
         assert repr(roller) == roller.expression.toJSON()
 
+    def test_expression_cached(self):
+        parse_expression.cache_clear()
+        assert Roller("2d6").expression is Roller("2 d 6").expression
+        assert parse_expression.cache_info().hits == 1
+
+    def test_roll_many(self):
+        rolls = Roller("2d6+1").roll_many(500)
+        assert len(rolls) == 500
+        assert min(rolls) >= 3 and max(rolls) <= 13
+
+    def test_odds(self):
+        odds = Roller("3d6kh2+4").odds(15)
+        assert "averages 12.5" in odds
+        assert "15 or more: 19.9%" in odds
+        assert "estimated" not in odds
+        assert "16.7%" in odds  # The histogram
+
+        assert "estimated" in Roller("1d6!").odds()
+
+
+@pytest.mark.parametrize(
+    "text, expression",
+    [
+        ("2d6+3", "2d6+3"),
+        ("d20", "1d20"),
+        ("Roll a d20!", "1d20"),
+        ("r 4d6kh3", "4d6kh3"),
+        ("roll 2d6 + 3.", "2d6+3"),
+        ("2d6!", "2d6!"),  # Exploding dice
+    ],
+)
+def test_parse_roll(text, expression):
+    assert str(parse_roll(text)) == expression
+
+
+@pytest.mark.parametrize(
+    "text", ["hello", "roll", "roll for initiative", "How do I roll 2d6?", "20"]
+)
+def test_parse_roll_not_dice(text):
+    assert parse_roll(text) is None
+
 
 class MockRoller:
     def roll(self):
@@ -48,6 +89,21 @@ class TestDiceTool:
         await DiceTool()._arun("1d6", MagicMock())
         mock_formatted.assert_called_once_with(5)
 
+    def test_run_many(self):
+        text = DiceTool()._run("1d20+5, 1d4", count=3)
+        lines = text.split("\n")
+        assert lines[-2].split("1d20+5: ")[1].count(",") == 2
+        assert lines[-1].startswith("1d4: ")
+
     def test_formatted(self):
         tool = DiceTool()
         assert "5" in tool.formatted(5)
+
+
+class TestDiceOddsTool:
+    def test_run(self):
+        assert "10 or more: 55.0%" in DiceOddsTool()._run("1d20", target=10)
+
+    @pytest.mark.asyncio
+    async def test_arun(self):
+        assert "averages 10.5" in await DiceOddsTool()._arun("1d20", MagicMock())
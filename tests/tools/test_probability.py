@@ -0,0 +1,104 @@
+import itertools
+
+import numpy as np
+import pytest
+from d7.dice_expression import DiceExpression
+
+from tools.probability import DiceSpec, Distribution, distribution, sample
+
+
+def spec(text: str) -> DiceSpec:
+    return DiceSpec.from_expression(DiceExpression(text))
+
+
+def brute_force(count: int, sides: int, keep=None) -> dict[int, float]:
+    """Chance of each total, from every way the dice can land"""
+    outcomes: dict[int, float] = {}
+    for faces in itertools.product(range(1, sides + 1), repeat=count):
+        faces = sorted(faces, reverse=True)
+        total = sum(faces[:keep])
+        outcomes[total] = outcomes.get(total, 0.0) + 1 / sides**count
+    return outcomes
+
+
+def test_from_expression():
+    assert spec("6d8rr1mi3kh3!+4") == DiceSpec(
+        count=6,
+        sides=8,
+        reroll="rr",
+        reroll_value=1,
+        minimum=3,
+        keep="kh",
+        keep_count=3,
+        explode=8,
+        modifier="+",
+        modifier_value=4,
+    )
+
+
+@pytest.mark.parametrize(
+    "text, count, sides, keep",
+    [("2d6", 2, 6, None), ("3d4", 3, 4, None), ("4d6kh3", 4, 6, 3)],
+)
+def test_distribution_exact(text, count, sides, keep):
+    odds = distribution(spec(text))
+    assert odds.exact
+    expected = brute_force(count, sides, keep)
+    assert odds.outcomes.keys() == expected.keys()
+    for total, chance in expected.items():
+        assert odds.outcomes[total] == pytest.approx(chance)
+
+
+def test_distribution_modifiers():
+    assert distribution(spec("1d20+5")).at_least(15) == pytest.approx(0.55)
+    assert distribution(spec("2d20kh1")).at_least(20) == pytest.approx(0.0975)
+    assert distribution(spec("2d20kl1")).at_least(20) == pytest.approx(0.0025)
+    assert distribution(spec("1d6mi3")).outcomes == pytest.approx(
+        {3: 0.5, 4: 1 / 6, 5: 1 / 6, 6: 1 / 6}
+    )
+    assert distribution(spec("1d4/2")).outcomes == pytest.approx(
+        {0: 0.25, 1: 0.5, 2: 0.25}
+    )
+    assert distribution(spec("1d4/^2")).outcomes == pytest.approx({1: 0.5, 2: 0.5})
+
+    # A one is rolled again, once
+    assert distribution(spec("1d6ro1")).outcomes[1] == pytest.approx(1 / 36)
+
+
+@pytest.mark.parametrize("text", ["4d6kl3", "3d6ro<3kh2*2", "2d6rr1mi2-1"])
+def test_sample_matches_distribution(text):
+    odds = distribution(spec(text))
+    totals, counts = np.unique(
+        sample(spec(text), 100_000, np.random.default_rng(0)), return_counts=True
+    )
+    for total, count in zip(totals.tolist(), counts.tolist()):
+        assert count / 100_000 == pytest.approx(odds.outcomes[total], abs=0.01)
+
+
+def test_distribution_exploding():
+    odds = distribution(spec("1d6!"))
+    assert not odds.exact
+    assert odds.mean == pytest.approx(4.2, abs=0.05)  # 3.5 * 6 / 5
+    assert 6 not in odds.outcomes  # A six always rolls again
+    assert sum(odds.outcomes.values()) == pytest.approx(1.0)
+
+
+def test_sample_keeps_exploded_dice():
+    totals = sample(spec("2d4kl1!"), 1000, np.random.default_rng(0))
+    assert totals.min() == 1 and totals.max() <= 4
+
+
+def test_histogram():
+    lines = distribution(spec("2d6")).histogram(width=12).splitlines()
+    assert len(lines) == 11
+    assert lines[0] == " 2 ██             2.8%"
+    assert lines[5] == " 7 ████████████  16.7%"
+
+    # Wide ranges are grouped, leaving out the unlikely ends
+    lines = distribution(spec("10d10")).histogram(rows=8).splitlines()
+    assert len(lines) <= 8
+    assert not lines[0].startswith("10")
+
+
+def test_histogram_single_total():
+    assert Distribution({3: 1.0}).histogram(width=4) == "3 ████ 100.0%"
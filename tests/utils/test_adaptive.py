@@ -0,0 +1,60 @@
+from utils import AdaptiveBatcher
+from utils.adaptive import MAX_BACKOFF, MIN_BACKOFF
+
+
+class TestAdaptiveBatcher:
+    def test_init(self):
+        batcher = AdaptiveBatcher(batch_size=50, max_concurrency=4)
+        assert batcher.batch_size == 50
+        assert batcher.concurrency == 1
+
+        # Batch size is kept within bounds
+        batcher = AdaptiveBatcher(batch_size=1000, max_concurrency=4, max_batch_size=64)
+        assert batcher.batch_size == 64
+
+    def test_ramp_up(self):
+        batcher = AdaptiveBatcher(
+            batch_size=16, max_concurrency=3, target_latency=1.0, min_batch_size=8
+        )
+
+        # Concurrency increases first, then the batch size
+        batcher.record(0.1)
+        batcher.record(0.1)
+        assert batcher.concurrency == 3
+        assert batcher.batch_size == 16
+        batcher.record(0.1)
+        assert batcher.concurrency == 3
+        assert batcher.batch_size == 24
+
+        # No change while close to the target
+        batcher.record(0.8)
+        assert batcher.concurrency == 3
+        assert batcher.batch_size == 24
+
+    def test_slow(self):
+        batcher = AdaptiveBatcher(
+            batch_size=32, max_concurrency=4, target_latency=1.0, min_batch_size=8
+        )
+        batcher.concurrency = 4
+        batcher.record(2.0)
+        assert batcher.concurrency == 2
+        assert batcher.batch_size == 16
+
+    def test_record_error(self):
+        batcher = AdaptiveBatcher(batch_size=32, max_concurrency=4, min_batch_size=8)
+        batcher.concurrency = 4
+        batcher.record_error()
+        assert batcher.concurrency == 1
+        assert batcher.batch_size == 16
+        assert batcher.backoff == MIN_BACKOFF
+
+        batcher.record_error()
+        assert batcher.backoff == MIN_BACKOFF * 2
+
+        for _ in range(20):
+            batcher.record_error()
+        assert batcher.backoff == MAX_BACKOFF
+        assert batcher.batch_size == 8
+
+        batcher.record(0.1)
+        assert batcher.backoff == 0.0
@@ -0,0 +1,53 @@
+from utils import BM25Index
+from utils.bm25 import tokenize
+
+
+def test_tokenize():
+    assert tokenize("Sneak Attack: DC 15!") == ["sneak", "attack", "dc", "15"]
+
+
+class TestBM25Index:
+    def test_search(self, tmp_path):
+        index = BM25Index(str(tmp_path / "index.json"))
+        index.add(
+            ["a", "b", "c"],
+            [
+                "Sneak Attack deals extra damage",
+                "Make a DC 15 Dexterity saving throw",
+                "Attack rolls and damage rolls",
+            ],
+        )
+
+        assert [id_ for id_, _ in index.search("sneak attack", 3)] == ["a", "c"]
+        assert index.search("DC 15", 1)[0][0] == "b"
+        assert index.search("fireball", 3) == []
+        assert index.has_terms(["sneak", "attack"])
+        assert not index.has_terms(["sneak", "fireball"])
+
+    def test_add_and_remove(self, tmp_path):
+        index = BM25Index(str(tmp_path / "index.json"))
+        index.add(["a", "b"], ["sneak attack", "attack"])
+
+        # Adding an existing document replaces it
+        index.add(["a"], ["grapple"])
+        assert len(index) == 2
+        assert [id_ for id_, _ in index.search("attack", 3)] == ["b"]
+
+        index.remove(["b", "missing"])
+        assert len(index) == 1
+        assert not index.has_terms(["attack"])
+        assert index.total_length == 1
+
+    def test_save_and_load(self, tmp_path):
+        path = str(tmp_path / "index.json")
+        index = BM25Index(path)
+        index.add(["a", "b"], ["sneak attack", "saving throw"])
+        index.save()
+
+        loaded = BM25Index(path)
+        assert len(loaded) == 2
+        assert loaded.search("throw", 1) == index.search("throw", 1)
+
+        index.clear()
+        index.save()
+        assert len(BM25Index(path)) == 0
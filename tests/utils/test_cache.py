@@ -0,0 +1,50 @@
+from utils import LRUCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestLRUCache:
+    def test_get_and_set(self):
+        cache = LRUCache()
+        assert cache.get("a") is None
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert len(cache) == 2
+
+    def test_expires(self):
+        clock = FakeClock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.set("a", 1)
+        clock.now = 10
+        assert cache.get("a") == 1
+        clock.now = 10.5
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_disabled(self):
+        cache = LRUCache(max_size=0)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+
+    def test_clear(self):
+        cache = LRUCache()
+        cache.set("a", 1)
+        cache.clear()
+        assert cache.get("a") is None
@@ -0,0 +1,33 @@
+from threading import Thread
+from unittest.mock import Mock
+
+from utils import Coalescer
+
+
+def test_flush():
+    render = Mock()
+    coalescer = Coalescer(render)
+    assert not coalescer.flush()
+
+    # Only the latest value is rendered
+    coalescer.push("a")
+    coalescer.push("ab")
+    assert coalescer.flush()
+    render.assert_called_once_with("ab")
+
+    # And only once
+    assert not coalescer.flush()
+    assert render.call_count == 1
+
+
+def test_push_from_thread():
+    render = Mock()
+    coalescer = Coalescer(render)
+    threads = [Thread(target=coalescer.push, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert coalescer.flush()
+    assert render.call_count == 1
@@ -0,0 +1,129 @@
+import threading
+from unittest.mock import AsyncMock, Mock, patch
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from utils import CachedEmbeddings
+
+
+@pytest.fixture
+def embeddings():
+    fake = DeterministicFakeEmbedding(size=4)
+    embeddings = Mock(wraps=fake)
+    embeddings.aembed_documents = AsyncMock(side_effect=fake.aembed_documents)
+    yield embeddings
+
+
+@pytest.fixture
+def cache(embeddings, tmp_path):
+    yield CachedEmbeddings(embeddings, "model", str(tmp_path / "embeddings.sqlite"))
+
+
+class TestCachedEmbeddings:
+    def test_embed_documents(self, cache, embeddings):
+        vectors = cache.embed_documents(["a", "b", "a"])
+        embeddings.embed_documents.assert_called_once_with(["a", "b"])
+        assert vectors[0] == vectors[2]
+        assert vectors[0] != vectors[1]
+
+        # Cached vectors match the embedder's, to float32 precision
+        expected = embeddings.embed_documents(["a"])[0]
+        assert vectors[0] == pytest.approx(expected, rel=1e-6)
+
+        embeddings.embed_documents.reset_mock()
+        assert cache.embed_documents(["b", "a"]) == [vectors[1], vectors[0]]
+        embeddings.embed_documents.assert_not_called()
+        assert cache.stats()["hits"] == 3
+        assert cache.stats()["misses"] == 2
+
+    @pytest.mark.asyncio
+    async def test_aembed_documents(self, cache, embeddings):
+        vectors = await cache.aembed_documents(["a", "b"])
+        assert await cache.aembed_documents(["a", "b"]) == vectors
+        embeddings.aembed_documents.assert_awaited_once_with(["a", "b"])
+
+    @pytest.mark.asyncio
+    async def test_async_off_loop(self, cache):
+        # SQLite is read and written in a thread, not on the event loop
+        loop_thread = threading.get_ident()
+        threads = []
+        get_many, put_many = cache.get_many, cache.put_many
+
+        def record(method):
+            def wrapper(*args):
+                threads.append(threading.get_ident())
+                return method(*args)
+
+            return wrapper
+
+        with (
+            patch.object(cache, "get_many", side_effect=record(get_many)),
+            patch.object(cache, "put_many", side_effect=record(put_many)),
+        ):
+            await cache.aembed_documents(["a"])
+            await cache.aembed_query("a")
+        assert len(threads) == 4
+        assert loop_thread not in threads
+
+    def test_counts_threads(self, cache):
+        # Chroma and the async methods embed from several threads at once
+        def embed():
+            for i in range(50):
+                cache.embed_query(str(i % 5))
+
+        threads = [threading.Thread(target=embed) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert cache.stats()["hits"] + cache.stats()["misses"] == 400
+
+    def test_persisted(self, cache, embeddings, tmp_path):
+        vectors = cache.embed_documents(["a"])
+        embeddings.embed_documents.reset_mock()
+
+        cache = CachedEmbeddings(embeddings, "model", cache.path)
+        assert cache.embed_documents(["a"]) == vectors
+        embeddings.embed_documents.assert_not_called()
+
+    def test_keyed_by_model(self, cache, embeddings):
+        cache.embed_documents(["a"])
+        other = CachedEmbeddings(embeddings, "other-model", cache.path)
+        other.embed_documents(["a"])
+        assert embeddings.embed_documents.call_count == 2
+
+    def test_embed_query(self, cache, embeddings):
+        vector = cache.embed_query("a")
+        assert cache.embed_query("a") == vector
+        embeddings.embed_query.assert_called_once_with("a")
+
+    def test_size_replaced(self, cache):
+        cache.put_many({"a": [1.0] * 4, "b": [2.0] * 4})
+        assert cache.stats()["bytes"] == 32
+
+        # Replacing a vector doesn't count it twice
+        cache.put_many({"a": [3.0] * 4, "c": [4.0] * 4})
+        assert cache.stats()["bytes"] == 48
+        (size,) = cache.conn.execute(
+            "SELECT SUM(LENGTH(vector)) FROM embeddings"
+        ).fetchone()
+        assert cache.stats()["bytes"] == size
+
+    def test_eviction(self, embeddings, tmp_path):
+        # Each vector is 16 bytes, so only 4 fit
+        cache = CachedEmbeddings(
+            embeddings, "model", str(tmp_path / "embeddings.sqlite"), max_bytes=64
+        )
+        for text in ["a", "b", "c", "d"]:
+            cache.embed_documents([text])
+        cache.embed_documents(["a"])  # Mark as recently used
+        cache.embed_documents(["e"])
+        assert cache.stats()["bytes"] <= 64
+
+        # The least recently used vector was evicted
+        embeddings.embed_documents.reset_mock()
+        cache.embed_documents(["a", "e"])
+        embeddings.embed_documents.assert_not_called()
+        cache.embed_documents(["b"])
+        embeddings.embed_documents.assert_called_once_with(["b"])
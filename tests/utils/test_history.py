@@ -1,18 +1,20 @@
-from utils import History
-from utils.history import MAX_HISTORY_SIZE
+import json
+
+from utils import History, HistorySearch
+from utils.history import COMPACT_RATIO, MAX_HISTORY_SIZE
 
 
 class TestHistory:
     def test_init(self):
         history = History()
         assert history.size == MAX_HISTORY_SIZE
-        assert history.history == []
+        assert list(history.history) == []
         assert history.index == 0
 
     def test_append(self):
         history = History()
         history.append("test")
-        assert history.history == ["test"]
+        assert list(history.history) == ["test"]
         assert history.index == 0
 
     def test_max_size(self):
@@ -50,3 +52,93 @@ class TestHistory:
 
         history.prev()
         assert history.next() == "test2"
+
+    def test_file(self, tmp_path):
+        path = str(tmp_path / "history")
+        history = History(path=path)
+        history.append("test1")
+        history.append("multi\nline")
+        history.close()
+
+        # The history is read back, skipping lines that can't be read
+        with open(path, "a") as f:
+            f.write('"cut sh\n')
+        history = History(path=path)
+        assert list(history.history) == ["test1", "multi\nline"]
+        assert history.prev() == "multi\nline"
+
+        history.append("test2")
+        history.close()
+        assert History(path=path).history[-1] == "test2"
+
+    def test_compact(self, tmp_path):
+        path = tmp_path / "history"
+        history = History(size=3, path=str(path))
+        for i in range(COMPACT_RATIO * 3):
+            history.append(f"test {i}")
+        history.close()
+
+        # Once the file is too big, it's rewritten with only the messages kept
+        lines = path.read_text().splitlines()
+        assert [json.loads(line) for line in lines] == ["test 3", "test 4", "test 5"]
+        assert list(History(size=3, path=str(path)).history) == list(history.history)
+
+    def test_find(self):
+        history = History(size=4)
+        for message in ["How does grappling work?", "roll 1d20", "Grapple DC?"]:
+            history.append(message)
+
+        assert history.get(history.find("grapp")) == "Grapple DC?"
+        assert (
+            history.get(history.find("grapp", before=2)) == "How does grappling work?"
+        )
+        assert history.get(history.find("1d")) == "roll 1d20"
+        assert history.find("grapp", before=0) is None
+        assert history.find("flanking") is None
+
+        # Messages dropped from the history aren't found
+        history.append("roll 2d6")
+        history.append("roll 3d6")
+        assert history.find("grappling") is None
+        assert history.get(history.find("roll", before=3)) == "roll 1d20"
+
+    def test_find_reindexed(self):
+        history = History(size=10)
+        history.append("message 0")
+        assert history.grams is None  # Built on the first search
+        assert history.find("message") == 0
+
+        for i in range(1, 35):
+            history.append(f"message {i}")
+        assert history.indexed_from > 0
+        assert history.get(history.find("message 2")) == "message 29"
+        assert history.find("message 1 ") is None
+        assert history.find("message 24") is None
+
+
+class TestHistorySearch:
+    def test_search(self):
+        history = History()
+        for message in [
+            "roll 1d20",
+            "How does grappling work?",
+            "roll 2d6",
+            "roll 1d20",
+        ]:
+            history.append(message)
+        search = HistorySearch(history)
+
+        # Typing narrows the search from the current match
+        assert search.update("r") == "roll 1d20"
+        assert search.update("ro") == "roll 1d20"
+        assert search.update("roll 2") == "roll 2d6"
+        assert search.update("roll") == "roll 1d20"
+
+        # Searching further skips messages already found
+        assert search.older() == "roll 2d6"
+        assert search.older() is None
+        assert history.get(search.match) == "roll 2d6"
+
+        assert search.update("flanking") is None
+        assert search.older() is None
+        assert search.update("") is None
@@ -0,0 +1,60 @@
+import logging
+from datetime import datetime
+
+import pytest
+
+from utils import configure_logging, get_logger
+from utils import logger as logger_module
+from utils.logger import APP_LOGGER, DailyRotatingFileHandler, TruncatingFormatter
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    if logger_module._listener is not None:
+        logger_module._listener.stop()
+        logger_module._listener = None
+    root.handlers = handlers
+    root.setLevel(level)
+    logging.getLogger(APP_LOGGER).setLevel(logging.NOTSET)
+
+
+def test_get_logger():
+    assert get_logger("rag_store").name == f"{APP_LOGGER}.rag_store"
+    assert get_logger("rag_store") is get_logger("rag_store")
+
+
+def test_truncating_formatter():
+    formatter = TruncatingFormatter("%(levelname)s %(message)s", max_length=5)
+    record = logging.LogRecord("app", logging.INFO, "", 0, "%s", ("x" * 8,), None)
+    assert formatter.format(record) == "INFO xxxxx... [3 more characters]"
+
+
+def test_daily_rotation(tmp_path):
+    handler = DailyRotatingFileHandler(str(tmp_path / "app.log"), maxBytes=1000)
+    record = logging.LogRecord("app", logging.INFO, "", 0, "message", None, None)
+    assert not handler.shouldRollover(record)
+
+    handler.rollover_at = datetime.now()
+    assert handler.shouldRollover(record)
+    handler.close()
+
+
+def test_configure_logging(tmp_path, restore_logging):
+    configure_logging("DEBUG", path=str(tmp_path), max_length=20)
+    configure_logging("ERROR", path=str(tmp_path / "other"))
+    logger = get_logger("test")
+
+    logger.debug("Lazy %s", "x" * 100)
+    logging.getLogger("library").info("Libraries only log warnings")
+    logging.getLogger("library").warning("Library warning")
+    logger_module._listener.stop()
+    logger_module._listener = None
+
+    lines = (tmp_path / "app.log").read_text().splitlines()
+    assert len(lines) == 2
+    assert lines[0].endswith("Lazy xxxxxxxxxxxxxxx... [85 more characters]")
+    assert lines[1].endswith("Library warning")
+    assert not (tmp_path / "other").exists()
@@ -0,0 +1,61 @@
+import os
+
+from utils import Manifest, ManifestEntry, hash_file
+
+
+def test_hash_file(tmp_path):
+    path = tmp_path / "file.pdf"
+    path.write_bytes(b"contents")
+    original = hash_file(str(path))
+    assert original == hash_file(str(path))
+
+    path.write_bytes(b"changed")
+    assert hash_file(str(path)) != original
+
+
+class TestManifest:
+    def test_init(self, tmp_path):
+        manifest = Manifest(str(tmp_path / "manifest.json"))
+        assert manifest.entries == {}
+
+    def test_save(self, tmp_path):
+        path = str(tmp_path / "store" / "manifest.json")
+        manifest = Manifest(path)
+        manifest.set("doc.pdf", ManifestEntry(size=1, mtime=2.0, hash="abc", ids=["1"]))
+        manifest.save()
+
+        manifest = Manifest(path)
+        assert manifest.get("doc.pdf") == ManifestEntry(1, 2.0, "abc", ["1"])
+
+    def test_remove(self, tmp_path):
+        manifest = Manifest(str(tmp_path / "manifest.json"))
+        entry = ManifestEntry(size=1, mtime=2.0, hash="abc")
+        manifest.set("doc.pdf", entry)
+        assert manifest.remove("doc.pdf") == entry
+        assert manifest.remove("doc.pdf") is None
+
+    def test_is_current(self, tmp_path):
+        path = tmp_path / "doc.pdf"
+        path.write_bytes(b"contents")
+        stat = os.stat(path)
+
+        manifest = Manifest(str(tmp_path / "manifest.json"))
+        assert not manifest.is_current(str(path), stat)
+
+        manifest.set(str(path), ManifestEntry(stat.st_size, stat.st_mtime, "abc"))
+        assert manifest.is_current(str(path), stat)
+
+        manifest.set(str(path), ManifestEntry(stat.st_size + 1, stat.st_mtime, "abc"))
+        assert not manifest.is_current(str(path), stat)
+
+    def test_missing(self, tmp_path):
+        manifest = Manifest(str(tmp_path / "manifest.json"))
+        manifest.set("a.pdf", ManifestEntry(1, 1.0, "a"))
+        manifest.set("b.pdf", ManifestEntry(1, 1.0, "b"))
+        assert manifest.missing(["a.pdf", "c.pdf"]) == ["b.pdf"]
+
+    def test_clear(self, tmp_path):
+        manifest = Manifest(str(tmp_path / "manifest.json"))
+        manifest.set("a.pdf", ManifestEntry(1, 1.0, "a"))
+        manifest.clear()
+        assert manifest.entries == {}
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from utils import cosine_similarities, count_tokens, fit_budget, merge_chunks, mmr
+from utils.rerank import join_chunks, overlap_length
+
+
+def chunk(text: str, page: int = 0, start: int | None = None) -> Document:
+    metadata = {"source": "rules.pdf", "page": page}
+    if start is not None:
+        metadata["start_index"] = start
+    return Document(page_content=text, metadata=metadata)
+
+
+def test_cosine_similarities():
+    vectors = np.array([[1.0, 0.0], [0.0, 2.0], [0.0, 0.0]], dtype=np.float32)
+    assert cosine_similarities([3.0, 0.0], vectors).tolist() == [1.0, 0.0, 0.0]
+
+
+def test_mmr():
+    vectors = np.array([[1.0, 0.0], [1.0, 0.05], [0.5, 0.5]], dtype=np.float32)
+    similarities = cosine_similarities([1.0, 0.2], vectors)
+
+    # The near copy of the first is passed over for something different
+    assert mmr(similarities, vectors, 2, lambda_mult=0.5) == [1, 2]
+
+    # Relevance alone keeps the order of similarity
+    assert mmr(similarities, vectors, 3, lambda_mult=1.0) == [1, 0, 2]
+    assert mmr(similarities, vectors, 0, lambda_mult=0.5) == []
+    assert mmr(similarities[:0], vectors[:0], 2, lambda_mult=0.5) == []
+
+
+@pytest.mark.parametrize(
+    "first, second, length",
+    [
+        ("The rogue hides in the shadows", "in the shadows and strikes", 14),
+        ("The rogue hides", "and then strikes", 0),
+        ("The rogue hides in the shadows", "shadows and strikes", 0),  # Too short
+    ],
+)
+def test_overlap_length(first, second, length, monkeypatch):
+    monkeypatch.setattr("utils.rerank.MIN_OVERLAP", 10)
+    assert overlap_length(first, second) == length
+
+
+def test_join_chunks():
+    text = "".join(f"Rule {i} of grappling says something else. " for i in range(4))
+    first = chunk(text[:70], start=0)
+    second = chunk(text[50:], start=50)
+
+    # Chunks are placed by where they start in the page
+    assert join_chunks(first, second) == text
+    assert join_chunks(second, first) == text
+    assert join_chunks(first, chunk(text[10:40], start=10)) == text[:70]
+    assert join_chunks(first, chunk("Next", start=71)) == f"{text[:70]}\nNext"
+    assert join_chunks(first, chunk("Later", start=100)) is None
+
+    # Or by the text they share, if they don't say
+    assert join_chunks(chunk(text[:70]), chunk(text[40:])) == text
+    assert join_chunks(chunk(text[40:]), chunk(text[:70])) == text
+    assert join_chunks(chunk(text), chunk(text[5:30])) == text
+    assert join_chunks(chunk("Grappling"), chunk("Spellcasting")) is None
+
+
+def test_merge_chunks():
+    text = "".join(f"Rule {i} of grappling says something else. " for i in range(4))
+    docs = [
+        chunk(text[40:90], start=40),
+        chunk("Spells need components", page=1),
+        chunk(text[:50], start=0),
+        chunk(text[80:], start=80),
+    ]
+
+    # Chunks that meet are merged in the place of the first, even through another
+    merged = merge_chunks(docs)
+    assert [doc.page_content for doc in merged] == [text, "Spells need components"]
+    assert merged[0].metadata["start_index"] == 0
+    assert docs[0].page_content == text[40:90]
+
+    # Chunks of other pages aren't merged
+    assert len(merge_chunks([chunk(text), chunk(text, page=1)])) == 2
+
+
+def test_fit_budget():
+    docs = [chunk("a" * 40), chunk("b" * 40), chunk("c" * 8)]
+    assert count_tokens(docs[0].page_content) == 10
+
+    assert fit_budget(docs, 21) == docs[:2]
+    assert fit_budget(docs, 0) == docs
+
+    # The first is cut short rather than sending nothing
+    (doc,) = fit_budget(docs, 5)
+    assert doc.page_content == "a" * 20
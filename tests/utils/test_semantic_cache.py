@@ -0,0 +1,84 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from utils import SemanticCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    yield SemanticCache(str(tmp_path / "answers.sqlite"), "model", threshold=0.9)
+
+
+class TestSemanticCache:
+    def test_lookup(self, cache):
+        assert cache.lookup([1.0, 0.0]) is None
+
+        cache.add("How does grappling work?", [1.0, 0.0], "It's contested.")
+        assert cache.lookup([1.0, 0.0]) == "It's contested."
+
+        # Similar questions are answered, dissimilar ones aren't
+        assert cache.lookup([0.99, 0.1]) == "It's contested."
+        assert cache.lookup([0.0, 1.0]) is None
+        assert cache.hits == 2
+        assert cache.misses == 2
+
+    def test_best_match(self, cache):
+        cache.add("a", [1.0, 0.0], "answer a")
+        cache.add("b", [0.0, 1.0], "answer b")
+        assert cache.lookup([0.1, 1.0]) == "answer b"
+
+    def test_persisted(self, cache):
+        cache.add("a", [1.0, 0.0], "answer a")
+
+        cache = SemanticCache(cache.path, "model", threshold=0.9)
+        assert cache.lookup([1.0, 0.0]) == "answer a"
+
+        # Answers from other embedding models can't be compared
+        cache = SemanticCache(cache.path, "other-model", threshold=0.9)
+        assert cache.lookup([1.0, 0.0]) is None
+
+    def test_eviction(self, tmp_path):
+        cache = SemanticCache(str(tmp_path / "answers.sqlite"), "model", max_entries=2)
+        cache.add("a", [1.0, 0.0, 0.0], "answer a")
+        cache.add("b", [0.0, 1.0, 0.0], "answer b")
+        cache.lookup([1.0, 0.0, 0.0])  # Mark as recently used
+        cache.add("c", [0.0, 0.0, 1.0], "answer c")
+
+        assert len(cache) == 2
+        assert cache.lookup([1.0, 0.0, 0.0]) == "answer a"
+        assert cache.lookup([0.0, 1.0, 0.0]) is None
+        assert cache.lookup([0.0, 0.0, 1.0]) == "answer c"
+
+    def test_clear(self, cache):
+        cache.add("a", [1.0, 0.0], "answer a")
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.lookup([1.0, 0.0]) is None
+
+    def test_dimension_change(self, cache):
+        cache.add("a", [1.0, 0.0], "answer a")
+        assert cache.lookup([1.0, 0.0, 0.0]) is None
+
+        cache.add("b", [1.0, 0.0, 0.0], "answer b")
+        assert len(cache) == 1
+        assert cache.lookup([1.0, 0.0, 0.0]) == "answer b"
+
+    @pytest.mark.asyncio
+    async def test_async(self, cache):
+        # SQLite is read and written in a thread, not on the event loop
+        loop_thread = threading.get_ident()
+        threads = []
+        execute = cache.conn.execute
+
+        def record(*args):
+            threads.append(threading.get_ident())
+            return execute(*args)
+
+        with patch.object(cache, "_conn", wraps=cache.conn) as conn:
+            conn.execute.side_effect = record
+            await cache.aadd("a", [1.0, 0.0], "answer a")
+            assert await cache.alookup([1.0, 0.0]) == "answer a"
+        assert threads
+        assert loop_thread not in threads
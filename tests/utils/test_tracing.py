@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from utils import Tracer
+from utils.tracing import format_duration
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def event(name: str, kind: str, run_id: str, node: str | None = None, **data):
+    return {
+        "event": f"on_{kind}",
+        "name": name,
+        "run_id": run_id,
+        "metadata": {"langgraph_node": node} if node else {},
+        "data": data,
+    }
+
+
+def test_format_duration():
+    assert format_duration(0.085) == "85ms"
+    assert format_duration(2.1) == "2.1s"
+
+
+class TestTracer:
+    def test_trace(self, tmp_path):
+        clock = FakeClock()
+        tracer = Tracer(str(tmp_path / "traces.jsonl"), clock=clock)
+        trace = tracer.start("question")
+
+        for time, e in [
+            (0.0, event("LangGraph", "chain_start", "0")),
+            (0.0, event("agent", "chain_start", "1", "agent")),
+            (0.1, event("ChatModel", "chat_model_start", "2", "agent")),
+            (0.3, event("ChatModel", "chat_model_stream", "2", "agent")),
+            (0.4, event("ChatModel", "chat_model_stream", "2", "agent")),
+            (0.5, event("ChatModel", "chat_model_end", "2", "agent")),
+            (0.6, event("agent", "chain_end", "1", "agent")),
+            (0.6, event("RunnableSequence", "chain_start", "3", "tools")),
+            (0.6, event("retrieve_rules", "tool_start", "4", "tools")),
+            (0.685, event("retrieve_rules", "tool_end", "4", "tools")),
+            (2.0, event("generator", "chain_start", "5", "generator")),
+        ]:
+            clock.now = time
+            trace.observe(e)
+        trace.output()
+        clock.now = 3.0
+        tracer.finish(trace)
+
+        # Only nodes themselves are timed, and open spans end with the trace
+        assert [span.name for span in trace.spans] == [
+            "agent",
+            "ChatModel",
+            "retrieve_rules",
+            "generator",
+        ]
+        model = trace.spans[1]
+        assert model.first_token == pytest.approx(0.2)
+        assert model.tokens == 2
+        assert trace.summary() == (
+            "agent 600ms · retrieve_rules 85ms · generator 1.0s · "
+            "first token 2.0s · total 3.0s"
+        )
+
+        tracer.close()
+        with open(tracer.path) as f:
+            saved = json.loads(f.readline())
+        assert saved["question"] == "question"
+        assert len(saved["spans"]) == 4
+
+    def test_histograms(self):
+        clock = FakeClock()
+        tracer = Tracer(clock=clock)
+        assert tracer.report() == "No responses yet."
+
+        for total in [0.005, 0.2, 3.0]:
+            trace = tracer.start("question")
+            clock.now += total
+            tracer.finish(trace)
+
+        histogram = tracer.histograms()["total"]
+        assert histogram["count"] == 3
+        assert histogram["p50"] == 0.2
+        assert histogram["buckets"]["0.01"] == 1
+        assert histogram["buckets"]["0.25"] == 1
+        assert histogram["buckets"]["5"] == 1
+        assert "total" in tracer.report()
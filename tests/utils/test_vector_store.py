@@ -0,0 +1,184 @@
+import os
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from utils import NumpyVectorStore
+
+VECTORS = [[1.0, 0.0, 0.0], [0.0, 2.0, 0.0], [0.0, 0.0, 3.0], [1.0, 1.0, 0.0]]
+IDS = ["a", "b", "c", "d"]
+
+
+def make_store(path, **kwargs) -> NumpyVectorStore:
+    return NumpyVectorStore(
+        str(path / "vectors"), DeterministicFakeEmbedding(size=3), **kwargs
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = make_store(tmp_path)
+    store.upsert_embedded(
+        IDS, VECTORS, [f"text {id_}" for id_ in IDS], [{"page": i} for i in range(4)]
+    )
+    yield store
+
+
+class TestNumpyVectorStore:
+    def test_search(self, store):
+        results = store.similarity_search_by_vector_with_score([0.9, 0.9, 0.0], k=2)
+        assert [(doc.id, doc.page_content) for doc, _ in results] == [
+            ("d", "text d"),
+            ("a", "text a"),
+        ]
+        assert results[0][0].metadata == {"page": 3}
+        assert results[0][1] == pytest.approx(0.02)
+        assert results[1][1] == pytest.approx(0.82)
+
+    @pytest.mark.parametrize(
+        "space, expected",
+        [("l2", ["a", "d"]), ("cosine", ["d", "a"]), ("ip", ["c", "d"])],
+    )
+    def test_spaces(self, tmp_path, space, expected):
+        store = make_store(tmp_path, space=space)
+        store.upsert_embedded(IDS, VECTORS, IDS, [{}] * 4)
+        docs = store.similarity_search_by_vector([0.5, 0.4, 0.35], k=2)
+        assert [doc.id for doc in docs] == expected
+
+    def test_int8(self, tmp_path):
+        store = make_store(tmp_path, dtype="int8")
+        store.upsert_embedded(IDS, VECTORS, IDS, [{}] * 4)
+        assert store.index_settings() == {"space": "l2", "dtype": "int8"}
+        assert store.vectors.dtype == np.int8
+
+        results = store.similarity_search_by_vector_with_score([0.0, 2.0, 0.0], k=1)
+        assert results[0][0].id == "b"
+        assert results[0][1] == pytest.approx(0.0, abs=1e-3)
+        assert store.get_embeddings(["d"])["d"] == pytest.approx(
+            [1.0, 1.0, 0.0], abs=0.01
+        )
+
+    def test_upsert_replaces(self, store):
+        store.upsert_embedded(
+            ["a", "e"], [[0.0, 2.0, 0.1], [0.0, 2.0, 0.3]], ["new a", "e"], [{}] * 2
+        )
+        assert store.count() == 5
+
+        docs = store.similarity_search_by_vector([0.0, 2.0, 0.1], k=3)
+        assert [doc.page_content for doc in docs] == ["new a", "text b", "e"]
+
+    def test_size_mismatch(self, store):
+        # As after the embedding model changes
+        with pytest.raises(ValueError, match="3 dimensions"):
+            store.upsert_embedded(["e"], [[1.0, 0.0]], ["e"], [{}])
+        with pytest.raises(ValueError, match="3 dimensions"):
+            store.similarity_search_by_vector([1.0, 0.0, 0.0, 0.0])
+        assert store.rows == 4
+        assert store.count() == 4
+
+    def test_delete_and_compact(self, store):
+        store.delete(["a"])
+        assert store.count() == 3
+        assert store.generation == 0
+        assert [doc.id for doc in store.similarity_search_by_vector([1, 0, 0], 4)] == [
+            "d",
+            "b",
+            "c",
+        ]
+
+        # Once most rows are deleted, the rest are rewritten to new files
+        store.delete(["b", "c"])
+        assert store.generation == 1
+        assert store.rows == 1
+        assert not os.path.exists(store.file_path("vectors.bin", 0))
+        assert [doc.id for doc in store.similarity_search_by_vector([1, 0, 0], 4)] == [
+            "d"
+        ]
+
+    def test_persisted(self, store, tmp_path):
+        store.delete(["b"])
+
+        reopened = make_store(tmp_path, space="cosine", dtype="int8")
+        assert reopened.count() == 3
+        # The settings the vectors were first written with are kept
+        assert reopened.index_settings() == {"space": "l2", "dtype": "float32"}
+        assert [
+            doc.id for doc in reopened.similarity_search_by_vector([0, 1, 0], 1)
+        ] == ["d"]
+        assert NumpyVectorStore.stored_count(store.path) == 3
+        assert NumpyVectorStore.stored_count(str(tmp_path / "missing")) == 0
+
+    def test_partitions(self, tmp_path):
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(10, 16))
+        vectors = centers[rng.integers(10, size=500)] + rng.normal(
+            scale=0.1, size=(500, 16)
+        )
+        ids = [str(i) for i in range(500)]
+        store = make_store(tmp_path, ivf_min_rows=100, ivf_probes=4)
+        store.upsert_embedded(ids, vectors.tolist(), ids, [{}] * 500)
+
+        queries = centers + rng.normal(scale=0.1, size=centers.shape)
+        exact = make_store(tmp_path / "exact", ivf_min_rows=0)
+        exact.upsert_embedded(ids, vectors.tolist(), ids, [{}] * 500)
+        for query in queries:
+            assert store.candidates(store.prepare(query), store.rows) is not None
+            assert [doc.id for doc in store.similarity_search_by_vector(query, 5)] == [
+                doc.id for doc in exact.similarity_search_by_vector(query, 5)
+            ]
+        assert exact.candidates(queries[0], exact.rows) is None
+
+        # Rows added since partitioning are searched too
+        store.upsert_embedded(["new"], [queries[0].tolist()], ["new"], [{}])
+        assert store.similarity_search_by_vector(queries[0], 1)[0].id == "new"
+        assert make_store(tmp_path, ivf_min_rows=100).partitions is not None
+
+        # Rows added while a search is under way, and partitioned, aren't scored
+        candidates = store.candidates
+
+        def add_during_search(query, rows):
+            added = [f"more {i}" for i in range(100)]
+            store.upsert_embedded(added, vectors[:100].tolist(), added, [{}] * 100)
+            return candidates(query, rows)
+
+        with patch.object(store, "candidates", side_effect=add_during_search):
+            assert len(store.similarity_search_by_vector(queries[0], 5)) == 5
+        assert store.candidates(queries[0], 10).max() < 10
+
+    def test_partitions_probed(self, tmp_path):
+        # Probing every partition finds exactly what scoring every row does
+        rng = np.random.default_rng(1)
+        vectors = rng.normal(size=(36, 4))
+        ids = [str(i) for i in range(36)]
+        store = make_store(tmp_path, ivf_min_rows=10, ivf_probes=100)
+        store.upsert_embedded(ids, vectors.tolist(), ids, [{}] * 36)
+        exact = make_store(tmp_path / "exact", ivf_min_rows=0)
+        exact.upsert_embedded(ids, vectors.tolist(), ids, [{}] * 36)
+
+        for query in rng.normal(size=(1000, 4)):
+            rows = store.candidates(store.prepare(query), store.rows)
+            assert (np.diff(rows) > 0).all()
+            assert [doc.id for doc in store.similarity_search_by_vector(query, 5)] == [
+                doc.id for doc in exact.similarity_search_by_vector(query, 5)
+            ]
+
+    def test_get(self, store):
+        assert [doc.page_content for doc in store.get_by_ids(["c", "x", "a"])] == [
+            "text c",
+            "text a",
+        ]
+        assert store.get_embeddings(["b", "x"]) == {"b": [0.0, 2.0, 0.0]}
+        assert store.scan(2, 1) == (["b", "c"], ["text b", "text c"])
+
+    def test_text(self, tmp_path):
+        store = make_store(tmp_path)
+        ids = store.add_texts(["grapple", "flank"], ids=["1", "2"])
+        assert ids == ["1", "2"]
+        assert store.similarity_search("flank", k=1)[0].id == "2"
+
+    def test_delete_collection(self, store):
+        store.delete_collection()
+        assert NumpyVectorStore.stored_count(store.path) == 0
@@ -1,4 +1,6 @@
 import random
+import re
+from functools import lru_cache
 from typing import Optional
 
 from d7 import dice_expression
@@ -10,11 +12,15 @@ from langchain_core.tools import BaseTool
 from langchain_core.tools.base import ArgsSchema
 from pydantic import BaseModel, Field
 
+from tools.probability import DiceSpec, distribution, sample
 from utils import get_logger
 
 logger = get_logger(__name__)
 
 DICE_TOOL_NAME = "dice"
+DICE_ODDS_TOOL_NAME = "dice_odds"
+EXPRESSION_CACHE_SIZE = 256
+MAX_ROLLS = 1000  # Rolls of each expression in one call
 
 DICE_TOOL_DESCRIPTION = """
 A tool to roll dice using dice notation.
@@ -27,9 +33,39 @@ Examples:
 2d4rr1+1 - roll two, four-sided dice, re-rolling the value one, adding one to the result;
 3d6ro<2kh2 - roll three, six-sided dice, re-rolling the value two at most once, keeping the highest two rolls;
 6d8rr1mi3kh3!+4 - roll six exploding, eight-sided dice, whose minimum value is three, re-rolling the value one, keeping the highest three, and adding four to the result.
+
+Several expressions can be rolled at once, separated by commas, e.g. "1d20+5, 1d20+2", and each can be rolled a number of times.
+"""
+
+DICE_ODDS_TOOL_DESCRIPTION = """
+A tool to work out the odds of a dice roll, using the same dice notation as the dice tool.
+
+Gives the average total and a histogram of the chance of each total. Given a target, such as a DC or an AC, it also gives the
+chance of rolling the target or more.
+
+Examples:
+3d6kh2+4 with target 15 - the chance of 15 or more when rolling three six-sided dice, keeping the highest two, and adding four;
+2d20kh1+5 - the odds of rolling with advantage, adding five.
 """
 
 
+# "roll 2d6+3", "r d20" or "roll a d20!" as well as bare expressions. A trailing "!"
+# is only punctuation after "roll", since it means exploding dice in an expression.
+ROLL_PATTERN = re.compile(
+    r"^\s*(?:(?P<roll>(?:roll|r)\s+(?:an?\s+)?))?(?P<expression>.+?)\s*$",
+    re.IGNORECASE,
+)
+
+# "d20" for "1d20", at the start of an expression or after an operator
+IMPLIED_COUNT_PATTERN = re.compile(r"(^|[+\-*/(])d(?=\d)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def parse_expression(text: str) -> dice_expression.DiceExpression:
+    """Parse a dice expression, once for each expression"""
+    return dice_expression.DiceExpression(text)
+
+
 class Roller:
     """
     A dice notation interpreter and roller for use in tabletop role-playing games (TTRPGs).
@@ -37,7 +73,7 @@ class Roller:
 
     def __init__(self, text: str = None, *args, **kwargs):
         self.text = text.replace(" ", "")
-        self.expression = dice_expression.DiceExpression(self.text)
+        self.expression = parse_expression(self.text)
 
     def __str__(self) -> str:
         """Return the dice expression as a string"""
@@ -47,15 +83,66 @@ class Roller:
         """Return the dice expression in JSON format"""
         return self.expression.toJSON()
 
+    @property
+    def spec(self) -> DiceSpec:
+        """Get the dice and modifiers of the expression"""
+        return DiceSpec.from_expression(self.expression)
+
     def roll(self) -> int:
         """Roll the dice"""
         result = self.expression.roll()
         return result
 
+    def roll_many(self, count: int) -> list[int]:
+        """Roll the dice a number of times at once"""
+        return sample(self.spec, count).tolist()
+
+    def odds(self, target: int | None = None) -> str:
+        """Describe the chance of each total, and of the target or more if given"""
+        odds = distribution(self.spec)
+        lines = [f"**{self.text}** averages {odds.mean:.1f}"]
+        if target is not None:
+            lines.append(f"{target} or more: {odds.at_least(target):.1%}")
+        if not odds.exact:
+            lines.append("(estimated from sample rolls)")
+        return "  \n".join(lines) + f"\n\n```\n{odds.histogram()}\n```"
+
+
+def parse_roll(text: str) -> Roller | None:
+    """
+    Get a roller if the text is only a dice expression, or a request to roll one,
+    so it can be rolled without asking the model.
+    """
+    match = ROLL_PATTERN.match(text)
+    if match is None:
+        return None
+
+    expression = match["expression"]
+    if match["roll"]:
+        expression = expression.rstrip(".!")
+    expression = IMPLIED_COUNT_PATTERN.sub(r"\g<1>1d", expression)
+    try:
+        return Roller(expression)
+    except ValueError:
+        return None
+
 
 class DiceToolInput(BaseModel):
     text: str = Field(
-        description="dice expression", examples=["1d100", "2d6", "3d10+1"]
+        description="dice expressions, separated by commas",
+        examples=["1d100", "2d6", "3d10+1", "1d20+5, 1d20+2"],
+    )
+    count: int = Field(
+        1, ge=1, le=MAX_ROLLS, description="number of times to roll each expression"
+    )
+
+
+class DiceOddsToolInput(BaseModel):
+    text: str = Field(
+        description="dice expression", examples=["1d20+5", "3d6kh2+4", "2d20kh1"]
+    )
+    target: Optional[int] = Field(
+        None, description="total to meet or beat, e.g. a DC or AC", examples=[15]
     )
 
 
@@ -71,14 +158,29 @@ class DiceTool(BaseTool):
     return_direct: bool = False
 
     def _run(
-        self, text: str, run_manager: Optional[CallbackManagerForToolRun] = None
+        self,
+        text: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+        count: int = 1,
     ) -> str:
-        return self.formatted(Roller(text).roll())
+        rollers = [Roller(expression) for expression in text.split(",")]
+        if len(rollers) == 1 and count == 1:
+            return self.formatted(rollers[0].roll())
+
+        return self.formatted(
+            "  \n".join(
+                f"{roller}: {', '.join(map(str, roller.roll_many(count)))}"
+                for roller in rollers
+            )
+        )
 
     async def _arun(
-        self, text: str, run_manager: Optional[AsyncCallbackManagerForToolRun] = None
+        self,
+        text: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        count: int = 1,
     ) -> str:
-        return self._run(text, run_manager=run_manager.get_sync())
+        return self._run(text, run_manager=run_manager.get_sync(), count=count)
 
     def formatted(self, text: str) -> str:
         formats = [
@@ -92,3 +194,30 @@ class DiceTool(BaseTool):
             "(⊃ ° ͜ʖ͡° )⊃━ .*･｡ﾟ    {text}",
         ]
         return "Dice Roll!  \n\n" + random.choice(formats).format(text=text)
+
+
+class DiceOddsTool(BaseTool):
+    """
+    Work out the odds of a dice roll
+    """
+
+    name: str = DICE_ODDS_TOOL_NAME
+    description: str = DICE_ODDS_TOOL_DESCRIPTION
+    args_schema: Optional[ArgsSchema] = DiceOddsToolInput
+    return_direct: bool = False
+
+    def _run(
+        self,
+        text: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+        target: Optional[int] = None,
+    ) -> str:
+        return Roller(text).odds(target)
+
+    async def _arun(
+        self,
+        text: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+        target: Optional[int] = None,
+    ) -> str:
+        return self._run(text, run_manager=run_manager.get_sync(), target=target)
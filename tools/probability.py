@@ -0,0 +1,275 @@
+import math
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+from d7.dice_expression import DiceExpression
+
+SAMPLES = 20_000  # Rolls sampled when a distribution can't be computed exactly
+SAMPLE_SEED = 0  # Sampled distributions are the same each time they're computed
+MAX_EXPLOSIONS = 100  # Rounds of exploding dice to roll before stopping
+EXACT_WORK_LIMIT = 10**7  # Steps of keeping dice exactly before sampling instead
+DISTRIBUTION_CACHE_SIZE = 64
+
+HISTOGRAM_ROWS = 20
+HISTOGRAM_WIDTH = 24
+HISTOGRAM_TAIL = 0.001  # Chance at each end left out of a histogram
+BLOCKS = "▏▎▍▌▋▊▉█"
+
+
+@dataclass(frozen=True)
+class DiceSpec:
+    """The dice and modifiers of a dice expression"""
+
+    count: int
+    sides: int
+    reroll: str | None = None  # "ro", "ro<", "ro>", "rr", "rr<" or "rr>"
+    reroll_value: int | None = None
+    max_rerolls: int = 5
+    minimum: int | None = None
+    keep: str | None = None  # "kh" or "kl"
+    keep_count: int | None = None
+    explode: int | None = None  # The face that explodes
+    modifier: str | None = None  # "+", "-", "*", "/" or "/^"
+    modifier_value: int = 0
+
+    @classmethod
+    def from_expression(cls, expression: DiceExpression) -> "DiceSpec":
+        args = expression.args
+        return cls(
+            count=args["nDice"],
+            sides=args["diceSize"],
+            reroll=args["reroll"],
+            reroll_value=args["rerollValue"],
+            max_rerolls=expression.maxReroll,
+            minimum=args["minValue"],
+            keep=args["keep"],
+            keep_count=args["keepValue"],
+            explode=args["explodeValue"] if args["explode"] else None,
+            modifier=args["mod"],
+            modifier_value=args["modValue"] or 0,
+        )
+
+    @property
+    def kept(self) -> int:
+        """Number of dice that count towards the total, before any explode"""
+        if self.keep is None:
+            return self.count
+        return min(self.count, self.keep_count)
+
+    def rerolled(self, faces: np.ndarray) -> np.ndarray:
+        """Which faces are rolled again"""
+        if self.reroll.endswith("<"):
+            return faces < self.reroll_value
+        if self.reroll.endswith(">"):
+            return faces > self.reroll_value
+        return faces == self.reroll_value
+
+    def modify(self, totals: np.ndarray) -> np.ndarray:
+        """Apply the modifier to the totals of the kept dice"""
+        value = self.modifier_value
+        match self.modifier:
+            case "-":
+                return totals - value
+            case "*":
+                return totals * value
+            case "/":
+                return np.floor(totals / value).astype(int)
+            case "/^":
+                return np.ceil(totals / value).astype(int)
+            case _:
+                return totals + value
+
+
+@dataclass
+class Distribution:
+    """The chance of each total of a dice expression"""
+
+    outcomes: dict[int, float]
+    exact: bool = True
+
+    @property
+    def mean(self) -> float:
+        return sum(total * chance for total, chance in self.outcomes.items())
+
+    def at_least(self, target: int) -> float:
+        """Chance of a total of the target or more, e.g. to meet a DC"""
+        return sum(chance for total, chance in self.outcomes.items() if total >= target)
+
+    def histogram(
+        self, rows: int = HISTOGRAM_ROWS, width: int = HISTOGRAM_WIDTH
+    ) -> str:
+        """
+        Draw the distribution as text, one bar per total. Wide ranges are grouped
+        into at most the given number of rows, leaving out the unlikely ends.
+        """
+        totals = sorted(self.outcomes)
+        chances = np.array([self.outcomes[total] for total in totals])
+        cumulative = np.cumsum(chances)
+        low = totals[int(np.searchsorted(cumulative, HISTOGRAM_TAIL, side="right"))]
+        high = totals[
+            min(int(np.searchsorted(cumulative, 1 - HISTOGRAM_TAIL)), len(totals) - 1)
+        ]
+
+        step = math.ceil((high - low + 1) / rows)
+        buckets: list[tuple[str, float]] = []
+        for start in range(low, high + 1, step):
+            end = min(start + step - 1, high)
+            chance = sum(
+                self.outcomes.get(total, 0.0) for total in range(start, end + 1)
+            )
+            buckets.append((str(start) if start == end else f"{start}-{end}", chance))
+
+        label_width = max(len(label) for label, _ in buckets)
+        largest = max(chance for _, chance in buckets)
+        lines = []
+        for label, chance in buckets:
+            eighths = round(chance / largest * width * 8) if largest else 0
+            bar = "█" * (eighths // 8) + (
+                BLOCKS[eighths % 8 - 1] if eighths % 8 else ""
+            )
+            lines.append(f"{label:>{label_width}} {bar:<{width}} {chance:6.1%}")
+        return "\n".join(lines)
+
+
+def die_chances(spec: DiceSpec) -> np.ndarray:
+    """Chance of each face of one die, after any rerolls and minimum"""
+    faces = np.arange(spec.sides + 1)
+    base = np.full(spec.sides + 1, 1 / spec.sides)
+    base[0] = 0.0
+    chances = base.copy()
+
+    if spec.reroll is not None:
+        rerolled = spec.rerolled(faces)
+        # "ro" rerolls once, "rr" until the face is kept or it's been rerolled enough
+        for _ in range(1 if spec.reroll.startswith("ro") else spec.max_rerolls):
+            chances = np.where(rerolled, 0.0, chances) + chances[rerolled].sum() * base
+
+    if spec.minimum is not None:
+        chances[spec.minimum] += chances[: spec.minimum].sum()
+        chances[: spec.minimum] = 0.0
+
+    return chances
+
+
+def sum_chances(die: np.ndarray, count: int) -> np.ndarray:
+    """Chance of each total of a number of dice"""
+    chances = np.array([1.0])
+    for _ in range(count):
+        chances = np.convolve(chances, die)
+    return chances
+
+
+def keep_chances(die: np.ndarray, count: int, kept: int, highest: bool) -> np.ndarray:
+    """
+    Chance of each total of the highest or lowest dice kept of a number of dice.
+
+    Faces are taken from the best down, choosing how many of the dice left show each
+    one, and the total of the dice kept so far is tracked for each number chosen.
+    """
+    faces = [face for face in range(len(die)) if die[face] > 0]
+    if highest:
+        faces.reverse()
+
+    # table[chosen][total] is the chance of choosing that many dice with that total
+    table = np.zeros((count + 1, kept * (len(die) - 1) + 1))
+    table[0, 0] = 1.0
+    for face in faces:
+        chance = die[face]
+        new = np.zeros_like(table)
+        for chosen in range(count + 1):
+            row = table[chosen]
+            if not row.any():
+                continue
+            for showing in range(count - chosen + 1):
+                weight = math.comb(count - chosen, showing) * chance**showing
+                shift = min(showing, max(kept - chosen, 0)) * face
+                new[chosen + showing, shift:] += row[: len(row) - shift] * weight
+        table = new
+
+    return table[count]
+
+
+def keep_work(die: np.ndarray, spec: DiceSpec) -> int:
+    """Rough number of steps to keep dice exactly"""
+    faces = np.count_nonzero(die)
+    return faces * (spec.count + 1) ** 2 * (spec.kept * spec.sides + 1) // 2
+
+
+def roll_dice(spec: DiceSpec, shape: tuple[int, int], rng: np.random.Generator):
+    """Roll an array of dice, rerolling as the spec says"""
+    faces = rng.integers(1, spec.sides + 1, size=shape)
+    if spec.reroll is not None:
+        for _ in range(1 if spec.reroll.startswith("ro") else spec.max_rerolls):
+            rerolled = spec.rerolled(faces)
+            if not rerolled.any():
+                break
+            faces[rerolled] = rng.integers(1, spec.sides + 1, size=rerolled.sum())
+    return faces
+
+
+def sample(
+    spec: DiceSpec, size: int, rng: np.random.Generator | None = None
+) -> np.ndarray:
+    """Roll a dice expression many times at once, returning each total"""
+    rng = rng or np.random.default_rng()
+    rounds = [roll_dice(spec, (size, spec.count), rng)]
+
+    # Exploded dice are rolled in rounds, with 0 for dice a roll didn't explode
+    if spec.explode is not None:
+        exploding = (rounds[-1] == spec.explode).sum(axis=1)
+        while exploding.any() and len(rounds) <= MAX_EXPLOSIONS:
+            faces = roll_dice(spec, (size, int(exploding.max())), rng)
+            faces[np.arange(faces.shape[1]) >= exploding[:, None]] = 0
+            rounds.append(faces)
+            exploding = (faces == spec.explode).sum(axis=1)
+
+    dice = np.concatenate(rounds, axis=1)
+    rolled = dice > 0
+    if spec.minimum is not None:
+        dice = np.where(rolled & (dice < spec.minimum), spec.minimum, dice)
+
+    if spec.keep == "kh":
+        totals = np.sort(dice, axis=1)[:, -spec.keep_count :].sum(axis=1)
+    elif spec.keep == "kl":
+        dice = np.sort(np.where(rolled, dice, spec.sides + 1), axis=1)
+        kept = dice[:, : spec.keep_count]
+        totals = np.where(kept <= spec.sides, kept, 0).sum(axis=1)
+    else:
+        totals = dice.sum(axis=1)
+
+    return spec.modify(totals)
+
+
+@lru_cache(maxsize=DISTRIBUTION_CACHE_SIZE)
+def distribution(spec: DiceSpec) -> Distribution:
+    """
+    Get the chance of each total of a dice expression. It's exact unless the dice
+    explode or there are too many to keep exactly, when it's estimated by sampling.
+    """
+    die = die_chances(spec)
+    if spec.explode is None and (
+        spec.kept == spec.count or keep_work(die, spec) <= EXACT_WORK_LIMIT
+    ):
+        if spec.kept == spec.count:
+            chances = sum_chances(die, spec.count)
+        else:
+            chances = keep_chances(die, spec.count, spec.kept, spec.keep == "kh")
+
+        outcomes: dict[int, float] = {}
+        totals = spec.modify(np.arange(len(chances)))
+        for total, chance in zip(totals.tolist(), chances.tolist()):
+            if chance > 0:
+                outcomes[total] = outcomes.get(total, 0.0) + chance
+        return Distribution(dict(sorted(outcomes.items())))
+
+    totals, counts = np.unique(
+        sample(spec, SAMPLES, np.random.default_rng(SAMPLE_SEED)), return_counts=True
+    )
+    return Distribution(
+        {
+            total: count / SAMPLES
+            for total, count in zip(totals.tolist(), counts.tolist())
+        },
+        exact=False,
+    )
@@ -1,6 +1,56 @@
-from .config import Config
-from .history import History
-from .logger import get_logger
-from .singleton import Singleton
+from importlib import import_module
+from typing import TYPE_CHECKING
 
-__all__ = ["Config", "History", "get_logger", "Singleton"]
+if TYPE_CHECKING:
+    from .adaptive import AdaptiveBatcher
+    from .bm25 import BM25Index
+    from .cache import LRUCache
+    from .coalescer import Coalescer
+    from .config import Config
+    from .embedding_cache import CachedEmbeddings
+    from .history import History, HistorySearch
+    from .logger import configure_logging, get_logger
+    from .manifest import Manifest, ManifestEntry, hash_file
+    from .rerank import cosine_similarities, count_tokens, fit_budget, merge_chunks, mmr
+    from .semantic_cache import SemanticCache
+    from .singleton import Singleton
+    from .tracing import Tracer
+    from .vector_store import NumpyVectorStore
+
+# Modules are imported on first use, so the app can start without loading
+# langchain or numpy
+_EXPORTS = {
+    "AdaptiveBatcher": ".adaptive",
+    "BM25Index": ".bm25",
+    "CachedEmbeddings": ".embedding_cache",
+    "Coalescer": ".coalescer",
+    "Config": ".config",
+    "configure_logging": ".logger",
+    "cosine_similarities": ".rerank",
+    "count_tokens": ".rerank",
+    "fit_budget": ".rerank",
+    "History": ".history",
+    "HistorySearch": ".history",
+    "get_logger": ".logger",
+    "hash_file": ".manifest",
+    "LRUCache": ".cache",
+    "Manifest": ".manifest",
+    "ManifestEntry": ".manifest",
+    "merge_chunks": ".rerank",
+    "mmr": ".rerank",
+    "NumpyVectorStore": ".vector_store",
+    "SemanticCache": ".semantic_cache",
+    "Singleton": ".singleton",
+    "Tracer": ".tracing",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
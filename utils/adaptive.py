@@ -0,0 +1,52 @@
+MIN_BATCH_SIZE = 8
+MAX_BATCH_SIZE = 256
+TARGET_LATENCY = 5.0  # Seconds a batch may take before backing off
+MIN_BACKOFF = 0.5  # Seconds to wait after the first error
+MAX_BACKOFF = 30.0
+
+
+class AdaptiveBatcher:
+    """
+    Adjust the size and number of concurrent batches sent to a server. Backs off when
+    batches are slow or fail, and ramps up while the server responds quickly, first by
+    sending more batches at once and then by making them larger.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        max_concurrency: int,
+        target_latency: float = TARGET_LATENCY,
+        min_batch_size: int = MIN_BATCH_SIZE,
+        max_batch_size: int = MAX_BATCH_SIZE,
+    ):
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.batch_size = min(max(batch_size, min_batch_size), max_batch_size)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.concurrency = 1
+        self.target_latency = target_latency
+        self.backoff = 0.0
+        self.errors = 0
+
+    def record(self, latency: float):
+        """Record how long a successful batch took."""
+        self.backoff = 0.0
+
+        if latency > self.target_latency:
+            self.concurrency = max(1, self.concurrency // 2)
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        elif latency < self.target_latency / 2:
+            if self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+            else:
+                self.batch_size = min(
+                    self.max_batch_size, self.batch_size + self.min_batch_size
+                )
+
+    def record_error(self):
+        """Record a failed batch, backing off exponentially."""
+        self.errors += 1
+        self.concurrency = 1
+        self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        self.backoff = min(MAX_BACKOFF, max(MIN_BACKOFF, self.backoff * 2))
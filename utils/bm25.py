@@ -0,0 +1,129 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+K1 = 1.5  # How quickly repeated terms stop adding to the score
+B = 0.75  # How much scores are normalized by document length
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Split text into lowercase word and number terms"""
+    return TOKEN_PATTERN.findall(text.casefold())
+
+
+class BM25Index:
+    """
+    Inverted index that ranks documents by keyword with BM25. Only the term counts
+    of each document are persisted, as JSON, and the postings are rebuilt from them
+    on load.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.modified = False
+        self.docs: dict[str, dict[str, int]] = {}
+        self.lengths: dict[str, int] = {}
+        self.postings: dict[str, dict[str, int]] = defaultdict(dict)
+        self.total_length = 0
+
+        # Documents are added from a worker thread while queries run on the event loop
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for doc_id, counts in json.load(f).items():
+                    self._add(doc_id, counts)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _add(self, doc_id: str, counts: dict[str, int]):
+        self.docs[doc_id] = counts
+        self.lengths[doc_id] = length = sum(counts.values())
+        self.total_length += length
+        for term, count in counts.items():
+            self.postings[term][doc_id] = count
+
+    def _remove(self, doc_id: str):
+        counts = self.docs.pop(doc_id, None)
+        if counts is None:
+            return
+
+        self.total_length -= self.lengths.pop(doc_id)
+        for term in counts:
+            postings = self.postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[term]
+
+    def add(self, ids: list[str], texts: list[str]):
+        """Add or replace documents."""
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                self._remove(doc_id)
+                self._add(doc_id, dict(Counter(tokenize(text))))
+            self.modified = True
+
+    def remove(self, ids: list[str]):
+        """Remove documents, ignoring any not in the index."""
+        with self._lock:
+            for doc_id in ids:
+                self._remove(doc_id)
+            self.modified = True
+
+    def has_terms(self, terms: list[str]) -> bool:
+        """Check whether every term appears in some document."""
+        with self._lock:
+            return all(term in self.postings for term in terms)
+
+    def search(self, query: str, k: int) -> list[tuple[str, float]]:
+        """Get the IDs and scores of the k documents that best match a query."""
+        with self._lock:
+            if not self.docs:
+                return []
+
+            count = len(self.docs)
+            average_length = self.total_length / count
+            scores: dict[str, float] = defaultdict(float)
+            for term in dict.fromkeys(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+
+                idf = math.log(
+                    1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for doc_id, freq in postings.items():
+                    norm = 1 - B + B * self.lengths[doc_id] / average_length
+                    scores[doc_id] += idf * freq * (K1 + 1) / (freq + K1 * norm)
+
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def clear(self):
+        """Remove all documents."""
+        with self._lock:
+            self.docs = {}
+            self.lengths = {}
+            self.postings = defaultdict(dict)
+            self.total_length = 0
+            self.modified = True
+
+    def save(self):
+        """Write the index to disk, if it changed."""
+        with self._lock:
+            if not self.modified:
+                return
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+            # Write to a temporary file first so that a crash can't leave a partial index
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.docs, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self.modified = False
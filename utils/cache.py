@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Hashable
+
+DEFAULT_MAX_SIZE = 256
+DEFAULT_TTL = 600.0  # Seconds
+
+
+class LRUCache:
+    """
+    An in-memory cache that evicts the least recently used entries once it's full,
+    and expires entries after a time to live.
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl: float = DEFAULT_TTL,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Get a value, or None if it's missing or expired."""
+        entry = self.entries.get(key)
+        if entry is None or self.clock() - entry[0] > self.ttl:
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any):
+        """Add or replace a value, evicting the least recently used if full."""
+        if self.max_size <= 0:
+            return
+
+        self.entries[key] = (self.clock(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all values."""
+        self.entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """Get the hit and miss counts."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
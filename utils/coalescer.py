@@ -0,0 +1,36 @@
+from threading import Lock
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class Coalescer(Generic[T]):
+    """
+    Keep only the latest of a stream of values, e.g. the text of a response as its
+    tokens arrive, so a timer can render it at its own rate rather than per value.
+    Values can be pushed from any thread.
+    """
+
+    def __init__(self, render: Callable[[T], object]):
+        self.render = render
+        self.lock = Lock()
+        self.pending: T | None = None
+        self.dirty = False
+
+    def push(self, value: T) -> None:
+        """Replace the value waiting to be rendered"""
+        with self.lock:
+            self.pending = value
+            self.dirty = True
+
+    def flush(self) -> bool:
+        """Render the latest value, if there's a new one. Returns whether there was"""
+        with self.lock:
+            if not self.dirty:
+                return False
+            value = self.pending
+            self.pending = None
+            self.dirty = False
+
+        self.render(value)
+        return True
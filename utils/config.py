@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -29,3 +31,177 @@ class Config(BaseSettings):
         description="Chroma collection name",
         frozen=True,
     )
+    game: str | None = Field(
+        default=None,
+        description="Game to search to start with, i.e. a subdirectory of the PDF directory. Unset to search every game",
+        frozen=True,
+    )
+    chroma_path: str = Field(
+        default=".chroma",
+        description="The directory for the persistent Chroma store",
+        frozen=True,
+    )
+    ingest_workers: int | None = Field(
+        default=None,
+        description="Number of processes for parsing PDFs. Defaults to the CPU count",
+        frozen=True,
+    )
+    embedding_cache_mb: int = Field(
+        default=512,
+        description="Maximum size of the on-disk embedding cache in megabytes",
+        frozen=True,
+    )
+    embedding_concurrency: int = Field(
+        default=4,
+        description="Maximum number of batches to embed at once while loading",
+        frozen=True,
+    )
+    rag_prompt_path: str | None = Field(
+        default=None,
+        description="A file to override the RAG prompt, with {question} and {context}",
+        frozen=True,
+    )
+    answer_cache_size: int = Field(
+        default=1000,
+        description="Maximum number of answers to cache. Set to 0 to disable",
+        frozen=True,
+    )
+    answer_cache_threshold: float = Field(
+        default=0.95,
+        description="How similar a question must be to a cached one to reuse its answer",
+        frozen=True,
+    )
+    retrieval_cache_size: int = Field(
+        default=256,
+        description="Maximum number of retrieval results to cache. Set to 0 to disable",
+        frozen=True,
+    )
+    retrieval_cache_ttl: float = Field(
+        default=600.0,
+        description="Seconds to keep a cached retrieval result",
+        frozen=True,
+    )
+    retrieval_mode: Literal["hybrid", "vector", "lexical"] = Field(
+        default="hybrid",
+        description="Search chunks by meaning, by keyword, or both",
+        frozen=True,
+    )
+    retrieval_fetch_k: int = Field(
+        default=20,
+        description="Chunks found by meaning to choose the most relevant and varied from",
+        ge=1,
+        frozen=True,
+    )
+    retrieval_mmr_lambda: float = Field(
+        default=0.7,
+        description="Weight of relevance against variety when choosing chunks. Set to 1 for relevance alone",
+        ge=0,
+        le=1,
+        frozen=True,
+    )
+    retrieval_min_similarity: float = Field(
+        default=-1.0,
+        description="Least cosine similarity to the question for a chunk found by meaning to be used. Depends on the embedding model, so it's off by default",
+        ge=-1,
+        le=1,
+        frozen=True,
+    )
+    retrieval_token_budget: int = Field(
+        default=1200,
+        description="Most tokens of rules to send with a question. Set to 0 for no limit",
+        ge=0,
+        frozen=True,
+    )
+    vector_backend: Literal["chroma", "numpy"] = Field(
+        default="chroma",
+        description="Where to keep the vectors of chunks: in Chroma, or in memory-mapped files searched with NumPy",
+        frozen=True,
+    )
+    vector_dtype: Literal["float32", "int8"] = Field(
+        default="float32",
+        description="Type to keep vectors as with NumPy. int8 takes a quarter of the memory, at some cost to recall",
+        frozen=True,
+    )
+    ivf_min_chunks: int = Field(
+        default=20_000,
+        description="Chunks in a collection before NumPy searches only the partitions nearest the query. Set to 0 to always search every chunk",
+        ge=0,
+        frozen=True,
+    )
+    ivf_probes: int = Field(
+        default=8,
+        description="Partitions NumPy searches for each query. More raises recall and latency",
+        ge=1,
+        frozen=True,
+    )
+    hnsw_space: Literal["l2", "cosine", "ip"] = Field(
+        default="l2",
+        description="Distance the vector index compares chunks by, with Chroma or NumPy. Set when the collection is created",
+        frozen=True,
+    )
+    hnsw_m: int = Field(
+        default=16,
+        description="Links per vector in the index. More raises recall, memory and build time",
+        ge=2,
+        frozen=True,
+    )
+    hnsw_construction_ef: int = Field(
+        default=100,
+        description="Candidates considered when adding a vector to the index. More builds a better index, slower",
+        ge=1,
+        frozen=True,
+    )
+    hnsw_search_ef: int = Field(
+        default=100,
+        description="Candidates considered when searching the index. More raises recall and latency",
+        ge=1,
+        frozen=True,
+    )
+    vector_search_timeout: float = Field(
+        default=2.0,
+        description="Seconds to wait for a vector search before using keywords alone",
+        frozen=True,
+    )
+    trace_path: str | None = Field(
+        default="logs/traces.jsonl",
+        description="File to append a timing trace of each response to. Unset to disable",
+        frozen=True,
+    )
+    log_level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = Field(
+        default="INFO",
+        description="Level of the app's messages to log, e.g. DEBUG",
+        frozen=True,
+    )
+    memory_path: str | None = Field(
+        default=".memory.sqlite",
+        description="SQLite file to keep conversations in. Unset to answer each question on its own",
+        frozen=True,
+    )
+    session_id: str = Field(
+        default="default",
+        description="Conversation to continue, from the memory file",
+        frozen=True,
+    )
+    memory_token_budget: int = Field(
+        default=2000,
+        description="Most tokens of earlier questions and answers to send with a question",
+        ge=0,
+        frozen=True,
+    )
+    render_fps: float = Field(
+        default=20.0,
+        description="Most times a second to redraw a response as it streams in",
+        gt=0,
+        frozen=True,
+    )
+    history_path: str | None = Field(
+        default=".history",
+        description="File to keep the prompts sent in, across sessions. Unset to disable",
+        frozen=True,
+    )
+    history_size: int = Field(
+        default=10_000,
+        description="Most prompts to keep in the history",
+        ge=1,
+        frozen=True,
+    )
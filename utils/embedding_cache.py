@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from array import array
+from time import time
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+EVICTION_TARGET = 0.9  # Fraction of the maximum size to shrink to when evicting
+QUERY_PREFIX = "query\0"
+SQL_BATCH_SIZE = 500  # Stay well under SQLite's limit on query parameters
+
+
+def text_hash(text: str) -> str:
+    """Get the sha256 hash of a text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def as_float32(vector: list[float]) -> list[float]:
+    """Round a vector to float32, so cached and fresh vectors are identical"""
+    return array("f", vector).tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wrap an embedder with a persistent cache, so that identical texts are only
+    embedded once per model. Vectors are stored as float32 in a SQLite file, and the
+    least recently used are evicted once the file grows past the maximum size.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        path: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.embeddings = embeddings
+        self.model = model
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._size = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the cache on first use"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+            # Chroma embeds from worker threads, so access is guarded by the lock
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    accessed REAL NOT NULL,
+                    PRIMARY KEY (model, hash)
+                )
+                """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)"
+            )
+            (size,) = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+            self._size = size
+        return self._conn
+
+    def stats(self) -> dict[str, int | float]:
+        """Get the hit and miss counts for this session"""
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, self._size
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "bytes": size,
+        }
+
+    def get_many(self, hashes: list[str]) -> dict[str, list[float]]:
+        """Get the cached vectors for text hashes, marking them as recently used"""
+        found: dict[str, list[float]] = {}
+        with self._lock:
+            for start in range(0, len(hashes), SQL_BATCH_SIZE):
+                batch = hashes[start : start + SQL_BATCH_SIZE]
+                rows = self.conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? "
+                    f"AND hash IN ({','.join('?' * len(batch))})",
+                    [self.model, *batch],
+                )
+                for hash_, vector in rows:
+                    found[hash_] = array("f", vector).tolist()
+
+            if found:
+                now = time()
+                self.conn.executemany(
+                    "UPDATE embeddings SET accessed = ? WHERE model = ? AND hash = ?",
+                    [(now, self.model, hash_) for hash_ in found],
+                )
+                self.conn.commit()
+        return found
+
+    def put_many(self, vectors: dict[str, list[float]]):
+        """Store vectors by text hash, evicting old vectors if the cache is full"""
+        now = time()
+        rows = [
+            (self.model, hash_, array("f", vector).tobytes(), now)
+            for hash_, vector in vectors.items()
+        ]
+        with self._lock:
+            # Vectors already stored are replaced, so only the difference is added
+            replaced = 0
+            hashes = list(vectors)
+            for start in range(0, len(hashes), SQL_BATCH_SIZE):
+                batch = hashes[start : start + SQL_BATCH_SIZE]
+                (size,) = self.conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings "
+                    f"WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    [self.model, *batch],
+                ).fetchone()
+                replaced += size
+
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows
+            )
+            self._size += sum(len(row[2]) for row in rows) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        """Delete the least recently used vectors until under the target size"""
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count == 0:
+            return
+
+        excess = self._size - self.max_bytes * EVICTION_TARGET
+        number = min(count, math.ceil(excess / (self._size / count)))
+        self.conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY accessed LIMIT ?)",
+            (number,),
+        )
+        (self._size,) = self.conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+
+    def _count(self, hits: int, misses: int):
+        """Add to the hit and miss counts, which embedding threads share"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def _split(
+        self, texts: list[str]
+    ) -> tuple[list[str], dict[str, list[float]], list[str]]:
+        """Get the hashes of the texts, the cached vectors, and the texts to embed"""
+        hashes = [text_hash(text) for text in texts]
+        cached = self.get_many(list(set(hashes)))
+        missing = list(
+            {h: t for h, t in zip(hashes, texts) if h not in cached}.values()
+        )
+
+        self._count(hits=len(texts) - len(missing), misses=len(missing))
+        return hashes, cached, missing
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed texts, only calling the embedder for texts not in the cache"""
+        hashes, cached, missing = self._split(texts)
+        if missing:
+            vectors = self.embeddings.embed_documents(missing)
+            new = {
+                text_hash(text): as_float32(vector)
+                for text, vector in zip(missing, vectors)
+            }
+            self.put_many(new)
+            cached.update(new)
+        return [cached[hash_] for hash_ in hashes]
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed texts, only calling the embedder for texts not in the cache"""
+        # The cache is read and written in a thread, to keep the event loop free
+        hashes, cached, missing = await asyncio.to_thread(self._split, texts)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(missing)
+            new = {
+                text_hash(text): as_float32(vector)
+                for text, vector in zip(missing, vectors)
+            }
+            await asyncio.to_thread(self.put_many, new)
+            cached.update(new)
+        return [cached[hash_] for hash_ in hashes]
+
+    def _get_query(self, text: str) -> tuple[str, list[float] | None]:
+        """Get the hash of a query and its cached vector, if any"""
+        # Some embedders treat queries differently, so they're cached separately
+        hash_ = text_hash(QUERY_PREFIX + text)
+        vector = self.get_many([hash_]).get(hash_)
+        self._count(hits=int(vector is not None), misses=int(vector is None))
+        return hash_, vector
+
+    def embed_query(self, text: str) -> list[float]:
+        """Embed a query, using the cache"""
+        hash_, vector = self._get_query(text)
+        if vector is None:
+            vector = as_float32(self.embeddings.embed_query(text))
+            self.put_many({hash_: vector})
+        return vector
+
+    async def aembed_query(self, text: str) -> list[float]:
+        """Embed a query, using the cache"""
+        hash_, vector = await asyncio.to_thread(self._get_query, text)
+        if vector is None:
+            vector = as_float32(await self.embeddings.aembed_query(text))
+            await asyncio.to_thread(self.put_many, {hash_: vector})
+        return vector
@@ -1,22 +1,183 @@
-MAX_HISTORY_SIZE = 100
+import json
+import os
+from bisect import bisect_left
+from collections import deque
+from queue import SimpleQueue
+from threading import Thread
+
+MAX_HISTORY_SIZE = 10_000
+COMPACT_RATIO = 2  # The file is rewritten once it holds this many times the size
+GRAM_LENGTH = 3  # Length of the pieces of text the search index is made of
+
+
+def grams(text: str) -> set[str]:
+    """Get the pieces of text that the search index maps to messages"""
+    return {text[i : i + GRAM_LENGTH] for i in range(len(text) - GRAM_LENGTH + 1)}
+
+
+def read_history(path: str, size: int) -> tuple[list[str], int]:
+    """
+    Read the latest messages from a history file, skipping any line that can't be
+    read, e.g. one cut short by a crash. Returns them and the lines in the file.
+    """
+    messages: deque[str] = deque(maxlen=size)
+    lines = 0
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for lines, line in enumerate(f, start=1):
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(message, str):
+                messages.append(message)
+    return list(messages), lines
 
 
 class History:
-    """Maintain a history of messages and allow the user to page through it."""
+    """
+    Maintain a history of messages and allow the user to page through it, or search
+    it. If given a path, the history is kept in an append-only file, which a
+    background thread writes, so adding a message never waits on the disk.
+    """
 
-    def __init__(self, size: int = MAX_HISTORY_SIZE):
+    def __init__(self, size: int = MAX_HISTORY_SIZE, path: str | None = None):
         self.size = size
-        self.history: list[str] = []
+        self.path = path
+        self.history: deque[str] = deque(maxlen=size)
         self.index = 0
 
-    def append(self, message: str):
-        """Add a message to the history."""
+        # Messages are numbered in the order they're added, so numbers stay the same
+        # as old ones are dropped. The index maps pieces of text to message numbers,
+        # and is built on the first search, so loading the history stays quick.
+        self.offset = 0  # Number of the oldest message kept
+        self.folded: deque[str] = deque(maxlen=size)
+        self.grams: dict[str, list[int]] | None = None
+        self.indexed_from = 0
+
+        self.queue: SimpleQueue[str | None] = SimpleQueue()
+        self.writer: Thread | None = None
+        lines = 0
+        if path is not None and os.path.exists(path):
+            messages, lines = read_history(path, size)
+            for message in messages:
+                self.add(message)
+            self.index = len(self.history) - 1 if self.history else 0
+        self.lines = lines
+
+    def __len__(self) -> int:
+        return len(self.history)
+
+    def add(self, message: str):
+        """Add a message to the history and its search index."""
+        if len(self.history) == self.size:
+            self.offset += 1
         self.history.append(message)
-        if len(self.history) > self.size:
-            self.history.pop(0)
+        folded = message.casefold()
+        self.folded.append(folded)
+
+        if self.grams is None:
+            return
+        number = self.offset + len(self.history) - 1
+        for gram in grams(folded):
+            self.grams.setdefault(gram, []).append(number)
 
+        # Dropped messages are skipped in searches, and cleared out of the index
+        # once there are as many of them as are kept
+        if self.offset - self.indexed_from >= self.size:
+            self.reindex()
+
+    def reindex(self):
+        """Rebuild the search index from the messages kept."""
+        self.grams = {}
+        for number, folded in enumerate(self.folded, start=self.offset):
+            for gram in grams(folded):
+                self.grams.setdefault(gram, []).append(number)
+        self.indexed_from = self.offset
+
+    def append(self, message: str):
+        """Add a message to the history, and to the file if there is one."""
+        self.add(message)
         self.index = len(self.history) - 1
 
+        if self.path is not None:
+            if self.writer is None:
+                self.writer = Thread(
+                    target=self.write,
+                    args=(self.lines, list(self.history)[:-1]),
+                    daemon=True,
+                )
+                self.writer.start()
+            self.queue.put(message)
+
+    def write(self, lines: int, saved: list[str]):
+        """
+        Append queued messages to the file until the history is closed. Once the
+        file holds too many messages, it's replaced with only the ones kept.
+        """
+        kept: deque[str] = deque(saved, maxlen=self.size)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        f = open(self.path, "a", encoding="utf-8")
+        try:
+            while (message := self.queue.get()) is not None:
+                f.write(json.dumps(message) + "\n")
+                kept.append(message)
+                lines += 1
+
+                if lines >= COMPACT_RATIO * self.size:
+                    f.close()
+                    temp_path = f"{self.path}.tmp"
+                    with open(temp_path, "w", encoding="utf-8") as temp:
+                        temp.writelines(json.dumps(m) + "\n" for m in kept)
+                    os.replace(temp_path, self.path)
+                    f = open(self.path, "a", encoding="utf-8")
+                    lines = len(kept)
+                elif self.queue.empty():
+                    f.flush()
+        finally:
+            f.close()
+
+    def close(self):
+        """Wait for the messages added to be written to the file."""
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+
+    def get(self, number: int) -> str:
+        """Get a message by its number."""
+        return self.history[number - self.offset]
+
+    def find(self, query: str, before: int | None = None) -> int | None:
+        """
+        Get the number of the latest message containing the query, ignoring case,
+        before the given number. Return None if no message matches.
+        """
+        query = query.casefold()
+        end = self.offset + len(self.history)
+        if before is not None:
+            end = min(before, end)
+
+        # Short queries are looked for in every message, latest first
+        if len(query) < GRAM_LENGTH:
+            for number in range(end - 1, self.offset - 1, -1):
+                if query in self.folded[number - self.offset]:
+                    return number
+            return None
+
+        # Otherwise only messages with the query's rarest piece need checking
+        if self.grams is None:
+            self.reindex()
+        postings = [self.grams.get(gram) for gram in grams(query)]
+        if not all(postings):
+            return None
+        shortest = min(postings, key=len)
+        first = bisect_left(shortest, self.offset)
+        for position in range(bisect_left(shortest, end) - 1, first - 1, -1):
+            number = shortest[position]
+            if query in self.folded[number - self.offset]:
+                return number
+        return None
+
     def prev(self) -> str | None:
         """
         Get the message from history at the index and traverse back if possible.
@@ -43,3 +204,48 @@ class History:
 
         self.index += 1
         return self.history[self.index]
+
+
+class HistorySearch:
+    """An incremental search back through a history, as with Ctrl-R in a shell"""
+
+    def __init__(self, history: History):
+        self.history = history
+        self.query = ""
+        self.match: int | None = None
+        self.seen: set[str] = set()
+
+    def update(self, query: str) -> str | None:
+        """
+        Find the latest message containing the query. Typing more of the query
+        carries on from the current match. Return None if no message matches.
+        """
+        before = None
+        if self.match is not None and query.startswith(self.query):
+            before = self.match + 1
+        self.query = query
+        self.seen = set()
+        self.match = self.history.find(query, before) if query else None
+        if self.match is None:
+            return None
+
+        message = self.history.get(self.match)
+        self.seen.add(message)
+        return message
+
+    def older(self) -> str | None:
+        """
+        Find the next older message containing the query, skipping ones already
+        found. Return None, keeping the current match, if there are no more.
+        """
+        if self.match is None:
+            return None
+
+        number = self.match
+        while (number := self.history.find(self.query, number)) is not None:
+            message = self.history.get(number)
+            if message not in self.seen:
+                self.match = number
+                self.seen.add(message)
+                return message
+        return None
@@ -1,21 +1,100 @@
-import datetime
+import atexit
 import logging
-from zoneinfo import ZoneInfo
+import os
+from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import SimpleQueue
 
-utc = ZoneInfo("UTC")
 LOG_PATH = "logs"
+LOG_FILE = "app.log"
+LOG_FORMAT = "%(asctime)s - %(levelname)s -  %(name)s - %(message)s"
+APP_LOGGER = "app"  # Parent of the app's loggers, which sets their level
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+MAX_MESSAGE_LENGTH = 2000  # Characters of a message to keep
 
+_listener: QueueListener | None = None
 
-def get_logger(name, level=logging.DEBUG) -> logging.Logger:
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
 
-    now = datetime.datetime.now(utc)
-    file_path = f"{LOG_PATH}/" + now.strftime("%Y-%m-%d_%H") + ".log"
-    log_format = "%(asctime)s - %(levelname)s -  %(name)s - %(message)s"
+class TruncatingFormatter(logging.Formatter):
+    """Formatter that cuts long messages short, e.g. dumps of the graph state"""
 
-    file_handler = logging.FileHandler(file_path)
-    file_handler.setFormatter(logging.Formatter(log_format))
-    logger.addHandler(file_handler)
-    # logger.propagate = False  # Prevent bubbling up to root logger
-    return logger
+    def __init__(self, fmt: str | None = None, max_length: int = MAX_MESSAGE_LENGTH):
+        super().__init__(fmt)
+        self.max_length = max_length
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        excess = len(record.message) - self.max_length
+        if excess > 0:
+            record.message = (
+                f"{record.message[: self.max_length]}... [{excess} more characters]"
+            )
+        return super().formatMessage(record)
+
+
+class DailyRotatingFileHandler(RotatingFileHandler):
+    """Rotate the log when it grows past its maximum size, and at the start of each day"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rollover_at = self.next_rollover()
+
+    @staticmethod
+    def next_rollover() -> datetime:
+        return datetime.combine(
+            datetime.now().date() + timedelta(days=1), datetime.min.time()
+        )
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if datetime.now() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self.next_rollover()
+
+
+def configure_logging(
+    level: str | int = logging.INFO,
+    path: str = LOG_PATH,
+    max_bytes: int = MAX_BYTES,
+    backup_count: int = BACKUP_COUNT,
+    max_length: int = MAX_MESSAGE_LENGTH,
+) -> None:
+    """
+    Send log records through a queue to a rotating file, which a background thread
+    writes, so logging never blocks the event loop. Libraries only log warnings, and
+    the app logs at the given level. Only the first call has any effect.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    os.makedirs(path, exist_ok=True)
+    file_handler = DailyRotatingFileHandler(
+        os.path.join(path, LOG_FILE),
+        maxBytes=max_bytes,
+        backupCount=backup_count,
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    # Messages are formatted before they're queued, so they're truncated then
+    queue: SimpleQueue = SimpleQueue()
+    queue_handler = QueueHandler(queue)
+    queue_handler.setFormatter(TruncatingFormatter(max_length=max_length))
+
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(logging.WARNING)
+    logging.getLogger(APP_LOGGER).setLevel(level)
+
+    _listener = QueueListener(queue, file_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Get a logger for a module of the app"""
+    return logging.getLogger(APP_LOGGER).getChild(name)
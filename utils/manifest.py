@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read at a time when hashing a file
+
+
+def hash_file(path: str) -> str:
+    """Get the sha256 hash of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass
+class ManifestEntry:
+    """A file that has been loaded into the store"""
+
+    size: int
+    mtime: float
+    hash: str
+    ids: list[str] = field(default_factory=list)
+
+
+class Manifest:
+    """
+    Keep track of the files loaded into a store, so that unchanged files can be skipped
+    and the chunks of changed or removed files can be deleted.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: dict[str, ManifestEntry] = {}
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = {
+                    file_path: ManifestEntry(**entry)
+                    for file_path, entry in json.load(f).items()
+                }
+
+    def get(self, file_path: str) -> ManifestEntry | None:
+        """Get the entry for a file, if it has been loaded."""
+        return self.entries.get(file_path)
+
+    def set(self, file_path: str, entry: ManifestEntry):
+        """Add or replace the entry for a file."""
+        self.entries[file_path] = entry
+
+    def remove(self, file_path: str) -> ManifestEntry | None:
+        """Remove the entry for a file and return it."""
+        return self.entries.pop(file_path, None)
+
+    def is_current(self, file_path: str, stat: os.stat_result) -> bool:
+        """Check whether a file is unchanged since it was loaded, without reading it."""
+        entry = self.entries.get(file_path)
+        return (
+            entry is not None
+            and entry.size == stat.st_size
+            and entry.mtime == stat.st_mtime
+        )
+
+    def missing(self, file_paths: list[str]) -> list[str]:
+        """Get the loaded files that are not in the list of file paths."""
+        existing = set(file_paths)
+        return [path for path in self.entries if path not in existing]
+
+    def clear(self):
+        """Remove all entries."""
+        self.entries = {}
+
+    def save(self):
+        """Write the manifest to disk."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        # Write to a temporary file first so that a crash can't leave a partial manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({k: asdict(v) for k, v in self.entries.items()}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+from langchain_core.documents import Document
+
+CHARS_PER_TOKEN = 4  # Rough length of a token, for budgeting without a tokenizer
+ADJACENT_GAP = 2  # Most characters, e.g. a stripped newline, between adjacent chunks
+MIN_OVERLAP = 20  # Shortest shared text taken to be the overlap of two chunks
+
+
+def count_tokens(text: str) -> int:
+    """Estimate the number of tokens in some text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def cosine_similarities(query: list[float], vectors: np.ndarray) -> np.ndarray:
+    """Get the cosine similarity of each row of a matrix to a query vector"""
+    query_array = np.asarray(query, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_array)
+    return (vectors @ query_array) / np.where(norms > 0, norms, 1.0)
+
+
+def mmr(
+    similarities: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float
+) -> list[int]:
+    """
+    Choose up to k vectors by maximal marginal relevance: each is the most similar
+    to the query, less its similarity to those already chosen, weighted by lambda.
+    Returns their positions, in the order chosen.
+    """
+    count = len(similarities)
+    if count == 0 or k <= 0:
+        return []
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms > 0, norms, 1.0)
+
+    # The most similar to any chosen so far, updated a column at a time
+    redundancy = np.full(count, -np.inf, dtype=np.float32)
+    chosen = [int(np.argmax(similarities))]
+    for _ in range(min(k, count) - 1):
+        redundancy = np.maximum(redundancy, unit @ unit[chosen[-1]])
+        scores = lambda_mult * similarities - (1 - lambda_mult) * redundancy
+        scores[chosen] = -np.inf
+        chosen.append(int(np.argmax(scores)))
+    return chosen
+
+
+def same_page(first: Document, second: Document) -> bool:
+    """Check whether two chunks are from the same page of the same file"""
+    return all(
+        first.metadata.get(key) == second.metadata.get(key)
+        for key in ("source", "page")
+    )
+
+
+def overlap_length(first: str, second: str) -> int:
+    """Get the length of the longest end of the first text that starts the second"""
+    probe = second[:MIN_OVERLAP]
+    if len(probe) < MIN_OVERLAP:
+        return 0
+
+    # The earliest place the second text starts in the first is the longest overlap
+    position = first.find(probe)
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(probe, position + 1)
+    return 0
+
+
+def join_chunks(first: Document, second: Document) -> str | None:
+    """
+    Join the text of two chunks of the same page if they overlap, or are next to
+    each other. Chunks are placed by their start in the page if they have one, and
+    otherwise by the text they share. Returns None if they can't be joined.
+    """
+    a, b = first.page_content, second.page_content
+    start_a = first.metadata.get("start_index")
+    start_b = second.metadata.get("start_index")
+    if start_a is not None and start_b is not None:
+        if start_b < start_a:
+            a, b, start_a, start_b = b, a, start_b, start_a
+        end_a = start_a + len(a)
+        if start_b > end_a + ADJACENT_GAP:
+            return None
+        if start_b + len(b) <= end_a:
+            return a
+        if start_b < end_a:
+            return a[: start_b - start_a] + b
+        return f"{a}\n{b}"
+
+    if b in a:
+        return a
+    if a in b:
+        return b
+    if length := overlap_length(a, b):
+        return a + b[length:]
+    if length := overlap_length(b, a):
+        return b + a[length:]
+    return None
+
+
+def merge_chunks(docs: list[Document]) -> list[Document]:
+    """
+    Merge chunks of the same page that overlap or are next to each other, so shared
+    text is only sent once. A merged chunk takes the place of the first of them.
+    """
+    merged: list[Document] = []
+    for doc in docs:
+        index = len(merged)
+        merged.append(doc)
+
+        # A merged chunk may meet another, so keep going until none are left
+        while True:
+            current = merged[index]
+            for other_index, other in enumerate(merged):
+                if other_index != index and same_page(other, current):
+                    if (text := join_chunks(other, current)) is not None:
+                        break
+            else:
+                break
+
+            first, last = sorted((index, other_index))
+            metadata = merged[first].metadata.copy()
+            if "start_index" in current.metadata and "start_index" in other.metadata:
+                metadata["start_index"] = min(
+                    current.metadata["start_index"], other.metadata["start_index"]
+                )
+            merged[first] = merged[first].model_copy(
+                update={"page_content": text, "metadata": metadata}
+            )
+            del merged[last]
+            index = first
+    return merged
+
+
+def fit_budget(docs: list[Document], max_tokens: int) -> list[Document]:
+    """
+    Keep the first chunks that fit in a token budget. The first is cut short if it's
+    too long on its own. A budget of 0 keeps them all.
+    """
+    if max_tokens <= 0:
+        return docs
+
+    kept: list[Document] = []
+    remaining = max_tokens
+    for doc in docs:
+        tokens = count_tokens(doc.page_content)
+        if tokens > remaining:
+            if not kept:
+                text = doc.page_content[: max_tokens * CHARS_PER_TOKEN]
+                kept.append(doc.model_copy(update={"page_content": text}))
+            break
+        kept.append(doc)
+        remaining -= tokens
+    return kept
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import sqlite3
+import threading
+from time import time
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.95  # Cosine similarity needed to reuse an answer
+DEFAULT_MAX_ENTRIES = 1000
+
+
+class SemanticCache:
+    """
+    Cache answers by the meaning of the question. A question is answered from the
+    cache when its embedding is similar enough to a previous question's. Entries are
+    persisted in a SQLite file, and the least recently used are evicted once there
+    are more than the maximum.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        model: str,
+        threshold: float = DEFAULT_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.model = model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # Lookups and additions run in worker threads, and may call each other
+        self._lock = threading.RLock()
+        self._conn: sqlite3.Connection | None = None
+        self._ids: list[int] = []
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Open the cache and load the question embeddings on first use"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    answer TEXT NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """)
+            rows = self._conn.execute(
+                "SELECT id, vector FROM answers WHERE model = ? ORDER BY id",
+                (self.model,),
+            ).fetchall()
+            self._ids = [row[0] for row in rows]
+            if rows:
+                self._vectors = np.stack(
+                    [np.frombuffer(row[1], dtype=np.float32) for row in rows]
+                )
+        return self._conn
+
+    def __len__(self) -> int:
+        with self._lock:
+            _ = self.conn  # Loads the entries on first use
+            return len(self._ids)
+
+    @staticmethod
+    def normalize(vector: list[float]) -> np.ndarray:
+        """Scale a vector to unit length, so dot products are cosine similarities"""
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def lookup(self, vector: list[float]) -> str | None:
+        """Get the answer to the most similar previous question, if similar enough"""
+        query = self.normalize(vector)
+        with self._lock:
+            if not len(self) or self._vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            similarities = self._vectors @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.conn.execute(
+                "UPDATE answers SET accessed = ? WHERE id = ?",
+                (time(), self._ids[best]),
+            )
+            self.conn.commit()
+            (answer,) = self.conn.execute(
+                "SELECT answer FROM answers WHERE id = ?", (self._ids[best],)
+            ).fetchone()
+            return answer
+
+    async def alookup(self, vector: list[float]) -> str | None:
+        """Get the answer to a similar question, without blocking the event loop"""
+        return await asyncio.to_thread(self.lookup, vector)
+
+    def add(self, question: str, vector: list[float], answer: str):
+        """Cache the answer to a question"""
+        normalized = self.normalize(vector)
+        with self._lock:
+            # Embeddings of a different size can't be compared, so start again
+            if len(self) and self._vectors.shape[1] != normalized.shape[0]:
+                self.clear()
+
+            cursor = self.conn.execute(
+                "INSERT INTO answers (model, question, vector, answer, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (self.model, question, normalized.tobytes(), answer, time()),
+            )
+            self._ids.append(cursor.lastrowid)
+            self._vectors = (
+                np.vstack([self._vectors, normalized])
+                if self._vectors.size
+                else normalized[np.newaxis, :]
+            )
+
+            if len(self._ids) > self.max_entries:
+                self._evict(len(self._ids) - self.max_entries)
+            self.conn.commit()
+
+    async def aadd(self, question: str, vector: list[float], answer: str):
+        """Cache the answer to a question, without blocking the event loop"""
+        await asyncio.to_thread(self.add, question, vector, answer)
+
+    def _evict(self, number: int):
+        """Delete the least recently used answers"""
+        evicted = {
+            row[0]
+            for row in self.conn.execute(
+                "SELECT id FROM answers WHERE model = ? ORDER BY accessed LIMIT ?",
+                (self.model, number),
+            )
+        }
+        self.conn.executemany(
+            "DELETE FROM answers WHERE id = ?", [(id_,) for id_ in evicted]
+        )
+        keep = [i for i, id_ in enumerate(self._ids) if id_ not in evicted]
+        self._ids = [self._ids[i] for i in keep]
+        self._vectors = self._vectors[keep]
+
+    def clear(self):
+        """Remove all answers, e.g. when the documents they're based on change"""
+        with self._lock:
+            self.conn.execute("DELETE FROM answers")
+            self.conn.commit()
+            self._ids = []
+            self._vectors = np.empty((0, 0), dtype=np.float32)
@@ -0,0 +1,230 @@
+import atexit
+import json
+import logging
+import os
+import statistics
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from logging.handlers import QueueListener
+from queue import SimpleQueue
+from time import perf_counter, time
+from typing import Any, Callable
+
+# Upper bounds of the histogram buckets, in seconds
+HISTOGRAM_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+HISTOGRAM_BARS = " ▁▂▃▄▅▆▇█"
+
+# Stream events that start and end spans, and the kind of span
+SPAN_EVENTS = {
+    "on_chain": "node",
+    "on_tool": "tool",
+    "on_retriever": "retriever",
+    "on_chat_model": "model",
+}
+
+
+def format_duration(seconds: float) -> str:
+    """Format a duration like 85ms or 2.1s"""
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    return f"{seconds:.1f}s"
+
+
+@dataclass
+class Span:
+    """A timed node, tool, retriever or model call. Times are seconds since the start."""
+
+    name: str
+    kind: str
+    node: str | None
+    start: float
+    end: float | None = None
+    first_token: float | None = None
+    tokens: int = 0
+
+    @property
+    def duration(self) -> float:
+        return (self.end or self.start) - self.start
+
+
+@dataclass
+class Trace:
+    """The spans of one response, built from the workflow's stream events"""
+
+    question: str
+    clock: Callable[[], float] = field(default=perf_counter, repr=False)
+    timestamp: float = field(default_factory=time)
+    spans: list[Span] = field(default_factory=list)
+    cached: bool = False
+    cancelled: bool = False
+    first_output: float | None = None
+    total: float | None = None
+
+    def __post_init__(self):
+        self._start = self.clock()
+        self._open: dict[str, Span] = {}
+
+    def now(self) -> float:
+        return self.clock() - self._start
+
+    def observe(self, event: dict[str, Any]):
+        """Start, update or end a span from a stream event"""
+        prefix, _, stage = event["event"].rpartition("_")
+        kind = SPAN_EVENTS.get(prefix)
+        run_id = event.get("run_id")
+        if kind is None or run_id is None:
+            return
+        node = event.get("metadata", {}).get("langgraph_node")
+
+        # Only time the nodes themselves, not the runnables inside them
+        if kind == "node" and (node is None or event["name"] != node):
+            return
+
+        if stage == "start":
+            span = Span(event["name"], kind, node, self.now())
+            self._open[run_id] = span
+            self.spans.append(span)
+        elif stage == "stream" and (span := self._open.get(run_id)):
+            if kind == "model":
+                if span.first_token is None:
+                    span.first_token = self.now() - span.start
+                span.tokens += 1
+        elif stage == "end" and (span := self._open.pop(run_id, None)):
+            span.end = self.now()
+            if kind == "model":
+                usage = getattr(event["data"].get("output"), "usage_metadata", None)
+                if usage:
+                    span.tokens = usage["output_tokens"]
+
+    def output(self):
+        """Note that part of the response was shown"""
+        if self.first_output is None:
+            self.first_output = self.now()
+
+    def finish(self):
+        """End the trace, and any spans left open"""
+        self.total = self.now()
+        for span in self._open.values():
+            span.end = self.total
+        self._open = {}
+
+    def summary(self) -> str:
+        """Summarize the time taken by each node and tool, e.g. agent 620ms · ..."""
+        parts = [
+            f"{span.name} {format_duration(span.duration)}"
+            for span in self.spans
+            if span.kind == "tool" or (span.kind == "node" and span.name != "tools")
+        ]
+        if self.cached:
+            parts.append("cached")
+        if self.cancelled:
+            parts.append("cancelled")
+        if self.first_output is not None:
+            parts.append(f"first token {format_duration(self.first_output)}")
+        parts.append(f"total {format_duration(self.total or self.now())}")
+        return " · ".join(parts)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "timestamp": self.timestamp,
+            "question": self.question,
+            "cached": self.cached,
+            "cancelled": self.cancelled,
+            "first_output": self.first_output,
+            "total": self.total,
+            "spans": [asdict(span) for span in self.spans],
+        }
+
+
+class Tracer:
+    """
+    Trace responses, appending each trace to a JSONL file, and collect the durations
+    of every span across the session for histograms. Traces are written by a
+    background thread, so recording one never blocks the event loop.
+    """
+
+    def __init__(
+        self, path: str | None = None, clock: Callable[[], float] = perf_counter
+    ):
+        self.path = path
+        self.clock = clock
+        self.last: Trace | None = None
+        self.durations: dict[str, list[float]] = defaultdict(list)
+        self.queue: SimpleQueue = SimpleQueue()
+        self.listener: QueueListener | None = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handler = logging.FileHandler(path, encoding="utf-8", delay=True)
+            self.listener = QueueListener(self.queue, handler)
+            self.listener.start()
+            atexit.register(self.close)
+
+    def close(self):
+        """Write any traces still queued, and stop the writer"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener.handlers[0].close()
+            self.listener = None
+
+    def start(self, question: str) -> Trace:
+        """Start tracing a response"""
+        return Trace(question, clock=self.clock)
+
+    def finish(self, trace: Trace):
+        """Finish a trace, and record it"""
+        trace.finish()
+        self.last = trace
+
+        for span in trace.spans:
+            self.durations[f"{span.kind}:{span.name}"].append(span.duration)
+            if span.first_token is not None:
+                self.durations[f"first_token:{span.node}"].append(span.first_token)
+        if trace.first_output is not None:
+            self.durations["first_output"].append(trace.first_output)
+        self.durations["total"].append(trace.total)
+
+        if self.listener is not None:
+            self.queue.put(logging.makeLogRecord({"msg": json.dumps(trace.to_dict())}))
+
+    def histograms(self) -> dict[str, dict[str, Any]]:
+        """Get the count, percentiles and bucket counts of each span's durations"""
+        histograms = {}
+        for name, durations in sorted(self.durations.items()):
+            counts = [0] * len(HISTOGRAM_BUCKETS)
+            for duration in durations:
+                counts[bisect_left(HISTOGRAM_BUCKETS, duration)] += 1
+
+            # Quantiles need at least two values
+            quantiles = statistics.quantiles(
+                durations * 2 if len(durations) == 1 else durations,
+                n=100,
+                method="inclusive",
+            )
+            histograms[name] = {
+                "count": len(durations),
+                "p50": quantiles[49],
+                "p95": quantiles[94],
+                "buckets": dict(zip(map(str, HISTOGRAM_BUCKETS), counts)),
+            }
+        return histograms
+
+    def report(self) -> str:
+        """Describe the last trace, and the session's histograms"""
+        if self.last is None:
+            return "No responses yet."
+
+        lines = [self.last.summary(), ""]
+        for name, histogram in self.histograms().items():
+            counts = list(histogram["buckets"].values())
+            peak = max(counts)
+            bars = "".join(
+                HISTOGRAM_BARS[round(count / peak * (len(HISTOGRAM_BARS) - 1))]
+                for count in counts
+            )
+            lines.append(
+                f"{name:<28} n={histogram['count']:<4} "
+                f"p50 {format_duration(histogram['p50']):>6} "
+                f"p95 {format_duration(histogram['p95']):>6}  {bars}"
+            )
+        return "\n".join(lines)
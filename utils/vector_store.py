@@ -0,0 +1,562 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+from threading import RLock
+from typing import Any, Iterable, Literal
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+INT8_MAX = 127
+SCALE, SQUARED_NORM = 0, 1  # Columns of the stats kept for each row
+COMPACT_RATIO = 2  # Rows are rewritten once there are this many times those kept
+SEARCH_BLOCK_ROWS = 65_536  # Rows scored at a time, to bound the memory used
+SQL_BATCH_SIZE = 500  # IDs looked up at a time, under SQLite's parameter limit
+IVF_ITERATIONS = 10  # Rounds of k-means when partitioning the rows
+IVF_SAMPLE_PER_LIST = 64  # Rows sampled per partition to place the centroids
+IVF_STALE_RATIO = 0.1  # Share of rows added since partitioning before it's redone
+
+Space = Literal["l2", "cosine", "ip"]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store that keeps embeddings in a memory-mapped matrix, with each chunk's
+    text and metadata in a SQLite file beside it, so opening it reads no vectors.
+    Collections are searched by scoring every row against the query, unless they
+    have more than the given number of chunks, when rows are partitioned around
+    centroids and only the partitions nearest the query are searched.
+
+    Rows are only appended, and those deleted or replaced are skipped until there
+    are as many of them as are kept, when the matrix is rewritten. Vectors can be
+    kept as 8-bit integers, each row scaled to fit, in a quarter of the memory.
+    The distance, type and size of the vectors are fixed once the first is added.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        embedding: Embeddings,
+        space: Space = "l2",
+        dtype: Literal["float32", "int8"] = "float32",
+        ivf_min_rows: int = 20_000,
+        ivf_probes: int = 8,
+    ):
+        self.path = path
+        self.embedding = embedding
+        self.ivf_min_rows = ivf_min_rows
+        self.ivf_probes = ivf_probes
+        self.lock = RLock()
+
+        os.makedirs(path, exist_ok=True)
+        self.conn = sqlite3.connect(
+            os.path.join(path, "chunks.sqlite"), check_same_thread=False
+        )
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL UNIQUE,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            """)
+        settings = dict(self.conn.execute("SELECT key, value FROM settings"))
+        self.space: Space = settings.get("space", space)
+        self.dtype = np.dtype(settings.get("dtype", dtype))
+        self.size = int(settings["size"]) if "size" in settings else 0
+
+        # Files are named by generation, which the SQLite file records, so a
+        # rewrite takes effect when it commits
+        self.generation = int(settings.get("generation", 0))
+        self.map_rows()
+        rows = np.fromiter(
+            (row for (row,) in self.conn.execute("SELECT row FROM chunks")), np.int64
+        )
+        self.live = np.zeros(self.rows, dtype=bool)
+        self.live[rows[rows < self.rows]] = True
+        self.partitions = self.load_partitions()
+
+    @staticmethod
+    def stored_count(path: str) -> int:
+        """Count the chunks in a store without opening it"""
+        db_path = os.path.join(path, "chunks.sqlite")
+        if not os.path.exists(db_path):
+            return 0
+        with sqlite3.connect(db_path) as conn:
+            try:
+                return conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            except sqlite3.OperationalError:
+                return 0
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def file_path(self, name: str, generation: int | None = None) -> str:
+        """Get the path of one of the store's files, by default of this generation"""
+        if generation is None:
+            generation = self.generation
+        root, ext = os.path.splitext(name)
+        return os.path.join(self.path, f"{root}.{generation}{ext}")
+
+    def map_rows(self):
+        """Map the vector and stats files into memory, ignoring any partial row"""
+        vectors_path = self.file_path("vectors.bin")
+        stats_path = self.file_path("stats.bin")
+        rows = 0
+        if self.size and os.path.exists(vectors_path) and os.path.exists(stats_path):
+            rows = min(
+                os.path.getsize(vectors_path) // (self.size * self.dtype.itemsize),
+                os.path.getsize(stats_path) // (2 * np.float32().itemsize),
+            )
+
+        self.rows = rows
+        if rows:
+            self.vectors = np.memmap(
+                vectors_path, dtype=self.dtype, mode="r", shape=(rows, self.size)
+            )
+            self.stats = np.memmap(
+                stats_path, dtype=np.float32, mode="r", shape=(rows, 2)
+            )
+        else:
+            self.vectors = np.empty((0, self.size), dtype=self.dtype)
+            self.stats = np.empty((0, 2), dtype=np.float32)
+
+    def save_settings(self, **settings: Any):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            [(key, str(value)) for key, value in settings.items()],
+        )
+
+    def index_settings(self) -> dict[str, str]:
+        """Get the settings the vectors are kept with"""
+        return {"space": self.space, "dtype": self.dtype.name}
+
+    def count(self) -> int:
+        return int(np.count_nonzero(self.live))
+
+    def prepare(self, vectors: np.ndarray) -> np.ndarray:
+        """Scale vectors to unit length if they're compared by angle"""
+        if self.space != "cosine":
+            return vectors
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+    def encode(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Get vectors as they're stored, and the stats of each row"""
+        if self.dtype == np.int8:
+            peaks = np.abs(vectors).max(axis=1)
+            scales = np.where(peaks > 0, peaks / INT8_MAX, 1.0).astype(np.float32)
+            encoded = np.round(vectors / scales[:, np.newaxis]).astype(np.int8)
+        else:
+            scales = np.ones(len(vectors), dtype=np.float32)
+            encoded = vectors.astype(np.float32)
+
+        # Distances are measured to the stored vector, not the original
+        decoded = encoded * scales[:, np.newaxis]
+        squared_norms = (decoded * decoded).sum(axis=1)
+        return encoded, np.column_stack([scales, squared_norms]).astype(np.float32)
+
+    def decode(self, rows: np.ndarray) -> np.ndarray:
+        """Get the vectors of some rows"""
+        return self.vectors[rows].astype(np.float32) * self.stats[rows, SCALE, None]
+
+    def score(
+        self, query: np.ndarray, vectors: np.ndarray, stats: np.ndarray
+    ) -> np.ndarray:
+        """Score rows by similarity to a query, the highest nearest"""
+        dots = (vectors @ query) * stats[:, SCALE]
+        if self.space == "l2":
+            # The query's own length doesn't change the order
+            return 2 * dots - stats[:, SQUARED_NORM]
+        return dots
+
+    def distance(self, query: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        """Get the distances that scores stand for, as Chroma measures them"""
+        if self.space == "l2":
+            return float(query @ query) - scores
+        return 1.0 - scores
+
+    def check_size(self, vectors: np.ndarray, ndim: int):
+        """
+        Raise an error unless vectors are the size of those stored, as they won't be
+        if the embedding model changed. A matrix of them has two dimensions.
+        """
+        if vectors.ndim != ndim or vectors.shape[-1] != self.size:
+            raise ValueError(
+                f"Expected vectors of {self.size} dimensions, got shape "
+                f"{vectors.shape}. Reset the store after changing the embedding model"
+            )
+
+    def upsert_embedded(
+        self,
+        ids: list[str],
+        embeddings: list[list[float]],
+        documents: list[str],
+        metadatas: list[dict],
+    ):
+        """Write embedded chunks, replacing any with the same IDs"""
+        if not ids:
+            return
+
+        with self.lock:
+            vectors = np.asarray(embeddings, dtype=np.float32)
+            if not self.size:
+                self.size = vectors.shape[-1]
+                self.save_settings(
+                    space=self.space, dtype=self.dtype.name, size=self.size
+                )
+                self.map_rows()
+            self.check_size(vectors, 2)
+            encoded, stats = self.encode(self.prepare(vectors))
+
+            # Vectors are written before the rows that point to them, and anything
+            # past the last row, e.g. from a write cut short, is written over
+            start = self.rows
+            for name, data in (("vectors.bin", encoded), ("stats.bin", stats)):
+                with open(self.file_path(name), "ab") as f:
+                    f.truncate(start * data.itemsize * data.shape[1])
+                    f.write(data.tobytes())
+
+            replaced = self.find_rows(ids)
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO chunks (id, row, document, metadata) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET "
+                    "row = excluded.row, document = excluded.document, "
+                    "metadata = excluded.metadata",
+                    [
+                        (id_, start + i, document, json.dumps(metadata or {}))
+                        for i, (id_, document, metadata) in enumerate(
+                            zip(ids, documents, metadatas)
+                        )
+                    ],
+                )
+
+            # An ID given twice is kept at its last row
+            last = {id_: start + i for i, id_ in enumerate(ids)}
+            self.map_rows()
+            live = np.zeros(self.rows, dtype=bool)
+            live[: len(self.live)] = self.live
+            live[list(replaced.values())] = False
+            live[list(last.values())] = True
+            self.live = live
+            self.compact_if_sparse()
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: list[dict] | None = None,
+        *,
+        ids: list[str] | None = None,
+        **kwargs: Any,
+    ) -> list[str]:
+        texts = list(texts)
+        if ids is None:
+            ids = [os.urandom(16).hex() for _ in texts]
+        self.upsert_embedded(
+            ids,
+            self.embedding.embed_documents(texts),
+            texts,
+            metadatas or [{} for _ in texts],
+        )
+        return ids
+
+    def find_rows(self, ids: list[str]) -> dict[str, int]:
+        """Get the rows of the chunks with the given IDs"""
+        rows = {}
+        for start in range(0, len(ids), SQL_BATCH_SIZE):
+            batch = ids[start : start + SQL_BATCH_SIZE]
+            rows.update(
+                self.conn.execute(
+                    "SELECT id, row FROM chunks WHERE id IN "
+                    f"({', '.join('?' * len(batch))})",
+                    batch,
+                )
+            )
+        return rows
+
+    def delete(self, ids: list[str] | None = None, **kwargs: Any) -> bool:
+        """Delete chunks by ID"""
+        if not ids:
+            return False
+
+        with self.lock:
+            rows = self.find_rows(ids)
+            with self.conn:
+                self.conn.executemany(
+                    "DELETE FROM chunks WHERE id = ?", [(id_,) for id_ in rows]
+                )
+            live = self.live.copy()
+            live[list(rows.values())] = False
+            self.live = live
+            self.compact_if_sparse()
+        return True
+
+    def delete_collection(self):
+        """Delete the store's files"""
+        with self.lock:
+            self.conn.close()
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def compact_if_sparse(self):
+        """Rewrite the rows once most of them are deleted"""
+        if self.rows >= COMPACT_RATIO * max(self.count(), 1):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the vectors, leaving out the rows of deleted chunks"""
+        kept = np.flatnonzero(self.live)
+        generation = self.generation + 1
+        for name, data in (("vectors.bin", self.vectors), ("stats.bin", self.stats)):
+            with open(self.file_path(name, generation), "wb") as f:
+                for start in range(0, len(kept), SEARCH_BLOCK_ROWS):
+                    f.write(
+                        np.ascontiguousarray(
+                            data[kept[start : start + SEARCH_BLOCK_ROWS]]
+                        ).tobytes()
+                    )
+
+        # Rows only move down, in order, so each is free by the time it's taken
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE chunks SET row = ? WHERE row = ?",
+                [(new, int(old)) for new, old in enumerate(kept)],
+            )
+            self.save_settings(generation=generation)
+
+        old = self.generation
+        self.generation = generation
+        self.map_rows()
+        self.live = np.ones(self.rows, dtype=bool)
+        self.partitions = None
+        for name in ("vectors.bin", "stats.bin", "partitions.npz"):
+            path = self.file_path(name, old)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def load_partitions(self) -> dict[str, np.ndarray] | None:
+        """Read the partitions of the rows, if they've been made"""
+        path = self.file_path("partitions.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return dict(data)
+
+    def partition(self) -> dict[str, np.ndarray]:
+        """
+        Group the rows around centroids placed by k-means on a sample of them.
+        Returns the centroids, the rows ordered by partition, where each partition
+        starts in that order, and how many rows there were.
+        """
+        rows = np.flatnonzero(self.live)
+        lists = max(int(np.sqrt(len(rows))), 1)
+        rng = np.random.default_rng(0)
+        sample = np.sort(
+            rng.choice(rows, min(len(rows), lists * IVF_SAMPLE_PER_LIST), False)
+        )
+        points = self.decode(sample)
+        centroids = points[rng.choice(len(points), lists, replace=False)]
+        for _ in range(IVF_ITERATIONS):
+            nearest = self.nearest_centroids(points, centroids)
+            for i in range(lists):
+                if np.any(members := nearest == i):
+                    centroids[i] = points[members].mean(axis=0)
+
+        assigned = np.concatenate(
+            [
+                self.nearest_centroids(
+                    self.decode(rows[start : start + SEARCH_BLOCK_ROWS]), centroids
+                )
+                for start in range(0, len(rows), SEARCH_BLOCK_ROWS)
+            ]
+        )
+        order = np.argsort(assigned, kind="stable")
+        partitions = {
+            "centroids": centroids,
+            "rows": rows[order],
+            "starts": np.searchsorted(assigned[order], np.arange(lists + 1)),
+            "indexed": np.array(self.rows),
+        }
+
+        # Written aside and moved into place, so a search never reads half of it
+        path = self.file_path("partitions.npz")
+        with open(f"{path}.tmp", "wb") as f:
+            np.savez(f, **partitions)
+        os.replace(f"{path}.tmp", path)
+        return partitions
+
+    @staticmethod
+    def nearest_centroids(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # Less the points' own lengths, which don't change the order
+        distances = (centroids * centroids).sum(axis=1) - 2 * points @ centroids.T
+        return np.argmin(distances, axis=1)
+
+    def candidates(self, query: np.ndarray, rows: int) -> np.ndarray | None:
+        """
+        Get the rows to score for a query, of the first given number: those in the
+        partitions nearest it and any added since partitioning, or None to score
+        them all. They're in order, so runs of them can be read as one slice.
+        """
+        if not self.ivf_min_rows or self.count() < self.ivf_min_rows:
+            return None
+
+        with self.lock:
+            partitions = self.partitions
+            if partitions is None or self.rows - int(partitions["indexed"]) > (
+                IVF_STALE_RATIO * int(partitions["indexed"])
+            ):
+                partitions = self.partitions = self.partition()
+
+        indexed = int(partitions["indexed"])
+        centroids = partitions["centroids"]
+        probes = min(self.ivf_probes, len(centroids))
+        centroid_stats = np.column_stack(
+            [np.ones(len(centroids)), (centroids * centroids).sum(axis=1)]
+        )
+        nearest = np.argpartition(
+            -self.score(query, centroids, centroid_stats), probes - 1
+        )[:probes]
+        starts = partitions["starts"]
+        found = np.concatenate(
+            [partitions["rows"][starts[i] : starts[i + 1]] for i in nearest]
+            + [np.arange(min(indexed, rows), rows)]
+        )
+
+        # Rows may have been added, and partitioned, since the search began
+        return np.sort(found[found < rows])
+
+    def search(self, embedding: list[float], k: int) -> list[tuple[int, float]]:
+        """Get the rows of the k chunks nearest a vector, and their distances"""
+        query = np.asarray(embedding, dtype=np.float32)
+        if self.size:
+            self.check_size(query, 1)
+        query = self.prepare(query)
+        with self.lock:
+            vectors, stats, live = self.vectors, self.stats, self.live
+        if not len(vectors) or k <= 0:
+            return []
+
+        rows = self.candidates(query, len(live))
+        if rows is None:
+            rows = np.arange(len(vectors))
+        rows = rows[live[rows]]
+
+        best_rows = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(rows), SEARCH_BLOCK_ROWS):
+            block = rows[start : start + SEARCH_BLOCK_ROWS]
+            # Contiguous blocks are read as views, without copying the rows
+            if block[-1] - block[0] == len(block) - 1:
+                span = slice(block[0], block[-1] + 1)
+                scores = self.score(query, vectors[span], stats[span])
+            else:
+                scores = self.score(query, vectors[block], stats[block])
+            best_rows = np.concatenate([best_rows, block])
+            best_scores = np.concatenate([best_scores, scores])
+            if len(best_rows) > k:
+                top = np.argpartition(-best_scores, k - 1)[:k]
+                best_rows, best_scores = best_rows[top], best_scores[top]
+
+        order = np.argsort(-best_scores, kind="stable")
+        distances = self.distance(query, best_scores[order])
+        return list(zip(best_rows[order].tolist(), distances.tolist()))
+
+    def documents_at(self, rows: list[int]) -> dict[int, Document]:
+        """Get the chunks at some rows"""
+        documents = {}
+        for start in range(0, len(rows), SQL_BATCH_SIZE):
+            batch = rows[start : start + SQL_BATCH_SIZE]
+            for id_, row, document, metadata in self.conn.execute(
+                "SELECT id, row, document, metadata FROM chunks WHERE row IN "
+                f"({', '.join('?' * len(batch))})",
+                batch,
+            ):
+                documents[row] = Document(
+                    id=id_, page_content=document, metadata=json.loads(metadata)
+                )
+        return documents
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        while True:
+            generation = self.generation
+            found = self.search(embedding, k)
+            with self.lock:
+                # Rows are renumbered when they're rewritten, so search them again
+                if self.generation == generation:
+                    documents = self.documents_at([row for row, _ in found])
+                    break
+        return [(documents[row], d) for row, d in found if row in documents]
+
+    def similarity_search_by_vector(
+        self, embedding: list[float], k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return [
+            doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding.embed_query(query), k
+        )
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k)
+
+    async def asimilarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> list[Document]:
+        vector = await self.embedding.aembed_query(query)
+        return await asyncio.to_thread(self.similarity_search_by_vector, vector, k)
+
+    def get_by_ids(self, ids: list[str], /) -> list[Document]:
+        with self.lock:
+            rows = self.find_rows(list(ids))
+            documents = self.documents_at(list(rows.values()))
+        return [documents[rows[id_]] for id_ in ids if id_ in rows]
+
+    def get_embeddings(self, ids: list[str]) -> dict[str, list[float]]:
+        """Get the stored vectors of chunks by ID"""
+        with self.lock:
+            rows = self.find_rows(ids)
+            found = list(rows.items())
+            vectors = self.decode(np.array([row for _, row in found], dtype=np.int64))
+        return {id_: vector.tolist() for (id_, _), vector in zip(found, vectors)}
+
+    def scan(self, limit: int, offset: int) -> tuple[list[str], list[str]]:
+        """Get the IDs and text of a page of the chunks"""
+        with self.lock:
+            results = self.conn.execute(
+                "SELECT id, document FROM chunks ORDER BY row LIMIT ? OFFSET ?",
+                (limit, offset),
+            ).fetchall()
+        return [id_ for id_, _ in results], [document for _, document in results]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: list[str],
+        embedding: Embeddings,
+        metadatas: list[dict] | None = None,
+        *,
+        ids: list[str] | None = None,
+        path: str = ".vectors",
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(path, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
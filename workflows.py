@@ -1,32 +1,81 @@
+import os
+from asyncio import CancelledError
+from contextlib import aclosing
 from typing import Callable
 
-from langchain import hub
+import aiosqlite
 from langchain.chat_models import init_chat_model
+from langchain_core.language_models import BaseChatModel
 from langchain_core.messages import (
     AIMessage,
     BaseMessage,
     HumanMessage,
+    RemoveMessage,
     SystemMessage,
     ToolMessage,
 )
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import Tool
 from langchain_core.tools.retriever import create_retriever_tool
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langgraph.graph import END, START, MessagesState, StateGraph
 from langgraph.prebuilt import ToolNode, tools_condition
 
-from rag_store import RagStore
-from tools.dice import DICE_TOOL_NAME, DiceTool
-from utils import Config, Singleton, get_logger
+from rag_store import RagStores, collection_name, query_game
+from tools.dice import (
+    DICE_ODDS_TOOL_NAME,
+    DICE_TOOL_NAME,
+    DiceOddsTool,
+    DiceTool,
+    parse_roll,
+)
+from utils import Config, SemanticCache, Singleton, Tracer, get_logger
+from utils.tracing import Trace
 
 logger = get_logger(__name__)
 
 TEMPERATURE = 0.0
+RAG_PROMPT_PATH = os.path.join(os.path.dirname(__file__), "prompts", "rag.txt")
 
 AGENT_NODE = "agent"
 TOOLS_NODE = "tools"
 GENERATOR_NODE = "generator"
 DICE_NODE = "dice"
 
+# Nodes whose model tokens are streamed to the user as they're generated
+STREAMING_NODES = (AGENT_NODE, GENERATOR_NODE)
+
+
+def load_prompt(path: str | None = None) -> ChatPromptTemplate:
+    """
+    Load the RAG prompt, which takes the question and the retrieved context, after
+    any history of the conversation
+    """
+    with open(path or RAG_PROMPT_PATH, encoding="utf-8") as f:
+        return ChatPromptTemplate.from_messages(
+            [MessagesPlaceholder("history", optional=True), ("human", f.read())]
+        )
+
+
+def get_answer_cache(config: Config, game: str | None = None) -> SemanticCache | None:
+    """
+    Get the cache of answers to previous questions about a game, or about every game,
+    if it's enabled
+    """
+    if config.answer_cache_size <= 0:
+        return None
+
+    name = "answers" if game is None else f"{collection_name(config, game)}.answers"
+    return SemanticCache(
+        os.path.join(config.chroma_path, f"{name}.sqlite"),
+        model=config.embedding_model,
+        threshold=config.answer_cache_threshold,
+        max_entries=config.answer_cache_size,
+    )
+
 
 class DiceMessage(BaseMessage):
     """Dice message"""
@@ -35,30 +84,103 @@ class DiceMessage(BaseMessage):
     type: str = "dice"
 
 
+def uses_dice(messages: list[BaseMessage]) -> bool:
+    """Check whether dice were rolled for a response, which makes it random"""
+    for message in messages:
+        if isinstance(message, DiceMessage):
+            return True
+        if isinstance(message, ToolMessage) and message.name == DICE_TOOL_NAME:
+            return True
+        if isinstance(message, AIMessage) and any(
+            tool_call["name"] == DICE_TOOL_NAME for tool_call in message.tool_calls
+        ):
+            return True
+    return False
+
+
+def split_turn(
+    messages: list[BaseMessage],
+) -> tuple[list[BaseMessage], list[BaseMessage]]:
+    """Split a conversation into the earlier turns and the current one"""
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            return messages[:index], messages[index:]
+    return [], messages
+
+
+def compact_history(messages: list[BaseMessage], max_tokens: int) -> list[BaseMessage]:
+    """
+    Get the earlier turns of a conversation to send with a question: the questions
+    and answers without the tool calls and rules they were based on, as many of the
+    latest as fit in the token budget.
+    """
+    compact: list[BaseMessage] = []
+    for message in messages:
+        if isinstance(message, DiceMessage):
+            compact.append(AIMessage(content=message.content, id=message.id))
+        elif isinstance(message, HumanMessage) or (
+            isinstance(message, AIMessage)
+            and message.content
+            and not message.tool_calls
+        ):
+            compact.append(message)
+
+    return trim_messages(
+        compact,
+        max_tokens=max_tokens,
+        token_counter=count_tokens_approximately,
+        strategy="last",
+        start_on="human",
+    )
+
+
 class LLM(metaclass=Singleton):
     """LLM for game rules lookup"""
 
-    SYSTEM_MESSAGE = "You are a helpful assistant tasked with looking up game rules and rolling dice."
+    SYSTEM_MESSAGE = "You are a helpful assistant tasked with looking up game rules, rolling dice and working out the odds of dice rolls."
     RETRIEVER_MESSAGE = "Search and return information about the role playing game."
 
     agent: StateGraph
 
-    def __init__(self, config: Config, store: RagStore, *args, **kwargs):
-        """Initialize the LLM"""
+    def __init__(
+        self,
+        config: Config,
+        stores: RagStores,
+        *args,
+        chat_model: BaseChatModel | None = None,
+        **kwargs,
+    ):
+        """Initialize the LLM, with the configured chat model unless one is given"""
         super().__init__(*args, **kwargs)
         self.config = config
+        self.stores = stores
+        self.tracer = Tracer(config.trace_path)
+        self.checkpointer: BaseCheckpointSaver | None = None
+        self.run_config: RunnableConfig = {
+            "configurable": {"thread_id": config.session_id}
+        }
+
+        # Answers are kept by the game asked about, and are based on its store, so
+        # they're stale once it changes
+        self.answer_caches: dict[str | None, SemanticCache | None] = {}
+        stores.listeners.append(self.forget_answers)
 
         retriever_tool: Tool = create_retriever_tool(
-            store.retriever, "retrieve_rules", self.RETRIEVER_MESSAGE
+            stores.retriever, "retrieve_rules", self.RETRIEVER_MESSAGE
         )
-        self.tools: list[Tool] = [retriever_tool, DiceTool()]
-        self.model = init_chat_model(
+        self.dice_tool = DiceTool()
+        self.tools: list[Tool] = [retriever_tool, self.dice_tool, DiceOddsTool()]
+
+        # One model, and so one pooled HTTP client, is shared by every node
+        self.chat_model = chat_model or init_chat_model(
             config.chat_model,
             model_provider=config.chat_provider,
             api_key=config.chat_api_key,
             streaming=True,
             temperature=TEMPERATURE,
-        ).bind_tools(self.tools)
+        )
+        self.model = self.chat_model.bind_tools(self.tools)
+        self.rag_chain = load_prompt(config.rag_prompt_path) | self.chat_model
 
     async def initialize_workflow(self) -> None:
         """Initialize the graph workflow"""
@@ -86,50 +208,69 @@ class LLM(metaclass=Singleton):
             },
         )
         workflow.add_edge(GENERATOR_NODE, END)
-        self.agent = workflow.compile()
+
+        # Conversations are kept by session, so questions can follow on
+        if self.config.memory_path is not None and self.checkpointer is None:
+            os.makedirs(os.path.dirname(self.config.memory_path) or ".", exist_ok=True)
+            self.checkpointer = AsyncSqliteSaver(
+                aiosqlite.connect(self.config.memory_path)
+            )
+        self.agent = workflow.compile(checkpointer=self.checkpointer)
+
+    async def close(self) -> None:
+        """Close the conversation memory, and write any traces still queued"""
+        self.tracer.close()
+        if isinstance(self.checkpointer, AsyncSqliteSaver):
+            await self.checkpointer.conn.close()
 
     async def generator_node(
         self, state: MessagesState
     ) -> dict[str, list[dict[str, str]]]:
         """Generate a response based on the original prompt and the retrieved documents"""
 
-        prompt = hub.pull("rlm/rag-prompt")
         messages = state["messages"]
-        question = messages[0].content
+        earlier, turn = split_turn(messages)
+        question = turn[0].content
         last_message = messages[-1]
         docs = last_message.content
 
-        model = init_chat_model(
-            self.config.chat_model,
-            model_provider=self.config.chat_provider,
-            api_key=self.config.chat_api_key,
-            streaming=True,
-            temperature=TEMPERATURE,
+        response = await self.rag_chain.ainvoke(
+            {
+                "context": docs,
+                "question": question,
+                "history": compact_history(earlier, self.config.memory_token_budget),
+            }
         )
 
-        rag_chain = prompt | model
-
-        response = await rag_chain.ainvoke({"context": docs, "question": question})
-
-        logger.debug(f"Response: {response}")
+        logger.debug("Response: %s", response.content)
         return {"messages": [response]}
 
     async def agent_node(self, state: MessagesState):
         """Decides whether to call a tool or not"""
+        earlier, turn = split_turn(state["messages"])
+        history = compact_history(earlier, self.config.memory_token_budget)
         response = await self.model.ainvoke(
-            [SystemMessage(content=self.SYSTEM_MESSAGE)] + state["messages"]
+            [SystemMessage(content=self.SYSTEM_MESSAGE)] + history + turn
         )
-        return {"messages": [response]}
+
+        # What isn't sent is forgotten, so the conversation kept is no bigger
+        kept = {message.id for message in history}
+        forgotten = [
+            RemoveMessage(id=message.id)
+            for message in earlier
+            if message.id is not None and message.id not in kept
+        ]
+        return {"messages": forgotten + [response]}
 
     def tools_response_condition(self, state: MessagesState):
         """Route the tool response to the appropriate node"""
-        logger.debug(f"--- Route tool response: {state} ---")
         last_message = state["messages"][-1]
+        logger.debug("Routing response from tool: %s", last_message.name)
 
-        # Return the response from the dice tool directly
-        if (
-            isinstance(last_message, ToolMessage)
-            and last_message.name == DICE_TOOL_NAME
+        # Return the response from the dice tools directly
+        if isinstance(last_message, ToolMessage) and last_message.name in (
+            DICE_TOOL_NAME,
+            DICE_ODDS_TOOL_NAME,
         ):
             return DICE_NODE
 
@@ -144,25 +285,193 @@ class LLM(metaclass=Singleton):
         """Get the graph of the workflow"""
         return self.agent.get_graph()
 
+    async def conversation(self) -> list[BaseMessage]:
+        """Get the messages of the conversation so far"""
+        if self.checkpointer is None:
+            return []
+        state = await self.agent.aget_state(self.run_config)
+        return state.values.get("messages", [])
+
+    async def remember(self, question: str, answer: str) -> None:
+        """Add a question answered without the workflow to the conversation"""
+        if self.checkpointer is None:
+            return
+        await self.agent.aupdate_state(
+            self.run_config,
+            {"messages": [HumanMessage(content=question), AIMessage(content=answer)]},
+            as_node=GENERATOR_NODE,
+        )
+
+    async def new_conversation(self) -> None:
+        """Forget the session's conversation, so the next question starts a new one"""
+        if self.checkpointer is None:
+            return
+        await self.checkpointer.adelete_thread(self.config.session_id)
+
+    async def prune_conversation(self) -> None:
+        """
+        Delete the session's checkpoints before the latest, and their writes. Each
+        holds the whole conversation, so the rest only record how it got there,
+        and would grow the memory file with every step of every turn.
+        """
+        if not isinstance(self.checkpointer, AsyncSqliteSaver):
+            return
+
+        latest = await self.checkpointer.aget_tuple(self.run_config)
+        if latest is None:
+            return
+
+        thread_id = self.config.session_id
+        checkpoint_id = latest.config["configurable"]["checkpoint_id"]
+        conn = self.checkpointer.conn
+        async with self.checkpointer.lock, conn.cursor() as cur:
+            for table in ("checkpoints", "writes"):
+                await cur.execute(
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_id != ?",
+                    (thread_id, checkpoint_id),
+                )
+            await conn.commit()
+
+    def answer_cache(self, game: str | None) -> SemanticCache | None:
+        """Get the cache of answers about a game, or every game, if it's enabled"""
+        if game not in self.answer_caches:
+            self.answer_caches[game] = get_answer_cache(self.config, game)
+        return self.answer_caches[game]
+
+    def forget_answers(self, game: str | None) -> None:
+        """
+        Clear the answers about a game once its store changes, and those about every
+        game, which may have come from it
+        """
+        for scope in {game, None}:
+            if (cache := self.answer_cache(scope)) is not None:
+                cache.clear()
+
+    async def embed_question(
+        self, text: str, cache: SemanticCache | None
+    ) -> list[float] | None:
+        """
+        Embed a question for the answer cache. Returns None if the cache is disabled
+        or the embedder is unavailable.
+        """
+        if cache is None:
+            return None
+
+        try:
+            return await self.stores.embedder.aembed_query(text)
+        except Exception as e:
+            logger.warning("Failed to embed question for the answer cache: %s", e)
+            return None
+
     async def stream_response(
         self, user_input: str, update_func: Callable[[str], None]
     ) -> None:
-        """Takes user input and streams the response using the update function"""
+        """
+        Takes user input and streams the response using the update function. Input
+        starting with "@game" only searches that game's rules.
+        """
+        trace = self.tracer.start(user_input)
+
+        def traced_update(text: str) -> None:
+            trace.output()
+            update_func(text)
+
+        game, question = self.stores.split_game(user_input)
+        token = query_game.set(game)
+        try:
+            await self.respond(question, traced_update, trace)
+            await self.prune_conversation()
+        except CancelledError:
+            trace.cancelled = True
+            raise
+        finally:
+            query_game.reset(token)
+            self.tracer.finish(trace)
+            logger.debug("Trace: %s", trace.summary())
+
+    async def respond(
+        self, user_input: str, update_func: Callable[[str], None], trace: Trace
+    ) -> None:
+        """Stream the response to user input, timing its nodes in the trace"""
+        # Roll dice expressions straight away, without asking the model
+        if (roller := parse_roll(user_input)) is not None:
+            logger.debug("Rolling without the model: %s", roller)
+            answer = self.dice_tool.formatted(roller.roll())
+            update_func(answer)
+            await self.remember(user_input, answer)
+            return
+
+        # Only the first question of a conversation is answered from the cache, or
+        # has its answer cached, since the rest can depend on what came before
+        first_question = not await self.conversation()
+        answer_cache = (
+            self.answer_cache(self.stores.scope()) if first_question else None
+        )
+        vector = await self.embed_question(user_input, answer_cache)
+        if vector is not None and (answer := await answer_cache.alookup(vector)):
+            logger.debug("Answered from cache: %s", user_input)
+            trace.cached = True
+            update_func(answer)
+            await self.remember(user_input, answer)
+            return
+
         response = ""
-        async for event in self.agent.astream_events(
-            {"messages": [HumanMessage(content=user_input)]}
+        streamed = ""
+        messages: list[BaseMessage] = []
+
+        # Closing the stream when cancelled stops the nodes, and the model's request
+        async with aclosing(
+            self.agent.astream_events(
+                {"messages": [HumanMessage(content=user_input)]}, config=self.run_config
+            )
+        ) as events:
+            async for event in events:
+                trace.observe(event)
+                if event["event"] in ("on_chat_model_start", "on_chat_model_stream"):
+                    node = event.get("metadata", {}).get("langgraph_node")
+                    if node not in STREAMING_NODES:
+                        continue
+
+                    # Each model call replaces what the previous one streamed
+                    if event["event"] == "on_chat_model_start":
+                        streamed = ""
+                        continue
+
+                    # Tool calls are the agent's routing decisions, not the answer
+                    chunk = event["data"]["chunk"]
+                    if chunk.tool_call_chunks or not (text := chunk.text()):
+                        continue
+
+                    streamed += text
+                    update_func(response + streamed)
+                    continue
+
+                if event["event"] != "on_chain_end" or event["name"] != "LangGraph":
+                    continue
+
+                messages = event["data"]["output"]["messages"]
+
+                # Get the last message
+                last_message = messages[-1]
+                logger.debug(
+                    "Output %d messages, the last a %s",
+                    len(messages),
+                    type(last_message).__name__,
+                )
+
+                # If the last message is an AIMessage or DiceMessage, replace the
+                # streamed tokens with it
+                streamed = ""
+                if isinstance(last_message, (AIMessage, DiceMessage)):
+                    response += last_message.content
+                    update_func(response)
+
+        # Cache answers, but never dice rolls
+        if (
+            vector is not None
+            and messages
+            and isinstance(messages[-1], AIMessage)
+            and messages[-1].content
+            and not uses_dice(split_turn(messages)[1])
         ):
-            if event["event"] != "on_chain_end" or event["name"] != "LangGraph":
-                continue
-
-            messages = event["data"]["output"]["messages"]
-
-            logger.debug(f"Event Output Messages: {messages}")
-
-            # Get the last message
-            last_message = messages[-1]
-
-            # If the last message is an AIMessage or DiceMessage, add it to the response
-            if isinstance(last_message, (AIMessage, DiceMessage)):
-                response += last_message.content
-                update_func(response)
+            await answer_cache.aadd(user_input, vector, messages[-1].content)